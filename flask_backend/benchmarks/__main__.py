@@ -0,0 +1,72 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from . import compare
+
+# Benchmark suite command line
+# python -m flask_backend.benchmarks run --sizes 1k,10k --output results.json
+# python -m flask_backend.benchmarks run --sizes 10k --compare baseline.json
+# python -m flask_backend.benchmarks compare baseline.json results.json
+# Generated catalogs are cached in --data-dir. Rows go through the same triggers as the app's own
+# writes, so the first 100k run spends about a minute generating and 1m about 15 minutes (2.5 GB).
+# compare (and run --compare) exit with status 1 when a benchmark regressed.
+
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), "recipeapp-benchmarks")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m flask_backend.benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="generate the catalogs and time the benchmarks")
+    run_parser.add_argument("--sizes", default="1k,10k", help="comma separated: 1k, 10k, 100k, 1m or recipe counts")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--repeat", type=int, default=20, help="timed runs per benchmark (at most)")
+    run_parser.add_argument("--only", help="comma separated benchmark names, e.g. micro/get_recipe")
+    run_parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="where generated catalogs are cached")
+    run_parser.add_argument("--output", help="results file, benchmark-<time>.json by default")
+    run_parser.add_argument("--compare", help="results file to compare against")
+
+    for command in (run_parser, commands.add_parser("compare", help="compare two results files")):
+        command.add_argument("--threshold", type=float, default=0.2,
+                             help="slowdown (fraction of the baseline timing) counted as a regression")
+        command.add_argument("--min-delta-ms", type=float, default=0.5,
+                             help="slowdowns smaller than this are never counted as regressions")
+        command.add_argument("--stat", default="median_ms", choices=compare.STATS,
+                             help="timing statistic to compare")
+    compare_parser = commands.choices["compare"]
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        # Importing the backend opens (and migrates) PANTRY_DB_PATH, point it away from the real pantry
+        os.makedirs(args.data_dir, exist_ok=True)
+        os.environ["PANTRY_DB_PATH"] = os.path.join(args.data_dir, "scratch.db")
+        from . import suite
+
+        results = suite.run(args.sizes.split(","), args.data_dir, seed=args.seed, repeat=args.repeat,
+                            only=set(args.only.split(",")) if args.only else None)
+        output = args.output or f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        with open(output, "w") as file:
+            json.dump(results, file, indent=2)
+        print(f"Saved results to {output}")
+        if not args.compare:
+            return 0
+        baseline_path, current = args.compare, results
+    else:
+        baseline_path = args.baseline
+        with open(args.current) as file:
+            current = json.load(file)
+
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    rows = compare.compare(baseline, current, threshold=args.threshold, min_delta_ms=args.min_delta_ms,
+                           stat=args.stat)
+    print(compare.format_report(rows))
+    return 1 if any(row["status"] == "regression" for row in rows) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+# Compares two benchmark results files (see suite.run) benchmark by benchmark
+# A benchmark regressed when it got slower by more than threshold (a fraction, 0.2 = 20%) and by
+# more than min_delta_ms, so sub-millisecond noise on fast benchmarks is not flagged.
+
+# Statistics of the timing summaries that can be compared
+STATS = ("median_ms", "min_ms", "p95_ms", "mean_ms")
+
+# Compares the sizes both files have
+# Returns List[Dict[size, name, baseline_ms, current_ms, ratio, status]] where status is one of
+# regression, improvement, same, new (only in current) or missing (only in baseline)
+def compare(baseline, current, threshold=0.2, min_delta_ms=0.5, stat="median_ms"):
+    rows = []
+    for size in [size for size in baseline["sizes"] if size in current["sizes"]]:
+        before = baseline["sizes"][size]["benchmarks"]
+        after = current["sizes"][size]["benchmarks"]
+        for name in list(before) + [name for name in after if name not in before]:
+            old = before[name][stat] if name in before else None
+            new = after[name][stat] if name in after else None
+            if old is None or new is None:
+                status, ratio = "new" if old is None else "missing", None
+            else:
+                ratio = new / old if old else None
+                if new - old > min_delta_ms and new > old * (1 + threshold):
+                    status = "regression"
+                elif old - new > min_delta_ms and old > new * (1 + threshold):
+                    status = "improvement"
+                else:
+                    status = "same"
+            rows.append({"size": size, "name": name, "baseline_ms": old, "current_ms": new,
+                         "ratio": None if ratio is None else round(ratio, 3), "status": status})
+    return rows
+
+def _milliseconds(value):
+    return "-" if value is None else f"{value:.3f}"
+
+# Text table of the compare() rows, regressions marked with !
+def format_report(rows):
+    lines = [f"{'size':>8}  {'benchmark':<40} {'baseline ms':>12} {'current ms':>12} {'ratio':>7}  status"]
+    for row in rows:
+        marker = "!" if row["status"] == "regression" else " "
+        ratio = "-" if row["ratio"] is None else f"{row['ratio']:.2f}x"
+        lines.append(f"{row['size']:>8}  {row['name']:<40} {_milliseconds(row['baseline_ms']):>12} "
+                     f"{_milliseconds(row['current_ms']):>12} {ratio:>7} {marker}{row['status']}")
+    regressions = sum(1 for row in rows if row["status"] == "regression")
+    lines.append(f"{regressions} regression(s), "
+                 f"{sum(1 for row in rows if row['status'] == 'improvement')} improvement(s)")
+    return "\n".join(lines)
@@ -0,0 +1,137 @@
+import os
+import random
+import time
+from ..src import database
+from ..src import recipe_interface
+
+# Deterministic synthetic catalog for the benchmarks
+# The same (recipes, seed) always produces the same rows, so results from different runs and
+# machines are comparable. Bump GENERATOR_VERSION whenever the output changes, it is part of the
+# cached file name.
+GENERATOR_VERSION = 1
+
+# Named sizes accepted on the command line
+SIZES = {"1k": 1_000, "10k": 10_000, "100k": 100_000, "1m": 1_000_000}
+
+# Timestamps are generated around this fixed time and shifted to the present by rebase_pantry
+BASE_TIME = 1_700_000_000
+SECONDS_PER_DAY = 86400
+
+# (family, unit of the ingredient, units recipes use for it, density range in g per ml)
+FAMILIES = (
+    ("mass", "g", ("g", "oz", "lb"), None),
+    ("volume", "ml", ("ml", "tsp.", "tbsp.", "cup(s)"), (0.6, 1.4)),
+    ("count", "piece(s)", ("piece(s)",), None),
+)
+# Typical recipe quantity range per recipe unit
+QUANTITIES = {"g": (5, 500), "oz": (1, 16), "lb": (0.25, 3), "ml": (5, 750), "tsp.": (0.25, 3),
+              "tbsp.": (0.5, 4), "cup(s)": (0.25, 3), "piece(s)": (1, 6)}
+
+MEAL_TYPES = ("Breakfast", "Lunch", "Dinner", "Snack")
+MEAL_WEIGHTS = (2, 3, 4, 1)
+WORDS = ("chop", "slice", "dice", "mince", "stir", "whisk", "simmer", "boil", "bake", "roast", "fry",
+         "saute", "season", "garlic", "onion", "golden", "tender", "crispy", "until", "minutes", "pan",
+         "oven", "bowl", "heat", "medium", "low", "high", "serve", "warm", "fresh", "sauce", "toss")
+ADJECTIVES = ("Smoky", "Spicy", "Creamy", "Zesty", "Rustic", "Crispy", "Hearty", "Tangy", "Sweet", "Herbed")
+DISHES = ("Stew", "Salad", "Bowl", "Curry", "Pasta", "Soup", "Tacos", "Bake", "Stir Fry", "Skillet")
+
+# Catalog shape for a number of recipes: a few hundred ingredients for a small catalog growing to
+# a few thousand, recipes of 3 to 15 ingredients (9 on average) drawn from a Zipf-like popularity
+# (salt-like staples appear in many recipes, most ingredients in few), and a household sized pantry
+def shape(recipes):
+    return {
+        "ingredients": min(5000, max(300, recipes // 20)),
+        "pantry": min(300, 50 + recipes // 100),
+    }
+
+# Path of the generated database for (recipes, seed) in data_dir
+def database_path(data_dir, recipes, seed):
+    return os.path.join(data_dir, f"recipes-{recipes}-seed{seed}-v{GENERATOR_VERSION}.db")
+
+# Creates the database for (recipes, seed) in data_dir unless it already exists
+# The backend is pointed at the new file while it is written (database.set_database_path) and
+# back at its previous database afterwards
+# Returns the path
+def generate(data_dir, recipes, seed=0, batch_size=10_000):
+    path = database_path(data_dir, recipes, seed)
+    if os.path.exists(path):
+        return path
+    os.makedirs(data_dir, exist_ok=True)
+    # Written under a temporary name so an interrupted run does not leave a partial catalog behind
+    partial = path + ".partial"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(partial + suffix):
+            os.remove(partial + suffix)
+
+    rng = random.Random(seed)
+    size = shape(recipes)
+    original_path = database.DB_PATH
+    database.set_database_path(partial)
+    try:
+        recipe_interface.create_tables()
+        recipe_interface.init_units()
+        conn = recipe_interface.open_db()
+
+        ingredients = []
+        for i in range(size["ingredients"]):
+            _, unit, recipe_units, densities = FAMILIES[rng.choices((0, 1, 2), (5, 3, 2))[0]]
+            density = round(rng.uniform(*densities), 3) if densities else None
+            ingredients.append((f"Ingredient {i:05d}", unit, recipe_units, density, rng.choice((None, 3, 7, 14, 30))))
+        conn.executemany("""INSERT INTO ingredients (name, serving_size, unit_of_measurement, calories, protein,
+                            total_fat, shelf_life, density) VALUES (?, 100, ?, ?, ?, ?, ?, ?)""",
+                         [(name, unit, round(rng.uniform(0, 600), 1), round(rng.uniform(0, 30), 1),
+                           round(rng.uniform(0, 40), 1), shelf_life, density)
+                          for name, unit, _, density, shelf_life in ingredients])
+
+        # Popularity of ingredient i is proportional to 1 / (i + 1)
+        cumulative, total = [], 0.0
+        for i in range(len(ingredients)):
+            total += 1.0 / (i + 1)
+            cumulative.append(total)
+
+        for start in range(0, recipes, batch_size):
+            recipe_rows, ingredient_rows = [], []
+            for i in range(start, min(start + batch_size, recipes)):
+                fan_out = min(15, max(3, round(rng.gauss(9, 3))))
+                chosen = set()
+                while len(chosen) < fan_out:
+                    chosen.add(rng.choices(range(len(ingredients)), cum_weights=cumulative)[0])
+                chosen = sorted(chosen)
+                name = f"{rng.choice(ADJECTIVES)} {rng.choice(DISHES)} {i}"
+                instructions = " ".join(rng.choice(WORDS) for _ in range(rng.randint(20, 60)))
+                recipe_rows.append((name, rng.choices(MEAL_TYPES, MEAL_WEIGHTS)[0], rng.randint(0, 60),
+                                    rng.randint(0, 120), instructions, rng.randint(1, 8)))
+                for position in chosen:
+                    unit = rng.choice(ingredients[position][2])
+                    low, high = QUANTITIES[unit]
+                    ingredient_rows.append((name, ingredients[position][0], round(rng.uniform(low, high), 2), unit))
+            conn.executemany("""INSERT INTO recipes (name, meal_type, prep_time, cook_time, instructions, servings)
+                                VALUES (?, ?, ?, ?, ?, ?)""", recipe_rows)
+            conn.executemany("""INSERT INTO recipe_ingredients (recipe_name, ingredient_name, quantity, unit_of_measurement)
+                                VALUES (?, ?, ?, ?)""", ingredient_rows)
+            conn.commit()
+
+        # Lots of the popular ingredients, bought over the last month, some already expired
+        lots = []
+        for i in range(size["pantry"]):
+            name, unit, _, _, _ = ingredients[rng.choices(range(len(ingredients)), cum_weights=cumulative)[0]]
+            purchased = BASE_TIME if i == 0 else BASE_TIME - rng.randint(0, 30 * SECONDS_PER_DAY)
+            expiry = None if rng.random() < 0.2 else purchased + rng.randint(2, 40) * SECONDS_PER_DAY
+            low, high = QUANTITIES[unit]
+            lots.append((name, round(rng.uniform(low, high) * 4, 2), purchased, expiry))
+        conn.executemany("INSERT INTO pantry (ingredient_name, quantity, purchase_date, expiry_date) VALUES (?, ?, ?, ?)", lots)
+        conn.commit()
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        database.set_database_path(original_path)
+    os.replace(partial, path)
+    return path
+
+# Shifts the pantry dates so the most recent purchase is now, keeping expiry dates relative to it
+def rebase_pantry(conn, now=None):
+    now = round(time.time()) if now is None else now
+    conn.execute("""UPDATE pantry SET purchase_date = purchase_date + s.shift, expiry_date = expiry_date + s.shift
+                    FROM (SELECT ? - MAX(purchase_date) AS shift FROM pantry) AS s""", (now,))
+    conn.commit()
+    database.bump_generation()
@@ -0,0 +1,195 @@
+import gc
+import platform
+import sqlite3
+import statistics
+import subprocess
+import time
+import numpy as np
+from ..src import database
+from ..src import ingredient_index
+from ..src import meal_plan
+from ..src import recipe_interface
+from ..src import response_cache
+from . import datagen
+
+# Format version of the results file
+RESULTS_VERSION = 1
+
+# Each benchmark runs once untimed (to warm the in-process indexes and caches), then up to repeat
+# times, stopping early once it has used TIME_BUDGET seconds and run at least MIN_RUNS times
+MIN_RUNS = 3
+TIME_BUDGET = 5.0
+
+# Ingredients per recipe in the add_recipe benchmark, whose recipes are removed again afterwards so
+# the cached database files stay as generated
+ADD_RECIPE_INGREDIENTS = 9
+
+# Timing summary of runs (seconds) in milliseconds
+def summarize(runs):
+    ordered = sorted(runs)
+    return {
+        "runs": len(runs),
+        "min_ms": round(ordered[0] * 1000, 4),
+        "median_ms": round(statistics.median(ordered) * 1000, 4),
+        # Nearest rank
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000, 4),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+    }
+
+# Times fn, calling setup (untimed) before every run
+# The garbage collector is paused while timing, as in timeit, so collections triggered by earlier
+# benchmarks do not land in this one's runs
+def measure(fn, repeat, setup=None):
+    if setup:
+        setup()
+    fn()
+    runs = []
+    collecting = gc.isenabled()
+    gc.collect()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        while len(runs) < repeat and (len(runs) < MIN_RUNS or time.perf_counter() - started < TIME_BUDGET):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            fn()
+            runs.append(time.perf_counter() - start)
+    finally:
+        if collecting:
+            gc.enable()
+    return summarize(runs)
+
+# Arguments for the benchmarks, read from the generated catalog: a recipe from the middle of the
+# catalog, the two most used ingredients and the ingredients of the recipes add_recipe adds
+def _fixtures(conn):
+    recipes = conn.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
+    name = conn.execute("SELECT name FROM recipes ORDER BY id LIMIT 1 OFFSET ?", (recipes // 2,)).fetchone()[0]
+    popular = [row[0] for row in conn.execute("""SELECT ingredient_name FROM recipe_ingredients
+                                                 GROUP BY ingredient_name ORDER BY COUNT(*) DESC LIMIT 2""")]
+    ingredients = [(row[0], 1, row[1]) for row in conn.execute(
+        "SELECT name, unit_of_measurement FROM ingredients ORDER BY id LIMIT ?", (ADD_RECIPE_INGREDIENTS,))]
+    return {"recipe": name, "url_recipe": name.replace(" ", "_").lower(), "popular": popular,
+            "url_popular": ",".join(ingredient.replace(" ", "_").lower() for ingredient in popular),
+            "ingredients": ingredients, "recipes": recipes}
+
+# recipe_interface (and meal_plan) functions, called directly
+def micro_benchmarks(fixtures):
+    popular = [ingredient.lower() for ingredient in fixtures["popular"]]
+    return {
+        "get_recipe": lambda: recipe_interface.get_recipe(fixtures["recipe"]),
+        "filter_recipes_meal_type": lambda: recipe_interface.filter_recipes(meal_type="dinner", prep_time=(0, 20), limit=50),
+        "filter_recipes_ingredients": lambda: recipe_interface.filter_recipes(ingredients=popular, limit=50),
+        "filter_recipes_available": lambda: recipe_interface.filter_recipes(ingredients_available=True, limit=50),
+        "filter_recipes_coverage": lambda: recipe_interface.filter_recipes(sort="coverage", limit=20),
+        "filter_recipes_calories": lambda: recipe_interface.filter_recipes(calories=(200, 600), limit=50),
+        "filter_recipes_page": lambda: recipe_interface.filter_recipes(limit=500),
+        "search_recipes": lambda: recipe_interface.search_recipes("garlic simmer", limit=20),
+        "get_expiring": lambda: recipe_interface.get_expiring(7),
+        "recommend_expiring": lambda: recipe_interface.recommend_expiring(7, 10),
+        "plan_meals": lambda: meal_plan.plan_meals(7),
+    }
+
+# Endpoints through the Flask test client
+# The response cache is cleared before every run, except for the *_cached benchmarks
+def endpoint_benchmarks(fixtures, client):
+    def get(url):
+        def run():
+            response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f"GET {url} answered {response.status_code}")
+        return run
+
+    return {
+        "recipe": get(f"/api/recipes/{fixtures['url_recipe']}"),
+        "recipe_cached": get(f"/api/recipes/{fixtures['url_recipe']}"),
+        "recipes_meal_type": get("/api/recipes/?meal_type=dinner&prep_time=0,20&limit=50"),
+        "recipes_ingredients": get(f"/api/recipes/?ingredients={fixtures['url_popular']}&limit=50"),
+        "recipes_coverage": get("/api/recipes/?sort=coverage&limit=20"),
+        "recipes_page": get("/api/recipes/?limit=500"),
+        "recipes_search": get("/api/recipes/search?q=garlic_simmer"),
+        "expiring": get("/api/expiring/7"),
+        "recommendations": get("/api/recommendations?days=7&limit=10"),
+        "meal_plan": get("/api/meal_plan?days=7"),
+    }
+
+# Times add_recipe on fresh names, then removes the recipes it added
+def _add_recipe_benchmark(fixtures, repeat):
+    added = []
+    ingredients = fixtures["ingredients"]
+
+    def add():
+        name = f"Benchmark Recipe {len(added)}"
+        added.append(name)
+        if not recipe_interface.add_recipe(name, "Mix everything", ingredients, meal_type="Dinner",
+                                           prep_time=10, cook_time=20, servings=2):
+            raise RuntimeError(f"Failed to add {name}")
+
+    try:
+        return measure(add, repeat)
+    finally:
+        for name in added:
+            recipe_interface.remove_recipe(name)
+
+# Versions of what the timings depend on
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "numpy": np.__version__,
+            "platform": platform.platform(), "processor": platform.processor(), "commit": commit or None}
+
+# Generates (or reuses) the catalog of recipes in data_dir and runs every benchmark against it
+# only: benchmark names (e.g. "micro/get_recipe") to run, all if None
+# The backend is pointed back at its previous database afterwards
+# Returns Dict[generate_seconds, recipes, recipe_ingredients, pantry, benchmarks:Dict[name, timing summary]]
+def run_size(recipes, data_dir, seed=0, repeat=20, only=None, log=print):
+    from ..src.app import app
+
+    original_path = database.DB_PATH
+    try:
+        start = time.perf_counter()
+        path = datagen.generate(data_dir, recipes, seed)
+        result = {"generate_seconds": round(time.perf_counter() - start, 3)}
+        database.set_database_path(path)
+        conn = database.get_connection()
+        datagen.rebase_pantry(conn)
+        # Built up front rather than in the background on first use, so no timing races the build
+        ingredient_index.get_index().build(conn)
+        fixtures = _fixtures(conn)
+        result["recipes"] = fixtures["recipes"]
+        result["recipe_ingredients"] = conn.execute("SELECT COUNT(*) FROM recipe_ingredients").fetchone()[0]
+        result["pantry"] = conn.execute("SELECT COUNT(*) FROM pantry").fetchone()[0]
+
+        benchmarks = {}
+
+        def record(key, timing):
+            benchmarks[key] = timing
+            log(f"{recipes:>8} {key:<40} median {timing['median_ms']:>10.3f} ms")
+
+        with app.test_client() as client:
+            suites = [("micro", micro_benchmarks(fixtures), None),
+                      ("endpoint", endpoint_benchmarks(fixtures, client), response_cache.CACHE.clear)]
+            for group, functions, setup in suites:
+                for name, fn in functions.items():
+                    if not only or f"{group}/{name}" in only:
+                        record(f"{group}/{name}", measure(fn, repeat, None if name.endswith("_cached") else setup))
+            # Writes last, they invalidate the in-process indexes the reads warmed up
+            if not only or "micro/add_recipe" in only:
+                record("micro/add_recipe", _add_recipe_benchmark(fixtures, repeat))
+        result["benchmarks"] = benchmarks
+    finally:
+        database.set_database_path(original_path)
+    return result
+
+# Runs the benchmarks for every size, see run_size
+# sizes: names from datagen.SIZES or recipe counts
+def run(sizes, data_dir, seed=0, repeat=20, only=None, log=print):
+    results = {"version": RESULTS_VERSION, "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+               "environment": environment(), "seed": seed, "repeat": repeat,
+               "generator_version": datagen.GENERATOR_VERSION, "sizes": {}}
+    for size in sizes:
+        recipes = datagen.SIZES.get(str(size).lower()) or int(size)
+        results["sizes"][str(size)] = run_size(recipes, data_dir, seed, repeat, only, log)
+    return results
@@ -1,11 +1,25 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 from . import recipe_interface
+from . import catalog
+from . import coverage
 from . import llm_interface
+from . import llm_cache
+from . import bulk_import
+from . import generation_jobs
+from . import ingredient_index
+from . import ingredient_search
+from . import json_extract
+from . import meal_plan
+from . import metrics
+from . import response_cache
+from . import prompt_builder
+import io
+import json
 import sys
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Next-After", "X-Next-Offset", "ETag"])
 
 # Convert URL safe-string to normal string:
 # Replace _ with spaces,
@@ -13,6 +27,21 @@ CORS(app)
 def normalized_string(str):
     return str.replace("_", " ").lower()
 
+# Request metrics (see metrics.py): latency, status and the SQLite queries of each request, per route
+# Recorded on teardown, so a streamed response is timed until its last chunk has been sent
+@app.before_request
+def start_request_metrics():
+    metrics.start_request(request.url_rule.rule if request.url_rule else "unmatched")
+
+@app.after_request
+def remember_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    metrics.finish_request(request.method, 500 if error is not None else g.get("response_status", 500))
+
 # add ingredient type
 @app.route('/api/ingredient_post', methods=['POST'])
 def add_ingredient():
@@ -30,10 +59,15 @@ def add_ingredient():
         protein = data.get("protein")
         cost = data.get("cost")
         shelf_life = data.get("shelf_life")
+        density = data.get("density")
+        
+        if not catalog.get_snapshot().has_unit(unit_of_measurement):
+            return jsonify({"error": f"Unknown unit {unit_of_measurement}"}), 400
         
         success = recipe_interface.insert_ingredient(name, serving_size, unit_of_measurement, calories=calories, 
                                                      total_fat=total_fat, sodium=sodium, total_carbohydrate=total_carbohydrate, 
-                                                     total_sugars=total_sugars, protein=protein, cost=cost, shelf_life=shelf_life)
+                                                     total_sugars=total_sugars, protein=protein, cost=cost, shelf_life=shelf_life,
+                                                     density=density)
         if success:
             return (jsonify({"message": "Ingredient added"}), 200)
         else:
@@ -41,6 +75,26 @@ def add_ingredient():
     else:
         return jsonify({"error": "Invalid request method"}), 405
     
+# bulk import ingredient types from a CSV or JSONL file
+# Send the file as multipart field "file" or as the raw request body
+# Format is taken from ?format=csv|jsonl, otherwise from the file name or content type
+# e.g. curl -F file=@nutrition.csv http://localhost:5000/api/ingredients/import
+@app.route('/api/ingredients/import', methods=['POST'])
+def import_ingredients():
+    upload = request.files.get("file")
+    fmt = bulk_import.detect_format(request.args.get("format"),
+                                    filename=upload.filename if upload else None,
+                                    content_type=upload.content_type if upload else request.content_type)
+    if not fmt:
+        return jsonify({"error": "Unknown import format, use format=csv or format=jsonl"}), 400
+    
+    try:
+        stream = io.TextIOWrapper(upload.stream if upload else request.stream, encoding="utf-8", newline="")
+        result = bulk_import.import_ingredients(bulk_import.read_rows(stream, fmt))
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
 # add ingredient to pantry
 @app.route('/api/pantry_post', methods=['POST'])
 def add_ingredient_to_pantry():
@@ -51,8 +105,13 @@ def add_ingredient_to_pantry():
         quantity = data.get("quantity")
         purchase_date = data.get("purchase_date")
         expiry_date = data.get("expiry_date")
+        unit_of_measurement = data.get("unit_of_measurement")
+        
+        if unit_of_measurement is not None and not catalog.get_snapshot().has_unit(unit_of_measurement):
+            return jsonify({"error": f"Unknown unit {unit_of_measurement}"}), 400
         
-        success = recipe_interface.add_to_pantry(ingredient_name, quantity, purchase_date=purchase_date, expiry_date=expiry_date)
+        success = recipe_interface.add_to_pantry(ingredient_name, quantity, purchase_date=purchase_date, expiry_date=expiry_date,
+                                                 unit_of_measurement=unit_of_measurement)
         
         if success:
                 return (jsonify({"message": "Ingredient added to pantry"}), 200)
@@ -75,6 +134,11 @@ def add_recipe():
         cook_time = data.get("cook_time")
         servings = data.get("servings")
         
+        snapshot = catalog.get_snapshot()
+        for ingredient in ingredients:
+            if not isinstance(ingredient, (list, tuple)) or len(ingredient) != 3 or not snapshot.has_unit(ingredient[2]):
+                return jsonify({"error": f"Invalid ingredient {ingredient}, expected [name, quantity, known unit]"}), 400
+        
         success = recipe_interface.add_recipe(recipe_name, instructions, ingredients, meal_type=meal_type, 
                                               prep_time=prep_time, cook_time=cook_time, servings=servings)
         
@@ -85,10 +149,46 @@ def add_recipe():
     else:
         return jsonify({"error": "Invalid request method"}), 405
 
+# bulk import recipes from a JSONL file, one /api/recipe_post body per line
+# Send the file as multipart field "file" or as the raw request body
+# e.g. curl --data-binary @recipes.jsonl http://localhost:5000/api/recipes/import
+@app.route('/api/recipes/import', methods=['POST'])
+def import_recipes():
+    upload = request.files.get("file")
+    try:
+        stream = io.TextIOWrapper(upload.stream if upload else request.stream, encoding="utf-8")
+        result = bulk_import.import_recipes(bulk_import.read_rows(stream, "jsonl"))
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# autocomplete ingredient names: prefix matches on any word, then fuzzy (typo tolerant) matches
+# e.g. /api/ingredients/search?q=parm&limit=5
+# Until the search index has been built (in the background) only names starting with q are found
+@app.route("/api/ingredients/search")
+def search_ingredients():
+    try:
+        query = normalized_string(request.args.get("q", ""))
+        limit = min(request.args.get("limit", 10, type=int), 50)
+        index = ingredient_search.get_index(build=False)
+        if not index.warm:
+            index.build_async()
+            return jsonify(recipe_interface.search_ingredient_names(query, limit)), 200
+        return jsonify(index.search(query, limit)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# The GET endpoints below are served from response_cache until a write changes the data
+# (results that depend on expiry dates also expire after a minute)
+
 # get ingredient type from pantry by:
 @app.route("/api/ingredients/<ingredient_name>")
+@response_cache.cached()
 def get_ingredient(ingredient_name):
     try:
+        # Names missing from the catalog (snapshot and database) are answered without reading the row
+        if catalog.get_snapshot().ingredient(normalized_string(ingredient_name)) is None:
+            return jsonify(None)
         ingredient = recipe_interface.get_ingredient(normalized_string(ingredient_name))
         return jsonify(ingredient)
     except Exception as e:
@@ -96,16 +196,58 @@ def get_ingredient(ingredient_name):
 
 # get recipe by name (use normalized recipe name)
 @app.route("/api/recipes/<recipe_name>")
+@response_cache.cached()
 def get_recipe(recipe_name):
     try:
+        if not catalog.get_snapshot().has_recipe(normalized_string(recipe_name)):
+            return jsonify({"recipe": None, "ingredients": [], "nutrition": None}), 200
         recipe = recipe_interface.get_recipe(normalized_string(recipe_name))
         return jsonify(recipe), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+# full-text search over recipe names and instructions, best matches first
+# e.g. /api/recipes/search?q=garlic_pasta&meal_type=dinner&prep_time=0,20&limit=20&offset=0
+# Takes the same filters as /api/recipes/; the X-Next-Offset header holds the offset of the next page
+@app.route("/api/recipes/search")
+@response_cache.cached(ttl=60, unordered_args=("ingredients",))
+def search_recipes():
+    try:
+        query = normalized_string(request.args.get("q", ""))
+        ingredients = request.args.get("ingredients")
+        ingredients = [normalized_string(ingredient) for ingredient in ingredients.split(',')] if ingredients else None
+        meal_type = request.args.get("meal_type")
+        meal_type = normalized_string(meal_type) if meal_type else None
+        prep_time = request.args.get("prep_time")
+        prep_time = prep_time.split(',') if prep_time else None
+        cook_time = request.args.get("cook_time")
+        cook_time = cook_time.split(',') if cook_time else None
+        available = request.args.get("available") == "true"
+        limit = min(request.args.get("limit", 20, type=int), 100)
+        offset = request.args.get("offset", 0, type=int)
+
+        results = recipe_interface.search_recipes(query, prep_time=prep_time, cook_time=cook_time,
+                                                  ingredients=ingredients, meal_type=meal_type,
+                                                  ingredients_available=available, offset=offset, limit=limit)
+        if results is None:
+            return jsonify({"error": "Search failed"}), 500
+        response = jsonify(results)
+        if len(results) == limit:
+            response.headers["X-Next-Offset"] = str(offset + limit)
+        return response, 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    
 # query recipes by preptime, required ingredients and whether or not ingredients are available in pantry
 # e.g. /api/recipes/?ingredients=garlic,olive_oil&prep_time=0,20&available=true&meal_type=lunch
+# calories=<min>,<max> and protein=<min>,<max> filter on nutrition per serving
+# Keyset pagination: limit=<page size>&after=<last recipe id seen>
+# The X-Next-After header holds the cursor for the next page (absent on the last page)
+# format=ndjson streams one JSON recipe per line as rows are read instead of building one array
+# max_missing=<k> keeps recipes with at most k ingredients missing from the pantry,
+# sort=coverage orders by the share of ingredients already in the pantry (best first)
 @app.route("/api/recipes/")
+@response_cache.cached(ttl=60, unordered_args=("ingredients",))
 def get_filtered_recipes():
     try:
         ingredients = request.args.get("ingredients")
@@ -116,33 +258,146 @@ def get_filtered_recipes():
         prep_time = prep_time.split(',') if prep_time else None
         cook_time = request.args.get("cook_time")
         cook_time = cook_time.split(',') if cook_time else None
+        calories = request.args.get("calories")
+        calories = calories.split(',') if calories else None
+        protein = request.args.get("protein")
+        protein = protein.split(',') if protein else None
         available = request.args.get("available") == "true"
+        limit = request.args.get("limit", type=int)
+        after = request.args.get("after", type=int)
+        max_missing = request.args.get("max_missing", type=int)
+        sort = request.args.get("sort")
+        if sort not in (None, "id", "coverage"):
+            return jsonify({"error": "sort must be id or coverage"}), 400
+        if max_missing is not None and max_missing < 0:
+            return jsonify({"error": "max_missing must be 0 or more"}), 400
+        filters = dict(prep_time=prep_time, cook_time=cook_time, ingredients=ingredients, meal_type=meal_type,
+                       ingredients_available=available, after=after, limit=limit, max_missing=max_missing, sort=sort,
+                       calories=calories, protein=protein)
         
-        filtered_recipes = recipe_interface.filter_recipes(prep_time=prep_time, cook_time=cook_time, ingredients=ingredients, meal_type=meal_type, ingredients_available=available)
+        if request.args.get("format") == "ndjson":
+            recipes = recipe_interface.iter_filtered_recipes(**filters)
+
+            def generate():
+                try:
+                    for recipe in recipes:
+                        yield json.dumps(recipe) + "\n"
+                except Exception as e:
+                    print(f"Failed to stream recipes: ", e)
+
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+        filtered_recipes = recipe_interface.filter_recipes(**filters)
         
-        return jsonify(filtered_recipes), 200
+        response = jsonify(filtered_recipes)
+        if limit and filtered_recipes and len(filtered_recipes) == limit:
+            response.headers["X-Next-After"] = str(filtered_recipes[-1]["recipe"]["id"])
+        return response, 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# cook a recipe: deduct its ingredients from the pantry, earliest expiring lots first
+# Responds 200 with the lots used, 409 with the missing ingredients (nothing is deducted), 404 for an unknown recipe
+@app.route("/api/recipes/<recipe_name>/cook", methods=['POST'])
+def cook_recipe(recipe_name):
+    try:
+        if not catalog.get_snapshot().has_recipe(normalized_string(recipe_name)):
+            return jsonify({"error": "Recipe not found"}), 404
+        result = recipe_interface.cook_recipe(normalized_string(recipe_name))
+        if result is None:
+            return jsonify({"error": "Failed to cook recipe"}), 500
+        return jsonify(result), 200 if result["cooked"] else 409
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 # Generate recipes using LLM
+# The generation runs on a background worker; responds 202 with a job id to poll at
+# /api/generate_recipe/<job_id>, or 503 when too many generations are already queued
 @app.route("/api/generate_recipe", methods=['POST'])
 def generate_recipe():
     try:
         data = request.get_json()
         ingredients = data.get("ingredients", [])
         preference = data.get("preference", None)
-        user_question = ", ".join(ingredients)
-        # LLM call
-        llm_response = llm_interface.get_recipe_from_user(user_question, preference)
-        print(llm_response)
-        llm_interface.add_parsed_recipe_from_text(llm_response)
-        return jsonify({"message": "Recipe generated and saved"}), 200
+        job_id = generation_jobs.QUEUE.submit(ingredients, preference)
+        return jsonify({"job_id": job_id, "status": generation_jobs.QUEUED}), 202
+    except generation_jobs.QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         print(e)
         return jsonify({"error": str(e)}), 500
 
+# Generate a recipe and stream the LLM output as it is produced (Server-Sent Events)
+# GET (for EventSource): /api/generate_recipe/stream?ingredients=eggs,cheese&preference=italian
+# POST: same JSON body as /api/generate_recipe
+# Events: "token" with {"text": ...} per chunk, then "done" with {"recipe_name": ...} once the
+# recipe has been parsed and saved, or "error" with {"error": ...}
+# If the LLM repeats an existing recipe, "retry" is sent and the tokens of a new attempt follow
+@app.route("/api/generate_recipe/stream", methods=['GET', 'POST'])
+def stream_generated_recipe():
+    if request.method == 'POST':
+        data = request.get_json()
+        ingredients = data.get("ingredients", [])
+        preference = data.get("preference", None)
+    else:
+        ingredients = request.args.get("ingredients", "")
+        ingredients = [ingredient for ingredient in ingredients.split(',') if ingredient]
+        preference = request.args.get("preference")
+    user_question = ", ".join(ingredients)
+
+    def event(name, data):
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+
+    def generate():
+        exclude = []
+        try:
+            # A repeated request replays the generation it saved before as a single token
+            saved = llm_interface.get_saved_generation(user_question, preference)
+            if saved is not None:
+                yield event("token", {"text": saved[0]})
+                yield event("done", {"recipe_name": saved[1]})
+                return
+            for _ in range(llm_interface.DUPLICATE_RETRIES + 1):
+                # The recipe JSON is located while the tokens arrive
+                extractor = json_extract.JSONObjectExtractor()
+                parts = []
+                for text in llm_interface.stream_recipe_from_user(user_question, preference, exclude):
+                    extractor.feed(text)
+                    parts.append(text)
+                    yield event("token", {"text": text})
+                recipe_data = extractor.finish()
+                if recipe_data is None:
+                    raise ValueError("No JSON recipe found in the LLM response")
+                duplicate = llm_interface.find_existing_title(recipe_data)
+                if duplicate is None:
+                    recipe_name = llm_interface.add_parsed_recipe(recipe_data)
+                    llm_interface.remember_generation(user_question, preference, "".join(parts))
+                    yield event("done", {"recipe_name": recipe_name})
+                    return
+                exclude.append(duplicate)
+                yield event("retry", {"error": f"Generated recipe {duplicate} already exists"})
+            yield event("error", {"error": f"Generated recipe {duplicate} already exists"})
+        except Exception as e:
+            print(e)
+            yield event("error", {"error": str(e)})
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop reverse proxies from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+# Status of a recipe generation job: queued, running, done (with recipe_name) or failed (with error)
+@app.route("/api/generate_recipe/<job_id>")
+def get_generation_job(job_id):
+    job = generation_jobs.QUEUE.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
+
 # get expiring ingredients
 @app.route("/api/expiring/<days>")
+@response_cache.cached(ttl=60)
 def get_expiring(days):
     try:
         ingredients = recipe_interface.get_expiring(int(days))
@@ -152,6 +407,7 @@ def get_expiring(days):
     
 # get expired ingredients
 @app.route("/api/expired")
+@response_cache.cached(ttl=60)
 def get_expired():
     try:
         ingredients = recipe_interface.get_expired()
@@ -159,5 +415,65 @@ def get_expired():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# recommend recipes that use up pantry ingredients expiring soon, most urgent first
+# e.g. /api/recommendations?days=7&limit=10
+@app.route("/api/recommendations")
+@response_cache.cached(ttl=60)
+def recommend_recipes():
+    try:
+        days = request.args.get("days", 7, type=int)
+        limit = min(request.args.get("limit", 10, type=int), 100)
+        recommendations = recipe_interface.recommend_expiring(days, limit)
+        if recommendations is None:
+            return jsonify({"error": "Failed to recommend recipes"}), 500
+        return jsonify(recommendations), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# plan meals for the next days that use up expiring pantry stock and need little that is not in the pantry
+# e.g. /api/meal_plan?days=7&meals=breakfast,lunch,dinner&prep_time=0,20&cook_time=0,60
+# Every meal gets a different recipe of that meal type; a meal with no such recipe has recipe null
+@app.route("/api/meal_plan")
+@response_cache.cached(ttl=60)
+def get_meal_plan():
+    try:
+        days = request.args.get("days", 7, type=int)
+        if days < 1 or days > meal_plan.MAX_DAYS:
+            return jsonify({"error": f"days must be between 1 and {meal_plan.MAX_DAYS}"}), 400
+        meals = request.args.get("meals")
+        meals = [normalized_string(meal) for meal in meals.split(',') if meal] if meals else list(meal_plan.DEFAULT_MEALS)
+        if not meals:
+            return jsonify({"error": "meals must name at least one meal type"}), 400
+        prep_time = request.args.get("prep_time")
+        prep_time = prep_time.split(',') if prep_time else None
+        cook_time = request.args.get("cook_time")
+        cook_time = cook_time.split(',') if cook_time else None
+        plan = meal_plan.plan_meals(days, meals, prep_time=prep_time, cook_time=cook_time)
+        if plan is None:
+            return jsonify({"error": "Failed to plan meals"}), 500
+        return jsonify(plan), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+# cache and index statistics
+@app.route("/api/stats")
+def get_stats():
+    return jsonify({
+        "llm_cache": llm_cache.stats(),
+        "response_cache": response_cache.CACHE.stats(),
+        "ingredient_index": ingredient_index.get_index().stats(),
+        "ingredient_search": ingredient_search.get_index(build=False).stats(),
+        "prompt": prompt_builder.stats(),
+        "catalog": catalog.get_snapshot().stats(),
+        "coverage": coverage.get_matrix().stats(),
+        "meal_plan": meal_plan.get_table().stats(),
+        "metrics": metrics.stats(),
+    }), 200
+
+# request, query and LLM call metrics in the Prometheus text format
+@app.route("/metrics")
+def get_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
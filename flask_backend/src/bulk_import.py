@@ -0,0 +1,274 @@
+import csv
+import json
+import sqlite3
+from . import catalog
+from . import coverage
+from . import database
+from . import ingredient_index
+from . import ingredient_search
+from . import meal_plan
+from . import recipe_interface
+
+# Rows are inserted with executemany and committed in chunks of this many rows
+CHUNK_SIZE = 5000
+
+# Only the first errors are returned in full, the rest are just counted
+MAX_REPORTED_ERRORS = 1000
+
+INGREDIENT_FIELDS = ("name", "serving_size", "unit_of_measurement", "calories", "total_fat", "sodium",
+                     "total_carbohydrate", "total_sugars", "protein", "cost", "shelf_life", "density")
+NUTRITION_FIELDS = ("calories", "total_fat", "sodium", "total_carbohydrate", "total_sugars", "protein", "cost")
+
+# Returns "csv" or "jsonl" for an explicit format, file name or content type (None if unknown)
+def detect_format(fmt=None, filename=None, content_type=None):
+    if fmt:
+        fmt = fmt.lower()
+        return fmt if fmt in ("csv", "jsonl") else None
+    if filename:
+        if filename.lower().endswith(".csv"):
+            return "csv"
+        if filename.lower().endswith((".jsonl", ".ndjson")):
+            return "jsonl"
+    if content_type:
+        if "csv" in content_type:
+            return "csv"
+        if "ndjson" in content_type or "jsonl" in content_type:
+            return "jsonl"
+    return None
+
+# Reads a CSV (with a header row) or JSONL text stream lazily
+# Yields (line number, row dict, error message) where row is None if the line could not be parsed
+def read_rows(stream, fmt):
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row, None
+    else:
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as error:
+                yield line_number, None, f"Invalid JSON: {error}"
+                continue
+            if not isinstance(row, dict):
+                yield line_number, None, "Expected a JSON object"
+                continue
+            yield line_number, row, None
+
+# Converts an optional numeric field (CSV gives "" for missing values)
+def _optional_number(value, cast=float):
+    if value is None or value == "":
+        return None
+    return cast(value)
+
+# Validates one ingredient row against the known units
+# Returns the tuple of INGREDIENT_FIELDS to insert, raises ValueError describing the problem
+def _ingredient_values(row, units):
+    name = row.get("name")
+    name = name.strip() if isinstance(name, str) else None
+    if not name:
+        raise ValueError("Missing name")
+    try:
+        serving_size = float(row.get("serving_size"))
+    except (TypeError, ValueError):
+        raise ValueError("serving_size must be a number")
+    unit = row.get("unit_of_measurement")
+    if unit not in units:
+        raise ValueError(f"Unknown unit {unit!r}")
+    values = [name, serving_size, unit]
+    for field in NUTRITION_FIELDS:
+        try:
+            values.append(_optional_number(row.get(field)))
+        except (TypeError, ValueError):
+            raise ValueError(f"{field} must be a number")
+    try:
+        values.append(_optional_number(row.get("shelf_life"), int))
+    except (TypeError, ValueError):
+        raise ValueError("shelf_life must be an integer")
+    try:
+        values.append(_optional_number(row.get("density")))
+    except (TypeError, ValueError):
+        raise ValueError("density must be a number")
+    return tuple(values)
+
+# Bulk loads ingredients from an iterable of rows (see read_rows)
+# Rows are validated against a single lookup of the units table and inserted with executemany,
+# one transaction per CHUNK_SIZE rows. Invalid rows and names that already exist are reported
+# without aborting the rest of the import.
+# Returns Dict[inserted:int, error_count:int, errors:List[Dict[line, name, error]]]
+def import_ingredients(rows, chunk_size=CHUNK_SIZE):
+    conn = recipe_interface.open_db()
+    c = conn.cursor()
+    units = {row["unit"] for row in c.execute("SELECT unit FROM units")}
+    result = {"inserted": 0, "error_count": 0, "errors": []}
+    seen = set()
+
+    def error(line, name, message):
+        result["error_count"] += 1
+        if len(result["errors"]) < MAX_REPORTED_ERRORS:
+            result["errors"].append({"line": line, "name": name, "error": message})
+
+    def flush(chunk):
+        # Names already in the ingredients table
+        c.execute("SELECT name FROM ingredients WHERE name IN (SELECT value FROM json_each(?))",
+                  (json.dumps([values[0] for _, values in chunk]),))
+        existing = {row["name"] for row in c.fetchall()}
+        for line, values in chunk:
+            if values[0] in existing:
+                error(line, values[0], "Ingredient already exists")
+        chunk = [(line, values) for line, values in chunk if values[0] not in existing]
+
+        placeholders = ", ".join("?" * len(INGREDIENT_FIELDS))
+        insert = f"INSERT INTO ingredients ({', '.join(INGREDIENT_FIELDS)}) VALUES ({placeholders})"
+        try:
+            c.executemany(insert, [values for _, values in chunk])
+            conn.commit()
+            inserted = [values[0] for _, values in chunk]
+        except sqlite3.Error:
+            # Something unexpected failed, retry row by row to find which rows
+            conn.rollback()
+            inserted = []
+            for line, values in chunk:
+                try:
+                    c.execute(insert, values)
+                    inserted.append(values[0])
+                except sqlite3.Error as row_error:
+                    error(line, values[0], str(row_error))
+            conn.commit()
+        result["inserted"] += len(inserted)
+        database.bump_generation()
+        catalog.add_ingredients(inserted)
+        ingredient_search.get_index(build=False).add(inserted)
+
+    chunk = []
+    for line, row, parse_error in rows:
+        if parse_error:
+            error(line, None, parse_error)
+            continue
+        try:
+            values = _ingredient_values(row, units)
+        except ValueError as validation_error:
+            error(line, row.get("name"), str(validation_error))
+            continue
+        if values[0] in seen:
+            error(line, values[0], "Duplicate name in import")
+            continue
+        seen.add(values[0])
+        chunk.append((line, values))
+        if len(chunk) >= chunk_size:
+            flush(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk)
+    return result
+
+# Validates one recipe row (same fields as /api/recipe_post)
+# ingredient_names maps lowercase ingredient name -> name in the ingredients table
+# Returns (recipe values, [(ingredient name, quantity, unit)]), raises ValueError describing the problem
+def _recipe_values(row, ingredient_names, units):
+    name = row.get("recipe_name")
+    name = name.strip() if isinstance(name, str) else None
+    if not name:
+        raise ValueError("Missing recipe_name")
+    instructions = row.get("instructions")
+    if isinstance(instructions, list):
+        instructions = "\n".join(str(step) for step in instructions)
+    if not instructions:
+        raise ValueError("Missing instructions")
+    try:
+        prep_time = _optional_number(row.get("prep_time"), int)
+        cook_time = _optional_number(row.get("cook_time"), int)
+        servings = _optional_number(row.get("servings"), int) or 1
+    except (TypeError, ValueError):
+        raise ValueError("prep_time, cook_time and servings must be integers")
+
+    ingredients = []
+    if not isinstance(row.get("ingredients") or [], list):
+        raise ValueError("ingredients must be a list of [name, quantity, unit]")
+    for ingredient in row.get("ingredients") or []:
+        try:
+            ingredient_name, quantity, unit = ingredient
+            quantity = float(quantity)
+        except (TypeError, ValueError):
+            raise ValueError(f"Ingredients must be [name, quantity, unit], got {ingredient!r}")
+        if not isinstance(ingredient_name, str) or ingredient_name.lower() not in ingredient_names:
+            raise ValueError(f"Ingredient {ingredient_name} not found")
+        if unit not in units:
+            raise ValueError(f"Unknown unit {unit!r}")
+        ingredients.append((ingredient_names[ingredient_name.lower()], quantity, unit))
+    return (name, row.get("meal_type"), prep_time, cook_time, instructions, servings), ingredients
+
+# Bulk loads recipes from an iterable of rows (see read_rows), each shaped like a /api/recipe_post body
+# For every batch of recipes, all ingredient names are resolved with one query, then each recipe and its
+# ingredients are inserted inside a savepoint, so a failing recipe leaves no partial rows behind.
+# Each batch is committed as one transaction.
+# Returns Dict[inserted:int, error_count:int, errors:List[Dict[line, name, error]]]
+def import_recipes(rows, batch_size=500):
+    conn = recipe_interface.open_db()
+    c = conn.cursor()
+    units = {row["unit"] for row in c.execute("SELECT unit FROM units")}
+    result = {"inserted": 0, "error_count": 0, "errors": []}
+
+    def error(line, name, message):
+        result["error_count"] += 1
+        if len(result["errors"]) < MAX_REPORTED_ERRORS:
+            result["errors"].append({"line": line, "name": name, "error": message})
+
+    def flush(batch):
+        # Resolve every ingredient used by the batch in one query
+        keys = {ingredient[0].lower() for _, row in batch if isinstance(row.get("ingredients"), list)
+                for ingredient in row["ingredients"]
+                if isinstance(ingredient, (list, tuple)) and ingredient and isinstance(ingredient[0], str)}
+        c.execute("SELECT name FROM ingredients WHERE LOWER(name) IN (SELECT value FROM json_each(?))",
+                  (json.dumps(sorted(keys)),))
+        ingredient_names = {row["name"].lower(): row["name"] for row in c.fetchall()}
+
+        inserted = []
+        if conn.in_transaction:
+            conn.commit()
+        c.execute("BEGIN")
+        for line, row in batch:
+            try:
+                recipe, ingredients = _recipe_values(row, ingredient_names, units)
+            except ValueError as validation_error:
+                error(line, row.get("recipe_name"), str(validation_error))
+                continue
+            c.execute("SAVEPOINT import_recipe")
+            try:
+                c.execute("""INSERT INTO recipes (name, meal_type, prep_time, cook_time, instructions, servings)
+                            VALUES (?, ?, ?, ?, ?, ?)""", recipe)
+                recipe_id = c.lastrowid
+                c.executemany("""INSERT INTO recipe_ingredients (recipe_name, ingredient_name, quantity, unit_of_measurement)
+                                VALUES (?, ?, ?, ?)""", [(recipe[0],) + ingredient for ingredient in ingredients])
+                c.execute("RELEASE import_recipe")
+                inserted.append((recipe_id, recipe[0], [ingredient[0] for ingredient in ingredients]))
+            except sqlite3.Error as insert_error:
+                c.execute("ROLLBACK TO import_recipe")
+                c.execute("RELEASE import_recipe")
+                error(line, recipe[0], str(insert_error))
+        conn.commit()
+        database.bump_generation()
+
+        result["inserted"] += len(inserted)
+        index = ingredient_index.get_index()
+        for recipe_id, _, names in inserted:
+            index.add_recipe(recipe_id, names)
+        catalog.add_recipes([name for _, name, _ in inserted])
+        if inserted:
+            coverage.get_matrix().invalidate()
+            meal_plan.get_table().add_recipes(conn, [recipe_id for recipe_id, _, _ in inserted])
+
+    batch = []
+    for line, row, parse_error in rows:
+        if parse_error:
+            error(line, None, parse_error)
+            continue
+        batch.append((line, row))
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return result
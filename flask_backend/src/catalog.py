@@ -0,0 +1,136 @@
+import sqlite3
+import threading
+from types import MappingProxyType
+from . import database
+
+# In-process snapshot of the catalog: ingredient names, units and recipe names
+# Built with three queries on first use and then kept up to date in place: the functions at the
+# bottom of this module are called after every committed ingredient, unit or recipe write, so
+# pantry writes (which bump the data generation) never throw it away. Each update bumps the
+# snapshot's version.
+# Writes made by another process are not seen, so a name missing from the snapshot is looked up
+# in the database before it is reported as unknown (and added if found).
+class CatalogSnapshot:
+    def __init__(self, ingredient_names, units, recipe_names):
+        self.version = 0
+        # Canonical ingredient names in insertion (id) order
+        self.ingredient_names = list(ingredient_names)
+        # Lowercase ingredient name -> canonical name
+        self._ingredients = {name.lower(): name for name in self.ingredient_names}
+        self.ingredients = MappingProxyType(self._ingredients)
+        self.units = tuple(units)
+        self.unit_set = frozenset(self.units)
+        # Lowercase recipe names
+        self.recipes = {name.lower() for name in recipe_names}
+        self._lock = threading.Lock()
+
+    # Returns the canonical spelling of an ingredient name (any case), or None if it is not in the catalog
+    def ingredient(self, name):
+        key = str(name).lower()
+        canonical = self._ingredients.get(key)
+        if canonical is None:
+            canonical = _lookup("SELECT name FROM ingredients WHERE LOWER(name) = ?", key)
+            if canonical is not None:
+                self.add_ingredients([canonical])
+        return canonical
+
+    def has_recipe(self, name):
+        key = str(name).lower()
+        if key in self.recipes:
+            return True
+        if _lookup("SELECT name FROM recipes WHERE LOWER(name) = ?", key) is None:
+            return False
+        self.add_recipes([key])
+        return True
+
+    def has_unit(self, unit):
+        return unit in self.unit_set or _lookup("SELECT unit FROM units WHERE unit = ?", unit) is not None
+
+    def add_ingredients(self, names):
+        with self._lock:
+            for name in names:
+                if name.lower() not in self._ingredients:
+                    self._ingredients[name.lower()] = name
+                    self.ingredient_names.append(name)
+            self.version += 1
+
+    def remove_ingredient(self, name):
+        with self._lock:
+            canonical = self._ingredients.pop(str(name).lower(), None)
+            if canonical is not None:
+                self.ingredient_names.remove(canonical)
+            self.version += 1
+
+    def add_recipes(self, names):
+        with self._lock:
+            self.recipes.update(str(name).lower() for name in names)
+            self.version += 1
+
+    def remove_recipe(self, name):
+        with self._lock:
+            self.recipes.discard(str(name).lower())
+            self.version += 1
+
+    def stats(self):
+        return {"version": self.version, "ingredients": len(self.ingredient_names),
+                "units": len(self.units), "recipes": len(self.recipes)}
+
+    # Reads the catalog over conn
+    @classmethod
+    def load(cls, conn):
+        return cls([row[0] for row in conn.execute("SELECT name FROM ingredients ORDER BY id")],
+                   [row[0] for row in conn.execute("SELECT unit FROM units ORDER BY id")],
+                   [row[0] for row in conn.execute("SELECT name FROM recipes")])
+
+# Database fallback for names missing from a snapshot, returns the first column of the first row or None
+def _lookup(sql, value):
+    try:
+        row = database.get_connection().execute(sql, (value,)).fetchone()
+    except sqlite3.Error as error:
+        print(f"Failed to look up {value} in the catalog: ", error)
+        return None
+    return row[0] if row else None
+
+_snapshots = {}
+# Held while a snapshot loads and while one is updated, so an update made during a load is
+# applied to the loaded snapshot
+_lock = threading.Lock()
+
+# Returns the snapshot for the current database file, loading it on first use
+def get_snapshot():
+    path = database.DB_PATH
+    snapshot = _snapshots.get(path)
+    if snapshot is not None:
+        return snapshot
+    with _lock:
+        snapshot = _snapshots.get(path)
+        if snapshot is None:
+            snapshot = CatalogSnapshot.load(database.get_connection())
+            _snapshots[path] = snapshot
+        return snapshot
+
+# Applies fn to the current database file's snapshot, if it has been loaded
+def _update(fn):
+    with _lock:
+        snapshot = _snapshots.get(database.DB_PATH)
+        if snapshot is not None:
+            fn(snapshot)
+
+# Records committed catalog writes
+def add_ingredients(names):
+    _update(lambda snapshot: snapshot.add_ingredients(names))
+
+def remove_ingredient(name):
+    _update(lambda snapshot: snapshot.remove_ingredient(name))
+
+def add_recipes(names):
+    _update(lambda snapshot: snapshot.add_recipes(names))
+
+def remove_recipe(name):
+    _update(lambda snapshot: snapshot.remove_recipe(name))
+
+# Drops the current database file's snapshot (e.g. after the units or the schema changed), the
+# next get_snapshot() loads it again
+def invalidate():
+    with _lock:
+        _snapshots.pop(database.DB_PATH, None)
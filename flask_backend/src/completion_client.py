@@ -0,0 +1,176 @@
+import json
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from . import metrics
+
+# Statuses worth retrying: rate limiting and upstream/server errors
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class CompletionError(Exception):
+    """Raised when the completion API cannot produce a response."""
+
+
+class CircuitOpenError(CompletionError):
+    """Raised without contacting the API while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Fails fast while the upstream API is down.
+
+    After `failure_threshold` consecutive failed calls the breaker opens and rejects calls for
+    `reset_timeout` seconds. Then a single trial call is let through (half-open): success closes
+    the breaker, failure opens it again.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        # Thread running the half-open trial call
+        self._trial_thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return "open"
+            return "half_open"
+
+    def allow(self):
+        """
+        Returns:
+            bool: Whether a call may go ahead now.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            self._trial_thread = threading.get_ident()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+            self._trial_thread = None
+
+    def release_trial(self):
+        """Ends the calling thread's half-open trial if it neither succeeded nor failed (no-op otherwise)."""
+        with self._lock:
+            if self._trial_thread == threading.get_ident():
+                self._trial_running = False
+                self._trial_thread = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            self._trial_thread = None
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class CompletionClient:
+    """
+    Shared HTTP client for the chat completions API.
+
+    Keeps a pooled keep-alive `requests.Session`, so calls reuse TCP/TLS connections, and applies
+    connect/read timeouts to every request. Connection errors, timeouts and 429/5xx responses are
+    retried up to `max_retries` times with full-jitter exponential backoff (honouring a numeric
+    Retry-After). Calls that still fail count towards the circuit breaker. The latency of every
+    call, retries included, is recorded in metrics.
+    """
+
+    def __init__(self, connect_timeout=None, read_timeout=None, max_retries=None, backoff_base=0.5,
+                 backoff_max=8.0, pool_size=10, breaker=None):
+        self.connect_timeout = connect_timeout if connect_timeout is not None else float(os.getenv("LLM_CONNECT_TIMEOUT", 5))
+        self.read_timeout = read_timeout if read_timeout is not None else float(os.getenv("LLM_READ_TIMEOUT", 60))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_MAX_RETRIES", 2))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker(int(os.getenv("LLM_BREAKER_THRESHOLD", 5)),
+                                                 float(os.getenv("LLM_BREAKER_RESET", 30)))
+        self.session = requests.Session()
+        # Retries are handled here, not by urllib3, so they go through the backoff and breaker
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def _backoff(self, attempt, response=None):
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(self.backoff_max, float(retry_after)))
+        time.sleep(delay)
+
+    def post(self, url, payload, headers=None, stream=False):
+        """
+        Sends a completion request.
+
+        Args:
+            url (str): The chat completions endpoint.
+            payload (dict): The JSON request body.
+            headers (dict, optional): Extra request headers (e.g. Authorization).
+            stream (bool): Whether to stream the response body.
+
+        Returns:
+            requests.Response: A 200 response. Close it (or use it as a context manager) when streaming.
+
+        Raises:
+            CircuitOpenError: If the breaker is open.
+            CompletionError: If the API returned a non-retryable error or retries were exhausted.
+        """
+        start = time.perf_counter()
+        if not self.breaker.allow():
+            metrics.record_llm_call(time.perf_counter() - start, stream, "circuit_open")
+            raise CircuitOpenError("Completion API unavailable, circuit breaker is open")
+        try:
+            response = self._post(url, payload, headers, stream)
+        except BaseException:
+            # Whatever went wrong, a half-open trial must not stay claimed or allow() never lets a call through again
+            self.breaker.release_trial()
+            metrics.record_llm_call(time.perf_counter() - start, stream, "error")
+            raise
+        metrics.record_llm_call(time.perf_counter() - start, stream, "ok")
+        return response
+
+    def _post(self, url, payload, headers, stream):
+        data = json.dumps(payload)
+        headers = {"Content-Type": "application/json", **(headers or {})}
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self.session.post(url, headers=headers, data=data, stream=stream,
+                                             timeout=(self.connect_timeout, self.read_timeout))
+            except requests.RequestException as e:
+                # Connection errors and timeouts, but also broken chunked bodies, redirect loops...
+                error = CompletionError(f"Request to completion API failed: {e}")
+            else:
+                if response.status_code == 200:
+                    self.breaker.record_success()
+                    return response
+                error = CompletionError(f"Received status code {response.status_code}: {response.text[:500]}")
+                response.close()
+                if response.status_code not in RETRY_STATUSES:
+                    # The API is up but rejected the request (bad key, bad payload...), retrying won't help
+                    self.breaker.record_success()
+                    raise error
+            if attempt < self.max_retries:
+                self._backoff(attempt, response)
+
+        self.breaker.record_failure()
+        raise error
@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import threading
+from . import metrics
+from . import migrations
+
+# Path to the pantry database (relative to the repository root)
+# Can be overridden with the PANTRY_DB_PATH environment variable or set_database_path()
+DB_PATH = os.getenv("PANTRY_DB_PATH", "flask_backend/pantry.db")
+
+# Applied once when a connection is opened instead of before every query
+# journal_mode=WAL: readers don't block the writer and vice versa
+# synchronous=NORMAL: safe with WAL, avoids an fsync on every commit
+# busy_timeout: wait for locks held by other threads/processes instead of failing straight away
+# mmap_size / cache_size: keep hot pages in memory (cache_size is negative -> KiB)
+PRAGMAS = (
+    "PRAGMA foreign_keys = 1",
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA busy_timeout = 5000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA cache_size = -20000",
+)
+
+# One connection per thread (Flask serves each request on a single thread)
+_local = threading.local()
+
+# Data generation, bumped after every committed write
+# In-process caches remember the generation they were filled at and refresh once it moves on.
+# Writes made by other processes are not counted, so caches shared with other workers need a TTL too.
+_generation = 0
+_generation_lock = threading.Lock()
+
+# Database files already brought up to the current schema version by this process
+_migrated = set()
+_migrate_lock = threading.Lock()
+
+# Opens a new configured connection to the database at path
+# Its queries are timed and counted by metrics (see metrics.Connection)
+def connect(path=None):
+    conn = sqlite3.connect(path or DB_PATH, factory=metrics.Connection)
+    # Returns queries as Row objects (similar to dictionary)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+# Returns the calling thread's long-lived connection, opening it on first use
+# Callers must not close it. Commit on success and rollback on failure instead.
+def get_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.path == DB_PATH:
+        return conn
+    if conn is not None:
+        conn.close()
+    _local.conn = connect(DB_PATH)
+    _local.path = DB_PATH
+    migrate(_local.conn, DB_PATH)
+    return _local.conn
+
+# Runs pending schema migrations the first time this process opens path
+def migrate(conn, path):
+    with _migrate_lock:
+        if path in _migrated:
+            return
+        migrations.upgrade(conn)
+        _migrated.add(path)
+
+# Closes the calling thread's connection (if any)
+def close_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+# Points every thread at a different database file, e.g. a temporary one in tests
+# Connections to the old file are replaced the next time each thread asks for one
+def set_database_path(path):
+    global DB_PATH
+    DB_PATH = path
+    close_connection()
+    bump_generation()
+
+# Marks that the data has changed
+def bump_generation():
+    global _generation
+    with _generation_lock:
+        _generation += 1
+        return _generation
+
+# Returns the current data generation
+def get_generation():
+    return _generation
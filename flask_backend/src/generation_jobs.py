@@ -0,0 +1,128 @@
+import os
+import queue
+import threading
+import time
+import uuid
+from . import llm_interface
+
+# Number of background threads running LLM generations
+WORKERS = int(os.getenv("GENERATION_WORKERS", 2))
+# Jobs that may wait for a worker before new submissions are rejected
+MAX_QUEUED = int(os.getenv("GENERATION_QUEUE_SIZE", 32))
+# Finished jobs are forgotten after this many seconds
+JOB_RETENTION_SECONDS = 3600
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    """Raised when the generation queue already holds MAX_QUEUED jobs."""
+
+
+class GenerationQueue:
+    """
+    Runs recipe generations on a pool of background threads fed by a bounded queue.
+
+    Each job runs `llm_interface.generate_and_save_recipe()`, which retries when the LLM
+    repeats an existing recipe. Job state lives in memory, so it is only
+    visible to the process that accepted the job.
+    """
+
+    def __init__(self, workers=WORKERS, max_queued=MAX_QUEUED):
+        self.workers = workers
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def submit(self, ingredients, preference=None):
+        """
+        Queues a generation.
+
+        Args:
+            ingredients (list of str): Pantry ingredients to build the recipe from.
+            preference (str, optional): Preferred style or cuisine.
+
+        Returns:
+            str: The job id.
+
+        Raises:
+            QueueFullError: If the queue is full.
+        """
+        self._start_workers()
+        self._forget_finished()
+        job = {
+            "job_id": uuid.uuid4().hex,
+            "status": QUEUED,
+            "recipe_name": None,
+            "error": None,
+            "created_at": time.time(),
+            "finished_at": None,
+            "ingredients": list(ingredients),
+            "preference": preference,
+        }
+        with self._lock:
+            self._jobs[job["job_id"]] = job
+        try:
+            self._queue.put_nowait(job["job_id"])
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job["job_id"]]
+            raise QueueFullError("Too many recipe generations in progress, try again later")
+        return job["job_id"]
+
+    def get(self, job_id):
+        """
+        Returns:
+            dict or None: The job's id, status, saved recipe name and error, or None if unknown.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {key: job[key] for key in ("job_id", "status", "recipe_name", "error")}
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _run(self, job_id):
+        with self._lock:
+            job = dict(self._jobs[job_id])
+        self._update(job_id, status=RUNNING)
+        try:
+            name = llm_interface.generate_and_save_recipe(", ".join(job["ingredients"]), job["preference"])
+            self._update(job_id, status=DONE, recipe_name=name, finished_at=time.time())
+        except Exception as e:
+            print(f"Recipe generation {job_id} failed: ", e)
+            self._update(job_id, status=FAILED, error=str(e), finished_at=time.time())
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _start_workers(self):
+        with self._lock:
+            if self._threads:
+                return
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._work, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _forget_finished(self):
+        cut_off = time.time() - JOB_RETENTION_SECONDS
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job["finished_at"] is not None and job["finished_at"] < cut_off]:
+                del self._jobs[job_id]
+
+
+QUEUE = GenerationQueue()
@@ -0,0 +1,178 @@
+from array import array
+from bisect import bisect_left
+import heapq
+import sys
+import threading
+import time
+from . import database
+
+# In-memory inverted index: lowercase ingredient name -> sorted array of recipe ids
+# A multi-ingredient containment query is the intersection of the ingredients' posting lists.
+# Kept up to date incrementally by recipe_interface.add_recipe/remove_recipe, so writes made
+# by another process are only picked up by the next build.
+class IngredientIndex:
+    def __init__(self, path):
+        self.path = path
+        self.warm = False
+        self.build_seconds = None
+        self._postings = {}
+        self._lock = threading.Lock()
+        self._building = False
+        # Set whenever no build is running
+        self._built = threading.Event()
+        self._built.set()
+        # Changes made while a build is running, replayed once it finishes
+        self._pending = []
+
+    # Builds the index from scratch by reading recipe_ingredients once
+    # Only one build runs at a time: if one is already running (e.g. started by build_async), this
+    # waits for it to finish instead of starting another, whose older snapshot could replace it
+    def build(self, conn):
+        with self._lock:
+            running = self._building
+            if not running:
+                self._building = True
+                self._built.clear()
+        if running:
+            self._built.wait()
+            # The running build failed, try again
+            if not self.warm:
+                self.build(conn)
+        else:
+            self._build(conn)
+
+    # Runs a build claimed by build() or build_async() (_building already set)
+    def _build(self, conn):
+        with self._lock:
+            self._pending = []
+        start = time.perf_counter()
+        postings = {}
+        try:
+            rows = conn.execute("""SELECT r.id, ri.ingredient_name FROM recipe_ingredients AS ri
+                                JOIN recipes AS r ON r.name = ri.recipe_name
+                                ORDER BY r.id""")
+            for recipe_id, ingredient_name in rows:
+                postings.setdefault(ingredient_name.lower(), array("q")).append(recipe_id)
+        except BaseException:
+            with self._lock:
+                self._building = False
+            self._built.set()
+            raise
+
+        with self._lock:
+            self._postings = postings
+            for change in self._pending:
+                change()
+            self._pending = []
+            self._building = False
+            self.warm = True
+            self.build_seconds = time.perf_counter() - start
+        self._built.set()
+        stats = self.stats()
+        print(f"Built ingredient index: {stats['ingredients']} ingredients, {stats['postings']} postings, "
+              f"{stats['build_seconds']:.3f}s, {stats['memory_bytes']} bytes")
+
+    # Builds the index on a background thread with its own connection (no-op if already warm or building)
+    def build_async(self):
+        with self._lock:
+            if self.warm or self._building:
+                return
+            self._building = True
+            self._built.clear()
+
+        def run():
+            conn = database.connect(self.path)
+            try:
+                self._build(conn)
+            except Exception as error:
+                print("Failed to build ingredient index: ", error)
+            finally:
+                conn.close()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # Records that recipe_id uses ingredient_names
+    def add_recipe(self, recipe_id, ingredient_names):
+        def change():
+            for name in ingredient_names:
+                posting = self._postings.setdefault(name.lower(), array("q"))
+                position = bisect_left(posting, recipe_id)
+                if position == len(posting) or posting[position] != recipe_id:
+                    posting.insert(position, recipe_id)
+        self._apply(change)
+
+    # Forgets recipe_id for ingredient_names
+    def remove_recipe(self, recipe_id, ingredient_names):
+        def change():
+            for name in ingredient_names:
+                posting = self._postings.get(name.lower())
+                if posting is None:
+                    continue
+                position = bisect_left(posting, recipe_id)
+                if position < len(posting) and posting[position] == recipe_id:
+                    posting.pop(position)
+                if not posting:
+                    del self._postings[name.lower()]
+        self._apply(change)
+
+    def _apply(self, change):
+        with self._lock:
+            if self._building:
+                self._pending.append(change)
+            if self.warm:
+                change()
+
+    # Returns the sorted ids of recipes that use every ingredient in ingredient_names (lowercase)
+    def recipes_with_all(self, ingredient_names):
+        with self._lock:
+            postings = [self._postings.get(name) for name in set(ingredient_names)]
+            if not postings or any(posting is None for posting in postings):
+                return []
+            postings.sort(key=len)
+            recipe_ids = set(postings[0])
+            for posting in postings[1:]:
+                recipe_ids.intersection_update(posting)
+                if not recipe_ids:
+                    break
+        return sorted(recipe_ids)
+
+    # Returns up to k ingredient names (lowercase), other than ingredient_names, ranked by how many
+    # recipes they share with ingredient_names, ties broken by how many recipes use them overall
+    def co_occurring(self, ingredient_names, k):
+        names = set(ingredient_names)
+        with self._lock:
+            recipe_ids = set()
+            for name in names:
+                recipe_ids.update(self._postings.get(name, ()))
+            scored = [(sum(1 for recipe_id in posting if recipe_id in recipe_ids), len(posting), name)
+                      for name, posting in self._postings.items() if name not in names]
+        return [name for _, _, name in heapq.nlargest(k, scored, key=lambda score: score[:2])]
+
+    # Returns a copy of every posting list, {lowercase ingredient name: array("q") of recipe ids}
+    def postings(self):
+        with self._lock:
+            return {name: array("q", posting) for name, posting in self._postings.items()}
+
+    # Size and build cost of the index
+    def stats(self):
+        with self._lock:
+            memory = sys.getsizeof(self._postings)
+            memory += sum(sys.getsizeof(name) + sys.getsizeof(posting) for name, posting in self._postings.items())
+            return {
+                "warm": self.warm,
+                "ingredients": len(self._postings),
+                "postings": sum(len(posting) for posting in self._postings.values()),
+                "build_seconds": self.build_seconds,
+                "memory_bytes": memory,
+            }
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# Returns the index for the current database file
+def get_index():
+    path = database.DB_PATH
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = IngredientIndex(path)
+        return _indexes[path]
@@ -0,0 +1,357 @@
+from bisect import bisect_left, insort
+import math
+import threading
+import time
+import numpy as np
+from . import database
+
+# Minimum trigram similarity for a fuzzy search result
+SEARCH_THRESHOLD = 0.3
+# Minimum trigram similarity for resolve() to accept a name that is not an exact match
+RESOLVE_THRESHOLD = 0.45
+# Thresholds fuzzy_search tries first, see IngredientSearchIndex.fuzzy_search
+PASS_THRESHOLDS = (0.8, 0.6, 0.45)
+
+# Posting of a trigram: (ids, sizes, bounds) with ids and sizes ordered by size and bounds[n]
+# the position of the first name with at least n trigrams (up to the largest size + 1)
+def _posting(ids, sizes):
+    return ids, sizes, np.searchsorted(sizes, np.arange(sizes[-1] + 2)).tolist()
+
+def _by_size(ids, sizes):
+    order = np.argsort(sizes, kind="stable")
+    return _posting(ids[order], sizes[order])
+
+# Trigrams of each word padded with spaces, e.g. "olive oil" -> " ol", "oli", ..., "ve ", " oi", ...
+def trigrams(text):
+    grams = set()
+    for word in text.lower().split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+# Lowercase name with runs of whitespace collapsed
+def _key(name):
+    return " ".join(str(name).lower().split())
+
+# Lowercase suffixes of name starting at each word, e.g. "olive oil" -> "olive oil", "oil"
+def _word_suffixes(name):
+    words = name.split()
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+# In-memory search index over ingredient names
+# Prefix lookups (autocomplete) bisect a sorted list of (word suffix, name) pairs, so typing
+# "chee" finds both "Cheddar Cheese" and "Cheese". Fuzzy lookups rank by Jaccard similarity of
+# trigram sets through an inverted index from trigram to name ids, kept sorted by the names'
+# trigram counts so only names of a length that can reach the threshold are read (see _scored).
+# Built on a background thread on first use (build_async) and kept up to date by
+# recipe_interface.insert_ingredient/remove_ingredient and bulk_import; like ingredient_index,
+# writes from other processes are only seen after a rebuild.
+class IngredientSearchIndex:
+    def __init__(self, path):
+        self.path = path
+        self.warm = False
+        self.build_seconds = None
+        # Lowercase name -> canonical name
+        self._names = {}
+        # Sorted (word suffix, lowercase name) pairs
+        self._prefixes = []
+        # Lowercase name -> id, and id -> lowercase name (None once removed)
+        self._ids = {}
+        self._keys = []
+        # Id -> number of trigrams of the name, and the trigram ids of every name one after the
+        # other (id -> start in _grams, only the first _grams_used are filled)
+        self._sizes = np.zeros(0, dtype=np.int32)
+        self._starts = np.zeros(0, dtype=np.int64)
+        self._grams = np.zeros(0, dtype=np.int32)
+        self._grams_used = 0
+        # Trigram -> id, and trigram -> posting of the names containing it (see _posting)
+        self._gram_ids = {}
+        self._trigrams = {}
+        self._lock = threading.Lock()
+        self._building = False
+        self._built = threading.Event()
+        # Changes made while a build is running, replayed once it finishes
+        self._pending = []
+
+    # Reads every ingredient name over conn and rebuilds the index
+    def build(self, conn):
+        with self._lock:
+            self._building = True
+            self._pending = []
+        start = time.perf_counter()
+        try:
+            names = [row[0] for row in conn.execute("SELECT name FROM ingredients")]
+        except BaseException:
+            with self._lock:
+                self._building = False
+            self._built.set()
+            raise
+        with self._lock:
+            self._names = {}
+            self._ids = {}
+            self._keys = []
+            self._sizes = np.zeros(0, dtype=np.int32)
+            self._starts = np.zeros(0, dtype=np.int64)
+            self._grams = np.zeros(0, dtype=np.int32)
+            self._grams_used = 0
+            self._gram_ids = {}
+            self._trigrams = {}
+            self._prefixes = sorted(self._add(names))
+            self.warm = True
+            for change in self._pending:
+                change()
+            self._pending = []
+            self._building = False
+            self.build_seconds = time.perf_counter() - start
+        self._built.set()
+
+    # Builds the index on a background thread with its own connection (no-op if already warm or building)
+    def build_async(self):
+        with self._lock:
+            if self.warm or self._building:
+                return
+            self._building = True
+            self._built.clear()
+
+        def run():
+            conn = database.connect(self.path)
+            try:
+                self.build(conn)
+            except Exception as error:
+                print("Failed to build ingredient search index: ", error)
+            finally:
+                conn.close()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # Builds the index from the database if it has not been built yet, or waits for the running build
+    def ensure_built(self):
+        if self.warm:
+            return
+        with self._lock:
+            building = self._building
+        if building:
+            self._built.wait()
+        if not self.warm:
+            self.build(database.get_connection())
+
+    # Runs change now if the index is warm, and again after the running build (which may have
+    # read the names before the change was committed)
+    def _apply(self, change):
+        with self._lock:
+            if self._building:
+                self._pending.append(change)
+            if self.warm:
+                change()
+
+    # Adds ingredient names, a no-op until the index has been built (the build reads them anyway)
+    def add(self, names):
+        names = list(names)
+        self._apply(lambda: self._add_entries(names))
+
+    def _add_entries(self, names):
+        entries = self._add(names)
+        # A few names are inserted in place, many (bulk import) are merged with one sort
+        if len(entries) > 32:
+            self._prefixes.extend(entries)
+            self._prefixes.sort()
+        else:
+            for entry in entries:
+                insort(self._prefixes, entry)
+
+    # Indexes the trigrams of new names and returns their unsorted prefix entries
+    def _add(self, names):
+        entries = []
+        # Trigram -> ([ids], [sizes]) of the new names
+        postings = {}
+        sizes = []
+        gram_ids = []
+        for name in names:
+            key = _key(name)
+            if key in self._names:
+                continue
+            self._names[key] = name
+            name_id = len(self._keys)
+            self._ids[key] = name_id
+            self._keys.append(key)
+            entries += [(suffix, key) for suffix in _word_suffixes(key)]
+            grams = trigrams(key)
+            sizes.append(len(grams))
+            gram_ids += [self._gram_ids.setdefault(gram, len(self._gram_ids)) for gram in grams]
+            for gram in grams:
+                posting = postings.setdefault(gram, ([], []))
+                posting[0].append(name_id)
+                posting[1].append(len(grams))
+        if sizes:
+            sizes = np.array(sizes, dtype=np.int32)
+            starts = self._grams_used + np.cumsum(sizes, dtype=np.int64) - sizes
+            self._sizes = np.concatenate([self._sizes, sizes])
+            self._starts = np.concatenate([self._starts, starts])
+            end = self._grams_used + len(gram_ids)
+            if end > len(self._grams):
+                # Grown geometrically so adding one name at a time stays cheap
+                grams = np.zeros(max(end, 2 * len(self._grams)), dtype=np.int32)
+                grams[:self._grams_used] = self._grams[:self._grams_used]
+                self._grams = grams
+            self._grams[self._grams_used:end] = gram_ids
+            self._grams_used = end
+        for gram, (ids, sizes) in postings.items():
+            posting = _by_size(np.array(ids, dtype=np.int32), np.array(sizes, dtype=np.int32))
+            if gram in self._trigrams:
+                ids, sizes, _ = self._trigrams[gram]
+                positions = np.searchsorted(sizes, posting[1], side="right")
+                posting = _posting(np.insert(ids, positions, posting[0]), np.insert(sizes, positions, posting[1]))
+            self._trigrams[gram] = posting
+        return entries
+
+    # Removes an ingredient name
+    def remove(self, name):
+        self._apply(lambda: self._remove(_key(name)))
+
+    def _remove(self, key):
+        if self._names.pop(key, None) is None:
+            return
+        name_id = self._ids.pop(key)
+        self._keys[name_id] = None
+        size = int(self._sizes[name_id])
+        for suffix in _word_suffixes(key):
+            position = bisect_left(self._prefixes, (suffix, key))
+            if position < len(self._prefixes) and self._prefixes[position] == (suffix, key):
+                self._prefixes.pop(position)
+        for gram in trigrams(key):
+            posting = self._trigrams.get(gram)
+            if posting is None:
+                continue
+            ids, sizes, bounds = posting
+            start = bounds[size]
+            positions = start + np.flatnonzero(ids[start:bounds[size + 1]] == name_id)
+            if len(positions) == len(ids):
+                del self._trigrams[gram]
+            elif len(positions):
+                self._trigrams[gram] = _posting(np.delete(ids, positions), np.delete(sizes, positions))
+
+    # Returns up to limit canonical names starting with query (at the start of any word),
+    # whole-name matches first, shorter names first
+    def prefix_search(self, query, limit=10):
+        query = _key(query)
+        if not query:
+            return []
+        with self._lock:
+            position = bisect_left(self._prefixes, (query,))
+            matches = set()
+            # Scan a bounded window, enough to fill limit after ranking
+            while position < len(self._prefixes) and len(matches) < limit * 4:
+                suffix, key = self._prefixes[position]
+                if not suffix.startswith(query):
+                    break
+                matches.add(key)
+                position += 1
+            ranked = sorted(matches, key=lambda key: (not key.startswith(query), len(key), key))
+            return [self._names[key] for key in ranked[:limit]]
+
+    # Returns up to limit (canonical name, similarity) pairs with similarity >= threshold, best first
+    # Searches at PASS_THRESHOLDS above threshold first: a high threshold reads few postings, and
+    # once a pass finds limit names nothing below its threshold can displace them.
+    def fuzzy_search(self, query, limit=10, threshold=SEARCH_THRESHOLD):
+        query_grams = trigrams(query)
+        if not query_grams or limit <= 0:
+            return []
+        with self._lock:
+            scored = None
+            for minimum in [t for t in PASS_THRESHOLDS if t > threshold]:
+                scored = self._scored(query_grams, limit, minimum, count_all=False)
+                if scored is None or len(scored) >= limit:
+                    break
+            if scored is None or len(scored) < limit:
+                scored = self._scored(query_grams, limit, threshold)
+            return [(self._names[key], round(similarity, 3)) for similarity, key in scored]
+
+    # Up to limit (similarity, lowercase name) pairs with similarity >= threshold, best first
+    # A name of n trigrams sharing c of the query's q has similarity c / (q + n - c), at most
+    # min(q, n) / max(q, n), so only the names with n in [threshold * q, q / threshold] are looked
+    # at: one slice of each query trigram's posting. Such a name also needs at least
+    # c = threshold * (q + n) / (1 + threshold) shared trigrams, so it is in one of the
+    # (slices - c + 1) shortest slices. When that prefix is small, only its names are candidates
+    # and their shared trigrams are counted from their own trigram ids; otherwise (common words,
+    # whose trigrams all have long postings) every slice is counted with one bincount. That costs
+    # about as much at any threshold, so unless count_all is set None is returned instead and the
+    # caller goes on to its final threshold.
+    def _scored(self, query_grams, limit, threshold, count_all=True):
+        q = len(query_grams)
+        low, high = max(1, math.ceil(threshold * q - 1e-9)), math.floor(q / threshold + 1e-9)
+        required = math.ceil(threshold * (q + low) / (1 + threshold) - 1e-9)
+        slices = []
+        for gram in query_grams:
+            posting = self._trigrams.get(gram)
+            if posting is not None:
+                ids, _, bounds = posting
+                last = len(bounds) - 1
+                slices.append(ids[bounds[min(low, last)]:bounds[min(high + 1, last)]])
+        if len(slices) < required:
+            return []
+        slices.sort(key=len)
+        prefix = slices[:len(slices) - required + 1]
+        if sum(map(len, prefix)) * (high + 1) < sum(map(len, slices)):
+            candidates = np.unique(np.concatenate(prefix))
+            if not len(candidates):
+                return []
+            in_query = np.zeros(len(self._gram_ids), dtype=np.int32)
+            in_query[[self._gram_ids[gram] for gram in query_grams if gram in self._gram_ids]] = 1
+            lengths = self._sizes[candidates]
+            offsets = np.cumsum(lengths) - lengths
+            positions = np.repeat(self._starts[candidates] - offsets, lengths) + np.arange(offsets[-1] + lengths[-1])
+            shared = np.add.reduceat(in_query[self._grams[positions]], offsets)
+        elif not count_all:
+            return None
+        else:
+            counts = np.bincount(np.concatenate(slices))
+            candidates = np.flatnonzero(counts >= required)
+            shared = counts[candidates]
+        similarity = shared / (q + self._sizes[candidates] - shared)
+        keep = similarity >= threshold
+        candidates, similarity = candidates[keep], similarity[keep]
+        if len(candidates) > limit:
+            # Everything tied with the limit-th best, so ties are broken by name below
+            keep = similarity >= np.partition(similarity, len(similarity) - limit)[len(similarity) - limit]
+            candidates, similarity = candidates[keep], similarity[keep]
+        scored = [(value, self._keys[name_id]) for name_id, value in zip(candidates.tolist(), similarity.tolist())]
+        scored.sort(key=lambda item: (-item[0], len(item[1]), item[1]))
+        return scored[:limit]
+
+    # Autocomplete: prefix matches, then fuzzy matches for typos
+    def search(self, query, limit=10):
+        results = self.prefix_search(query, limit)
+        if len(results) < limit:
+            results += [name for name, _ in self.fuzzy_search(query, limit)
+                        if name not in results][:limit - len(results)]
+        return results
+
+    # Returns the canonical name for name: an exact (case-insensitive) match, otherwise the most
+    # similar ingredient if it is at least RESOLVE_THRESHOLD similar, otherwise None
+    def resolve(self, name):
+        with self._lock:
+            exact = self._names.get(_key(name))
+        if exact is not None:
+            return exact
+        matches = self.fuzzy_search(str(name), limit=1, threshold=RESOLVE_THRESHOLD)
+        return matches[0][0] if matches else None
+
+    def stats(self):
+        with self._lock:
+            return {"warm": self.warm, "names": len(self._names), "prefix_entries": len(self._prefixes),
+                    "trigrams": len(self._trigrams), "build_seconds": self.build_seconds}
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+# Returns the search index for the current database file
+# build: build it now if it has not been built yet (writers pass False, an unbuilt index ignores them)
+def get_index(build=True):
+    path = database.DB_PATH
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = IngredientSearchIndex(path)
+        index = _indexes[path]
+    if build:
+        index.ensure_built()
+    return index
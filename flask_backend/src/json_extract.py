@@ -0,0 +1,168 @@
+import json
+import re
+
+# Characters that change the scanner's state; everything else is skipped by the regex engine
+_SPECIAL = re.compile(r'[{}"\\]')
+
+# Extra passes allowed when the text ends inside an object, each costs at most one more scan
+MAX_RESCANS = 2
+
+
+class JSONObjectExtractor:
+    """
+    Finds JSON objects embedded in free text (LLM output) in a single pass.
+
+    The scanner balances braces and tracks string literals and escapes, so braces and quotes
+    inside strings, nested objects and surrounding prose or markdown fences are handled. Text
+    can be fed in pieces as it streams in; every character is scanned once and every candidate
+    object is decoded at most once, so the total cost is linear in the length of the text.
+
+    Candidates are the outermost balanced {...} spans. If one of them is not valid JSON, or the
+    text ends before it is closed (a truncated response), its largest complete inner objects are
+    tried instead.
+
+    Example:
+        extractor = JSONObjectExtractor()
+        for chunk in chunks:
+            extractor.feed(chunk)
+        recipe = extractor.finish()
+    """
+
+    def __init__(self):
+        # Text fed since the last point where no object was open, starting at self._offset
+        self._chunks = []
+        self._offset = 0
+        self._length = 0
+        # Positions of the unclosed "{"
+        self._stack = []
+        self._in_string = False
+        # Position of the character escaped by a backslash
+        self._escaped = -1
+        # Outermost closed spans inside the objects that are still open
+        self._inner = []
+        # (length, object) for every object decoded so far
+        self._objects = []
+        self.candidates = 0
+
+    def feed(self, chunk):
+        """
+        Scans the next piece of text.
+
+        Args:
+            chunk (str): The text following everything fed so far.
+
+        Returns:
+            list of dict: Outermost objects completed (and successfully decoded) by this chunk.
+        """
+        base = self._length
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+        completed = []
+        for match in _SPECIAL.finditer(chunk):
+            position = base + match.start()
+            if position == self._escaped:
+                continue
+            char = match.group()
+            if self._in_string:
+                if char == "\\":
+                    self._escaped = position + 1
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                # Quotes only start strings inside an object, prose around it may use them freely
+                self._in_string = bool(self._stack)
+            elif char == "{":
+                self._stack.append(position)
+            elif char == "}" and self._stack:
+                opened = self._stack.pop()
+                inner = []
+                while self._inner and self._inner[-1][0] > opened:
+                    inner.append(self._inner.pop())
+                if self._stack:
+                    self._inner.append((opened, position))
+                    continue
+                found = self._decode(opened, position)
+                if found is None:
+                    found = self._decode_any(inner)
+                if found is not None:
+                    completed.append(found)
+
+        if not self._stack:
+            self._chunks = []
+            self._offset = self._length
+        return completed
+
+    def finish(self, rescans=MAX_RESCANS):
+        """
+        Ends the input and returns the best object found.
+
+        Args:
+            rescans (int): How many times the text after an unclosed "{" may be scanned again.
+
+        Returns:
+            dict or None: The largest valid JSON object in the text, or None if there is none.
+        """
+        if self._stack:
+            # Truncated outer object, fall back to the complete objects inside it
+            self._decode_any(self._inner)
+            if rescans:
+                # A stray "{" (and quote) in the prose may have thrown off string tracking for
+                # everything after it, so scan the rest again as if it were not there
+                retry = JSONObjectExtractor()
+                retry.feed(self._text(self._stack[0] + 1, self._length - 1))
+                retry.finish(rescans - 1)
+                self._objects.extend(retry._objects)
+                self.candidates += retry.candidates
+            self._stack = []
+            self._inner = []
+        return self.best()
+
+    def best(self):
+        """
+        Returns:
+            dict or None: The largest valid JSON object decoded so far.
+        """
+        if not self._objects:
+            return None
+        return max(self._objects, key=lambda found: found[0])[1]
+
+    def _text(self, start, end):
+        buffer = "".join(self._chunks)
+        self._chunks = [buffer]
+        return buffer[start - self._offset:end - self._offset + 1]
+
+    def _decode(self, start, end):
+        self.candidates += 1
+        try:
+            value = json.loads(self._text(start, end))
+        except ValueError:
+            return None
+        if not isinstance(value, dict):
+            return None
+        self._objects.append((end - start, value))
+        return value
+
+    def _decode_any(self, spans):
+        found = None
+        for start, end in spans:
+            value = self._decode(start, end)
+            if value is not None and found is None:
+                found = value
+        return found
+
+
+def extract_json_object(text):
+    """
+    Extracts the largest valid JSON object from a block of text.
+
+    Args:
+        text (str): Text that contains a JSON object, possibly inside a markdown fence
+                    and surrounded by other text.
+
+    Returns:
+        tuple: (object, candidates) where object is the decoded dict or None, and candidates
+            is the number of balanced {...} spans that were tried.
+    """
+    extractor = JSONObjectExtractor()
+    extractor.feed(text)
+    return extractor.finish(), extractor.candidates
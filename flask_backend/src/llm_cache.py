@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from . import recipe_interface
+
+# Entries older than this are treated as misses and evicted
+TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL", 7 * 24 * 3600))
+# Least recently used entries beyond this count are evicted
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 1000))
+
+_counter_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+
+def make_key(ingredients, preference, prompt_version):
+    """
+    Builds the cache key for a generation request.
+
+    The ingredient list is normalized (split on commas/newlines, trimmed, lowercased,
+    deduplicated and sorted) so the same pantry in a different order or spelling case
+    maps to the same entry.
+
+    Args:
+        ingredients (str): The pantry summary sent to the LLM.
+        preference (str or None): The user's style preference.
+        prompt_version (int): Version of the prompt template, so template changes never reuse old answers.
+
+    Returns:
+        str: A hex SHA-256 digest.
+    """
+    items = sorted({item.strip().lower() for item in re.split(r"[,\n]", str(ingredients)) if item.strip()})
+    normalized = {
+        "ingredients": items,
+        "preference": str(preference).strip().lower() if preference else "",
+        "prompt_version": prompt_version,
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get(key):
+    """
+    Looks up a cached LLM response.
+
+    Args:
+        key (str): Key from make_key().
+
+    Returns:
+        str or None: The cached response text, or None on a miss (including expired entries).
+    """
+    global _hits, _misses
+    conn = recipe_interface.open_db()
+    now = round(time.time())
+    try:
+        row = conn.execute("SELECT response FROM llm_cache WHERE key = ? AND created_at > ?",
+                           (key, now - TTL_SECONDS)).fetchone()
+        if row:
+            conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+            conn.commit()
+    except sqlite3.Error as error:
+        conn.rollback()
+        print("Failed to read LLM cache: ", error)
+        row = None
+
+    with _counter_lock:
+        if row:
+            _hits += 1
+        else:
+            _misses += 1
+    return row["response"] if row else None
+
+
+def put(key, response):
+    """
+    Stores an LLM response, then evicts expired and least recently used entries.
+
+    Args:
+        key (str): Key from make_key().
+        response (str): The response text of a generation whose recipe was saved.
+    """
+    conn = recipe_interface.open_db()
+    now = round(time.time())
+    try:
+        conn.execute("INSERT OR REPLACE INTO llm_cache (key, response, created_at, last_used) VALUES (?, ?, ?, ?)",
+                     (key, response, now, now))
+        conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (now - TTL_SECONDS,))
+        conn.execute("""DELETE FROM llm_cache WHERE key IN (
+                            SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)""", (MAX_ENTRIES,))
+        conn.commit()
+    except sqlite3.Error as error:
+        conn.rollback()
+        print("Failed to write LLM cache: ", error)
+
+
+def stats():
+    """
+    Returns:
+        dict: Hit and miss counts since the process started, and the number of stored entries.
+    """
+    try:
+        entries = recipe_interface.open_db().execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+    except sqlite3.Error:
+        entries = None
+    with _counter_lock:
+        return {"hits": _hits, "misses": _misses, "entries": entries}
@@ -1,57 +1,95 @@
-import requests
 import json
+import math
 from dotenv import load_dotenv
 import os
 from . import recipe_interface
+from . import llm_cache
+from . import catalog
+from . import completion_client
+from . import ingredient_search
+from . import json_extract
+from . import prompt_builder
+from . import units
 import re
 import sqlite3
 load_dotenv()
 ARLIAI_API_KEY = os.getenv("ARLIAI_API_KEY")
 
+# Bump whenever the prompt (see prompt_builder) changes so cached generations are not reused
+PROMPT_VERSION = 2
+
+# How many times a generation is retried when the LLM returns a recipe that already exists
+DUPLICATE_RETRIES = 2
+
+# Chat completions endpoint, overridable to point at a local or stub server
+ARLIAI_API_URL = os.getenv("ARLIAI_API_URL", "https://api.arliai.com/v1/chat/completions")
+
+# Shared pooled client with timeouts, retries and a circuit breaker
+CLIENT = completion_client.CompletionClient()
+
 def get_pantry_summary():
     """
     Retrieves a summary of the user's pantry ingredients from the database.
+
+    Every lot is converted to its ingredient's unit of measurement (see `units.UnitTable`)
+    before the quantities are added up. Lots in a unit that cannot be converted, e.g. cups
+    of an ingredient measured in grams with no known density, are listed after the total.
+
     Returns:
         str: A formatted string summarizing the total quantities of each ingredient in the pantry.
     """
-    # Connect to the database and retrieve pantry summary
-    conn = sqlite3.connect('flask_backend/pantry.db')
-    conn.execute("PRAGMA foreign_keys = 1")
+    # Retrieve pantry summary over the thread's pooled connection
+    conn = recipe_interface.open_db()
     c = conn.cursor()
     
     try:
         c.execute("""
             SELECT
                 p.ingredient_name,
-                SUM(p.quantity) AS total_quantity,
-                i.unit_of_measurement
+                p.quantity,
+                COALESCE(p.unit_of_measurement, i.unit_of_measurement) AS unit,
+                i.unit_of_measurement AS ingredient_unit,
+                i.density
             FROM pantry AS p
             JOIN ingredients AS i
                 ON p.ingredient_name = i.name
-            GROUP BY p.ingredient_name
+            ORDER BY p.ingredient_name
         """)
         rows = c.fetchall()
     except sqlite3.Error as error:
         print("Failed to retrieve pantry summary:", error)
-        conn.close()
         return []
-    
-    conn.close()
+
+    quantities = units.get_table().convert([row["quantity"] for row in rows], [row["unit"] for row in rows],
+                                           [row["ingredient_unit"] for row in rows], [row["density"] for row in rows])
+    totals = {}
+    for row, quantity in zip(rows, quantities.tolist()):
+        total = totals.setdefault(row["ingredient_name"], {"quantity": 0.0, "unit": row["ingredient_unit"], "other": {}})
+        if math.isnan(quantity):
+            # Not convertible, kept in its own unit
+            total["other"][row["unit"]] = total["other"].get(row["unit"], 0.0) + row["quantity"]
+        else:
+            total["quantity"] += quantity
+
     ingred_summary = ""
-    for row in rows:
-        name, total_qty, unit = row
-        ingred = f"{name}: {total_qty} {unit} total in pantry\n"
-        ingred_summary += ingred
+    for name, total in totals.items():
+        ingred = f"{name}: {round(total['quantity'], 2)} {total['unit']} total in pantry"
+        if total["other"]:
+            ingred += " (plus " + ", ".join(f"{round(quantity, 2)} {unit}" for unit, quantity in total["other"].items()) + ")"
+        ingred_summary += ingred + "\n"
     return ingred_summary
 
 
 def parse_recipe_json(text):
     """
-    Extracts and parses a JSON object from a text block that contains
-    a JSON-formatted recipe enclosed in triple backticks (e.g., ```json ... ```).
+    Extracts and parses the JSON recipe object from an LLM response.
+
+    The object may be enclosed in triple backticks (e.g., ```json ... ```) and surrounded by
+    other text. See `json_extract.JSONObjectExtractor` for how it is located; nested objects
+    and braces inside strings are supported and the largest valid object wins.
 
     Args:
-        text (str): A string containing a JSON block inside triple backticks.
+        text (str): A string containing a JSON object.
 
     Returns:
         dict: The parsed JSON object representing the recipe.
@@ -59,17 +97,12 @@ def parse_recipe_json(text):
     Raises:
         ValueError: If no JSON block is found or if the JSON is invalid.
     """
-    match1 = re.search(r'```json\s*(\{.*?\})\s*```', text, re.DOTALL)
-    match2 = re.search(r'(\{.*?\})', text, re.DOTALL)
-    if not match1 and not match2:
-        raise ValueError("No JSON block found in the input text.")
-    
-    json_str = match1.group(1) if match1 else match2.group(1)
-    
-    try:
-        return json.loads(json_str)
-    except json.JSONDecodeError as e:
-        raise ValueError(f"Invalid JSON: {e}")
+    recipe_data, candidates = json_extract.extract_json_object(text)
+    if recipe_data is None:
+        if not candidates:
+            raise ValueError("No JSON block found in the input text.")
+        raise ValueError(f"Invalid JSON: none of the {candidates} objects in the input text could be parsed")
+    return recipe_data
 
 
 def parse_ingredient_string(ingredient_str):
@@ -106,18 +139,58 @@ def parse_ingredient_string(ingredient_str):
     return (name, float(qty), unit)
 
 
+def resolve_ingredient_name(name):
+    """
+    Maps an ingredient name from an LLM response to the catalog's spelling.
+
+    Args:
+        name (str): The ingredient name as written by the LLM.
+
+    Returns:
+        str: The exact or best fuzzy match from `ingredient_search`, or `name` unchanged
+            if nothing is similar enough (saving the recipe then fails as before).
+    """
+    resolved = ingredient_search.get_index().resolve(name)
+    if resolved is None:
+        return name
+    if resolved.lower() != str(name).lower():
+        print(f"Resolved ingredient {name} to {resolved}")
+    return resolved
+
+
 def add_parsed_recipe_from_text(text):
     """
-    Extracts a recipe from a markdown-style JSON block, parses the relevant fields,
-    and adds it to the recipe interface.
+    Extracts a recipe from a markdown-style JSON block and saves it with `add_parsed_recipe()`.
 
     Args:
         text (str): A string containing a markdown-formatted recipe in JSON,
                     enclosed in triple backticks and optionally labeled as 'json'.
 
+    Returns:
+        str: The name of the saved recipe.
+
+    Raises:
+        ValueError: If no valid JSON recipe is found or the recipe could not be saved.
+    """
+    return add_parsed_recipe(parse_recipe_json(text))
+
+
+def add_parsed_recipe(recipe_data):
+    """
+    Parses the relevant fields of a decoded recipe and adds it to the recipe interface.
+
+    Args:
+        recipe_data (dict): The recipe object returned by `parse_recipe_json()`.
+
     Side Effects:
         Calls `recipe_interface.add_recipe()` to store the parsed recipe.
 
+    Returns:
+        str: The name of the saved recipe.
+
+    Raises:
+        ValueError: If the recipe could not be saved.
+
     Fields Extracted:
         - title (str): Name of the recipe.
         - instructions (list of str): Step-by-step instructions.
@@ -128,9 +201,9 @@ def add_parsed_recipe_from_text(text):
     Notes:
         Time fields may be given as strings (e.g., "30 minutes") or integers (e.g., 30).
         Ingredient strings are parsed into (name, quantity, unit) tuples.
+        Ingredient names are matched to the catalog with `resolve_ingredient_name()`, so close
+        variants such as "garlic cloves" or "parmesan" still find "Garlic" or "Parmesan Cheese".
     """
-    recipe_data = parse_recipe_json(text)
-    
     name = recipe_data.get("title", "Untitled Recipe")
     instructions = "\n".join(recipe_data.get("instructions", []))
     ingredients_raw = recipe_data.get("ingredients", [])
@@ -147,98 +220,33 @@ def add_parsed_recipe_from_text(text):
     prep_time = parse_time(prep_time)
     cook_time = parse_time(cook_time)
     
-    ingredients = [parse_ingredient_string(i) for i in ingredients_raw]
+    ingredients = []
+    for ingredient_name, quantity, unit in (parse_ingredient_string(i) for i in ingredients_raw):
+        ingredients.append((resolve_ingredient_name(ingredient_name), quantity, unit))
     
-    recipe_interface.add_recipe(name, instructions, ingredients, prep_time=prep_time, meal_type=meal_type, cook_time=cook_time)
+    if not recipe_interface.add_recipe(name, instructions, ingredients, prep_time=prep_time, meal_type=meal_type, cook_time=cook_time):
+        raise ValueError(f"Failed to save recipe {name}")
+    return name
 
-def get_recipe_from_user(user_question, user_preference=None):
+def build_completion_payload(user_question, user_preference=None, stream=False, exclude=()):
     """
-    Generates a recipe based on the user's pantry ingredients and optional preferences.
+    Builds the chat completions request body for a recipe generation.
+
+    The prompt is assembled by `prompt_builder.build_messages()` within its token budget.
 
     Args:
         user_question (str): A summary of the ingredients available in the user's pantry.
         user_preference (str, optional): User's preferred style or cuisine for the recipe.
-            Defaults to None.
-    
-    Returns:
-        str: A JSON-formatted string containing the recipe title, ingredients, and instructions.
-    """
-  
-    # Get the list of ingredient names from the database
-    conn = sqlite3.connect('flask_backend/pantry.db')
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA foreign_keys = 1")
-    c = conn.cursor()
-    ingredient_names = []
-    units = []
-    recipe_names = []
-    try:
-        c.execute("SELECT name FROM ingredients")
-        ingredient_names = [row["name"].lower() for row in c.fetchall()]
-        c.execute("SELECT unit FROM units")
-        units = [row["unit"] for row in c.fetchall()]
-        c.execute("SELECT name FROM recipes")
-        recipe_names = [row["name"].lower() for row in c.fetchall()]
+        stream (bool): Whether to ask the API for incremental (server-sent event) chunks.
+        exclude (iterable of str): Recipe titles the LLM must not produce.
 
-    except sqlite3.Error as error:
-        print(f"Failed to get ingredient names/units: ", error)
-    finally:
-        conn.close()
-        
-    print(ingredient_names)
-    print(recipe_names)
-    print(units)
-        
-    system_prompt = f"""
-    You are a helpful assistant that generates detailed recipes based on a provided list of ingredients. 
-    Please adhere to the following guidelines:
-    1. Prioritise using mostly just the ingredients from the user's pantry.
-       If needed, you can also use the following ingredients list: {', '.join(ingredient_names)}. USE NOTHING ELSE.
-    2. Include a list of the required ingredients for the recipe. You MUST use EXACTLY the SAME name and SAME spelling as provided.
-    3. Provide clear, step-by-step cooking instructions.
-    4. Estimate approximate cooking/preparation times.
-    5. Generate a recipe NOT included in this list: {', '.join(recipe_names)}.
-
-    Combine them in a way that results in a balanced, flavorful dish, and detail the recipe thoroughly.
-
-    Finally, please return  the recipe title, ingredients, and instructions in JSON format, with ABSOLUTELY NO backslashes or comments.
-        
-    The JSON should look like this:
-    For ingredient, copy LETTER FOR LETTER from the following keys: {', '.join(ingredient_names)}.
-    For quantity, you MUST ONLY use an integer or decimal numbers, NO fractions, NO units and NO strings.
-    For unit, copy LETTER FOR LETTER one of the following keys: {', '.join(units)}. If there is no appropriate unit, default to using "piece(s)".
-    {{
-        "title": "Recipe Title",
-        "ingredients": [
-            ["Ingredient 1", "quantity", "unit"],
-            ["Ingredient 2", "quantity", "unit"],
-            ...
-        ],
-        "instructions": [
-            "Step 1",
-            "Step 2",
-            ...
-        ],
-        "meal_type": (breakfast, lunch, dinner or snack)
-        "prep_time": "X minutes",
-        "cook_time": "Y minutes"
-    }}
-
-    Only include the ingredients under ONE LIST. Make sure any information about cooking time is included as a bullet point under instructions. 
-    You MUST use the format provided above.
+    Returns:
+        tuple: (payload, prompt_tokens) with the JSON payload for the chat completions API
+            and the estimated size of its prompt.
     """
-
-    if user_preference:
-        messages = [
-            {"role": "system", "content": system_prompt.strip()},
-            {"role": "user", "content": "Please make the recipe in this style: " + str(user_preference) + "\n" +
-             "Here is a summary of the ingredients in my pantry:\n" + str(user_question)}
-        ]
-    else:
-        messages = [
-            {"role": "system", "content": system_prompt.strip()},
-            {"role": "user", "content": "Here is a summary of the ingredients in my pantry:\n" + str(user_question)}
-        ]
+    messages, info = prompt_builder.build_messages(user_question, user_preference, exclude)
+    # The answer's ingredient names are resolved through the search index, built while the API works
+    ingredient_search.get_index(build=False).build_async()
 
     payload = {
         "model": "Mistral-Nemo-12B-Instruct-2407",
@@ -248,26 +256,179 @@ def get_recipe_from_user(user_question, user_preference=None):
         "top_p": 0.9,
         "top_k": 40,
         "max_tokens": 1024,
-        "stream": False
+        "stream": stream
     }
+    return payload, info["prompt_tokens"]
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {ARLIAI_API_KEY}"
-    }
 
-    url = "https://api.arliai.com/v1/chat/completions"
-    response = requests.post(url, headers=headers, data=json.dumps(payload))
-
-    if response.status_code == 200:
-        data = response.json()
-        try:
-            answer = data["choices"][0]["message"]["content"]
-            return answer
-        except (KeyError, IndexError):
-            print("Error: Unexpected response format:", data)
-    else:
-        print(f"Error: Received status code {response.status_code}\n{response.text}")
+def get_recipe_from_user(user_question, user_preference=None, exclude=()):
+    """
+    Generates a recipe based on the user's pantry ingredients and optional preferences.
+
+    Args:
+        user_question (str): A summary of the ingredients available in the user's pantry.
+        user_preference (str, optional): User's preferred style or cuisine for the recipe.
+            Defaults to None.
+        exclude (iterable of str): Recipe titles the LLM must not produce.
+    
+    Returns:
+        str: A JSON-formatted string containing the recipe title, ingredients, and instructions.
+
+    Raises:
+        completion_client.CompletionError: If the API cannot be reached, keeps failing or returns
+            an unexpected response (see completion_client for timeouts, retries and the circuit breaker).
+
+    Notes:
+        Always calls the API. Generations are only cached once they have been parsed and saved,
+        see `get_saved_generation()` and `remember_generation()`.
+    """
+    payload, prompt_tokens = build_completion_payload(user_question, user_preference, exclude=exclude)
+
+    headers = {"Authorization": f"Bearer {ARLIAI_API_KEY}"}
+
+    response = CLIENT.post(ARLIAI_API_URL, payload, headers=headers)
+    data = response.json()
+    try:
+        answer = data["choices"][0]["message"]["content"]
+    except (KeyError, IndexError):
+        raise completion_client.CompletionError(f"Unexpected response format: {data}")
+    prompt_builder.record_usage(prompt_tokens, (data.get("usage") or {}).get("prompt_tokens"))
+    return answer
+
+
+def get_saved_generation(user_question, user_preference=None):
+    """
+    Looks up the recipe an identical generation request saved before.
+
+    Entries are keyed on the request (normalized ingredients, preference and PROMPT_VERSION),
+    not on the exclusions of the attempt that succeeded, so a repeated request gets the
+    recipe it produced last time instead of a new call that would only repeat its title.
+
+    Args:
+        user_question (str): A summary of the ingredients available in the user's pantry.
+        user_preference (str, optional): User's preferred style or cuisine for the recipe.
+
+    Returns:
+        tuple or None: (response text, recipe name), or None if the request has no saved
+            generation. A cached recipe that has since been removed is saved again.
+    """
+    text = llm_cache.get(llm_cache.make_key(user_question, user_preference, PROMPT_VERSION))
+    if text is None:
+        return None
+    try:
+        recipe_data = parse_recipe_json(text)
+        return text, find_existing_title(recipe_data) or add_parsed_recipe(recipe_data)
+    except ValueError as error:
+        print("Failed to reuse cached generation: ", error)
+        return None
+
+
+def remember_generation(user_question, user_preference, text):
+    """
+    Caches a generation once its recipe has been saved (see `get_saved_generation()`).
+
+    Args:
+        user_question (str): A summary of the ingredients available in the user's pantry.
+        user_preference (str or None): User's preferred style or cuisine for the recipe.
+        text (str): The response text the saved recipe was parsed from.
+    """
+    llm_cache.put(llm_cache.make_key(user_question, user_preference, PROMPT_VERSION), text)
+
+
+def find_existing_title(recipe_data):
+    """
+    Checks whether a generated recipe duplicates a saved one.
+
+    Replaces listing every saved recipe name in the prompt: the title is checked against
+    the database after generation instead.
+
+    Args:
+        recipe_data (dict): The recipe object returned by `parse_recipe_json()`.
+
+    Returns:
+        str or None: The recipe's title if a recipe with that name already exists, else None.
+    """
+    title = recipe_data.get("title", "Untitled Recipe")
+    return title if catalog.get_snapshot().has_recipe(title) else None
+
+
+def generate_and_save_recipe(user_question, user_preference=None):
+    """
+    Generates a recipe and saves it, asking again when the LLM repeats an existing recipe.
+
+    Each retry adds the duplicate titles seen so far to the prompt's exclusions, up to
+    DUPLICATE_RETRIES times. A request that already produced a saved recipe returns it
+    without calling the API (see `get_saved_generation()`).
+
+    Args:
+        user_question (str): A summary of the ingredients available in the user's pantry.
+        user_preference (str, optional): User's preferred style or cuisine for the recipe.
+
+    Returns:
+        str: The name of the saved recipe.
+
+    Raises:
+        ValueError: If every attempt produced an existing recipe or the recipe could not be parsed or saved.
+        completion_client.CompletionError: If the API cannot produce a response.
+    """
+    saved = get_saved_generation(user_question, user_preference)
+    if saved is not None:
+        return saved[1]
+
+    exclude = []
+    for _ in range(DUPLICATE_RETRIES + 1):
+        text = get_recipe_from_user(user_question, user_preference, exclude)
+        recipe_data = parse_recipe_json(text)
+        duplicate = find_existing_title(recipe_data)
+        if duplicate is None:
+            name = add_parsed_recipe(recipe_data)
+            remember_generation(user_question, user_preference, text)
+            return name
+        print(f"Generated recipe {duplicate} already exists, retrying")
+        exclude.append(duplicate)
+    raise ValueError(f"Generated recipe {duplicate} already exists")
+
+
+def stream_recipe_from_user(user_question, user_preference=None, exclude=()):
+    """
+    Streaming variant of `get_recipe_from_user()`.
+
+    Requests the completion with "stream": true and yields the text of each incremental chunk
+    as soon as it arrives, so callers can relay the first tokens before generation has finished.
+    Like `get_recipe_from_user()` it always calls the API; callers cache the text with
+    `remember_generation()` once its recipe has been saved.
+
+    Args:
+        user_question (str): A summary of the ingredients available in the user's pantry.
+        user_preference (str, optional): User's preferred style or cuisine for the recipe.
+        exclude (iterable of str): Recipe titles the LLM must not produce.
+
+    Yields:
+        str: Pieces of the response text, in order.
+
+    Raises:
+        completion_client.CompletionError: If the API cannot be reached or keeps failing.
+    """
+    payload, prompt_tokens = build_completion_payload(user_question, user_preference, stream=True, exclude=exclude)
+    prompt_builder.record_usage(prompt_tokens)
+
+    headers = {"Authorization": f"Bearer {ARLIAI_API_KEY}"}
+
+    with CLIENT.post(ARLIAI_API_URL, payload, headers=headers, stream=True) as response:
+        # Server-sent events: one "data: {json chunk}" line per chunk, terminated by "data: [DONE]"
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            try:
+                text = json.loads(data)["choices"][0]["delta"].get("content")
+            except (ValueError, KeyError, IndexError):
+                print("Error: Unexpected stream chunk:", data)
+                continue
+            if text:
+                yield text
 
 
 ### Example usage
@@ -0,0 +1,564 @@
+import json
+import math
+import sqlite3
+import threading
+import time
+import numpy as np
+from . import database
+from . import migrations
+from . import units
+
+SECONDS_PER_DAY = 86400
+
+DEFAULT_MEALS = ("breakfast", "lunch", "dinner")
+MAX_DAYS = 14
+
+# Plan cost = WASTE_WEIGHT * lots of expiring stock left to go off (fractions of lots)
+#           + MISSING_WEIGHT * ingredients the pantry cannot supply (fractions of the recipe amounts)
+WASTE_WEIGHT = 1.0
+MISSING_WEIGHT = 1.0
+
+# Candidates kept per meal by the greedy pass, the local search only tries these
+CANDIDATES_PER_MEAL = 16
+# Local search stops improving the plan this many seconds after the recipes and the pantry are in
+# memory (a rebuild of the recipe table does not eat into it)
+TIME_BUDGET = 0.2
+
+# Slack when comparing quantities, so rounding does not leave crumbs in the pantry
+QUANTITY_EPSILON = 1e-9
+
+# In-memory copy of what the planner needs from the recipes: meal type, times and the amounts of
+# every ingredient converted to the ingredient's unit of measurement (NaN when the recipe's unit
+# cannot be converted). Ingredients are stored in CSR form like coverage.CoverageMatrix: recipe i
+# uses columns indices[indptr[i]:indptr[i + 1]] in amounts amounts[indptr[i]:indptr[i + 1]].
+# Recipe writes update it in place: recipe_interface.add_recipe and bulk_import append their recipes
+# (add_recipes), remove_recipe drops its rows (remove_recipes). Each change makes a new dict (appends
+# write past the end of the previous arrays, see _extended), so a plan running on the previous one
+# is not affected. Anything else that changes the
+# recipes calls invalidate(), and the previous arrays are served while a background build
+# (build_async) replaces them. Pantry writes do not touch it, the pantry is read per plan.
+class RecipeTable:
+    def __init__(self, path):
+        self.path = path
+        self.build_seconds = None
+        self._stale = True
+        self._lock = threading.Lock()
+        self._data = None
+        self._building = False
+        self._built = threading.Event()
+        # Changes made while a build is running, replayed on its arrays once it finishes
+        self._pending = []
+
+    # Marks the table out of date after recipes changed in a way the in-place updates do not cover
+    def invalidate(self):
+        self._stale = True
+
+    # Reads recipes, ingredients and recipe_ingredients with one scan each, matching rows up on the
+    # names in Python instead of joining on the text keys in SQL
+    def build(self, conn):
+        with self._lock:
+            self._building = True
+            self._pending = []
+        start = time.perf_counter()
+        # Cleared before reading, so a write that lands during the build marks it stale again
+        self._stale = False
+        try:
+            data = self._read(conn)
+        except BaseException:
+            with self._lock:
+                self._building = False
+            self._built.set()
+            raise
+        with self._lock:
+            for change in self._pending:
+                data = change(data)
+            self._pending = []
+            self._data = data
+            self._building = False
+            self.build_seconds = time.perf_counter() - start
+        self._built.set()
+
+    def _read(self, conn):
+        cursor = conn.cursor()
+        # Plain tuples, sqlite3.Row objects would double the cost of reading recipe_ingredients
+        cursor.row_factory = None
+        recipes = cursor.execute("SELECT id, name, LOWER(meal_type), prep_time, cook_time FROM recipes ORDER BY id").fetchall()
+        ingredients = {row[0]: (row[1], row[2]) for row in
+                       cursor.execute("SELECT name, unit_of_measurement, density FROM ingredients ORDER BY id")}
+        rows = cursor.execute("SELECT recipe_name, ingredient_name, quantity, unit_of_measurement FROM recipe_ingredients").fetchall()
+        recipe_names, ingredient_names, quantities, recipe_units = zip(*rows) if rows else ((), (), (), ())
+
+        # One column per ingredient name (any case), like the ingredient index
+        columns, names, column_units = {}, [], []
+        for name, (unit, _) in ingredients.items():
+            if name.lower() not in columns:
+                columns[name.lower()] = len(names)
+                names.append(name)
+                column_units.append(unit)
+        positions = {recipe[1]: position for position, recipe in enumerate(recipes)}
+        entry_rows = [positions[name] for name in recipe_names]
+        indices = np.array([columns[name.lower()] for name in ingredient_names], dtype=np.int64)
+        # Amounts are converted with a grid of factors, one per (column, unit), so the per row work is
+        # a lookup; units missing from the units table (-1) pick the NaN column appended last.
+        # The unit table is read over conn, this may run on a background thread.
+        table = units.UnitTable.load(conn, None)
+        unit_positions = [table.positions.get(unit, -1) for unit in recipe_units]
+        factors = table.convert(np.ones(len(names) * len(table.units)), table.units * len(names),
+                                [unit for unit in column_units for _ in table.units],
+                                [ingredients[name][1] for name in names for _ in table.units])
+        factors = np.append(factors.reshape(len(names), len(table.units)), np.full((len(names), 1), np.nan), axis=1)
+
+        entry_rows = np.array(entry_rows, dtype=np.int64)
+        order = np.argsort(entry_rows, kind="stable")
+        indptr = np.zeros(len(recipes) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(entry_rows, minlength=len(recipes)), out=indptr[1:])
+        return {
+            "recipe_ids": np.array([recipe[0] for recipe in recipes], dtype=np.int64),
+            "meal_types": np.array([recipe[2] or "" for recipe in recipes]),
+            # NULL times never match a time range, as in filter_recipes
+            "prep_time": np.array([np.nan if recipe[3] is None else recipe[3] for recipe in recipes], dtype=float),
+            "cook_time": np.array([np.nan if recipe[4] is None else recipe[4] for recipe in recipes], dtype=float),
+            "indptr": indptr,
+            "indices": indices[order],
+            "amounts": (np.array(quantities, dtype=float) * factors[indices, unit_positions])[order],
+            "entry_rows": entry_rows[order],
+            "columns": columns,
+            "names": names,
+            "units": column_units,
+        }
+
+    # Builds the table on a background thread with its own connection (no-op if a build is running)
+    def build_async(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+            self._built.clear()
+
+        def run():
+            conn = database.connect(self.path)
+            try:
+                self.build(conn)
+            except Exception as error:
+                print("Failed to build meal plan recipe table: ", error)
+            finally:
+                conn.close()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    # Returns the current arrays. They are built on first use; once built, a stale table is
+    # served as it is while build_async() replaces it, so no plan waits for a rebuild.
+    def current(self):
+        data = self._data
+        if data is None:
+            with self._lock:
+                building = self._building
+            if building:
+                self._built.wait()
+            if self._data is None:
+                self.build(database.get_connection())
+            return self._data
+        if self._stale:
+            self.build_async()
+        return data
+
+    # Applies change (arrays -> new arrays) to the current arrays, and again to those of the
+    # running build (which may or may not have read the write), so changes must be idempotent
+    def _apply(self, change):
+        with self._lock:
+            if self._building:
+                self._pending.append(change)
+            if self._data is not None:
+                self._data = change(self._data)
+
+    # Appends recipes added after the table was built, reading them over conn
+    def add_recipes(self, conn, recipe_ids):
+        if self._data is None and not self._building:
+            return
+        try:
+            ids = json.dumps(list(recipe_ids))
+            recipes = conn.execute("""SELECT id, name, LOWER(meal_type), prep_time, cook_time FROM recipes
+                                      WHERE id IN (SELECT value FROM json_each(?)) ORDER BY id""", (ids,)).fetchall()
+            entries = conn.execute("""SELECT ri.recipe_name, ri.ingredient_name, ri.quantity, ri.unit_of_measurement,
+                                             i.unit_of_measurement, i.density
+                                      FROM recipe_ingredients AS ri
+                                      JOIN ingredients AS i ON i.name = ri.ingredient_name
+                                      WHERE ri.recipe_name IN (SELECT name FROM recipes
+                                                               WHERE id IN (SELECT value FROM json_each(?)))""",
+                                   (ids,)).fetchall()
+        except sqlite3.Error as error:
+            print(f"Failed to add recipes to the meal plan table: ", error)
+            self.invalidate()
+            return
+        recipes = [tuple(recipe) for recipe in recipes]
+        entries = [tuple(entry) for entry in entries]
+        amounts = units.get_table().convert([entry[2] for entry in entries], [entry[3] for entry in entries],
+                                            [entry[4] for entry in entries], [entry[5] for entry in entries])
+        self._apply(lambda data: self._appended(data, recipes, entries, amounts))
+
+    def _appended(self, data, recipes, entries, amounts):
+        recipe_ids = data["recipe_ids"]
+        recipes = [recipe for recipe in recipes if not _has_recipe(data, recipe[0])]
+        if not recipes:
+            return data
+        if len(recipe_ids) and recipes[0][0] < recipe_ids[-1]:
+            # Rows are kept in id order, an older id (written by another process) needs a rebuild
+            self.invalidate()
+            return data
+        columns, names, column_units = data["columns"], data["names"], data["units"]
+        positions = {recipe[1]: len(recipe_ids) + position for position, recipe in enumerate(recipes)}
+        kept = [k for k, entry in enumerate(entries) if entry[0] in positions]
+        for k in kept:
+            name, unit = entries[k][1], entries[k][4]
+            if name.lower() not in columns:
+                if columns is data["columns"]:
+                    columns, names, column_units = dict(columns), list(names), list(column_units)
+                columns[name.lower()] = len(names)
+                names.append(name)
+                column_units.append(unit)
+        entry_rows = np.array([positions[entries[k][0]] for k in kept], dtype=np.int64)
+        order = np.argsort(entry_rows, kind="stable")
+        counts = np.bincount(entry_rows - len(recipe_ids), minlength=len(recipes))
+        return {
+            "recipe_ids": _extended(recipe_ids, [recipe[0] for recipe in recipes]),
+            "meal_types": _extended(data["meal_types"], [recipe[2] or "" for recipe in recipes]),
+            "prep_time": _extended(data["prep_time"], [np.nan if recipe[3] is None else recipe[3] for recipe in recipes]),
+            "cook_time": _extended(data["cook_time"], [np.nan if recipe[4] is None else recipe[4] for recipe in recipes]),
+            "indptr": _extended(data["indptr"], data["indptr"][-1] + np.cumsum(counts)),
+            "indices": _extended(data["indices"], np.array([columns[entries[k][1].lower()] for k in kept],
+                                                           dtype=np.int64)[order]),
+            "amounts": _extended(data["amounts"], amounts[kept][order]),
+            "entry_rows": _extended(data["entry_rows"], entry_rows[order]),
+            "columns": columns,
+            "names": names,
+            "units": column_units,
+        }
+
+    # Drops removed recipes
+    def remove_recipes(self, recipe_ids):
+        recipe_ids = list(recipe_ids)
+        self._apply(lambda data: _without(data, recipe_ids))
+
+    # Size and build cost of the table
+    def stats(self):
+        data = self._data
+        if data is None:
+            return {"warm": False, "build_seconds": self.build_seconds}
+        return {
+            "warm": not self._stale,
+            "recipes": len(data["recipe_ids"]),
+            "ingredients": len(data["columns"]),
+            "nonzeros": len(data["indices"]),
+            "memory_bytes": sum(value.nbytes for value in data.values() if isinstance(value, np.ndarray)),
+            "build_seconds": self.build_seconds,
+        }
+
+# Returns array with values appended. Written into the spare room of the buffer array starts, when
+# it has enough, so adding one recipe does not copy the whole table: arrays handed out before only
+# cover their own length, so they do not see the new values. Otherwise the values go into a new
+# buffer with room for as many more.
+def _extended(array, values):
+    values = np.asarray(values)
+    size = len(array) + len(values)
+    buffer = array.base
+    if (buffer is not None and buffer.ndim == 1 and buffer.dtype == np.result_type(array, values)
+            and buffer.ctypes.data == array.ctypes.data and len(buffer) >= size):
+        buffer[len(array):size] = values
+        return buffer[:size]
+    buffer = np.empty(2 * size, dtype=np.result_type(array, values))
+    buffer[:len(array)] = array
+    buffer[len(array):size] = values
+    return buffer[:size]
+
+def _has_recipe(data, recipe_id):
+    position = np.searchsorted(data["recipe_ids"], recipe_id)
+    return position < len(data["recipe_ids"]) and data["recipe_ids"][position] == recipe_id
+
+# Copy of the arrays without the rows of recipe_ids (ids it does not have are ignored)
+def _without(data, recipe_ids):
+    positions = np.searchsorted(data["recipe_ids"], recipe_ids)
+    found = positions < len(data["recipe_ids"])
+    found[found] = data["recipe_ids"][positions[found]] == np.asarray(recipe_ids)[found]
+    if not found.any():
+        return data
+    keep = np.ones(len(data["recipe_ids"]), dtype=bool)
+    keep[positions[found]] = False
+    kept_entries = keep[data["entry_rows"]]
+    # Old row -> new row
+    rows = np.cumsum(keep) - 1
+    indptr = np.zeros(int(keep.sum()) + 1, dtype=np.int64)
+    np.cumsum(np.diff(data["indptr"])[keep], out=indptr[1:])
+    return dict(data, recipe_ids=data["recipe_ids"][keep], meal_types=data["meal_types"][keep],
+                prep_time=data["prep_time"][keep], cook_time=data["cook_time"][keep], indptr=indptr,
+                indices=data["indices"][kept_entries], amounts=data["amounts"][kept_entries],
+                entry_rows=rows[data["entry_rows"][kept_entries]])
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+# Returns the recipe table for the current database file
+def get_table():
+    path = database.DB_PATH
+    with _tables_lock:
+        if path not in _tables:
+            _tables[path] = RecipeTable(path)
+        return _tables[path]
+
+# One planning run: the non-expired pantry lots and the simulation of cooking a plan day by day.
+# Meals draw from the lots that expire first (lots without an expiry date last), like
+# recipe_interface.cook_recipe, and only from lots still good on the meal's day. Lots that expire
+# before the plan ends count as wasted for whatever is left of them.
+class _Planner:
+    def __init__(self, data, lots, days, meals, now):
+        self.data = data
+        self.meals = meals
+        self.day_starts = [now + day * SECONDS_PER_DAY for day in range(days)]
+        self.slots = [(day, meal) for day in range(days) for meal in meals]
+
+        self.lot_amounts = [lot["amount"] for lot in lots]
+        self.lot_expiry = [math.inf if lot["expiry_date"] is None else lot["expiry_date"] for lot in lots]
+        self.lot_expiring = [expiry <= now + days * SECONDS_PER_DAY for expiry in self.lot_expiry]
+        columns = data["columns"]
+        self.lot_columns = [columns.get(lot["ingredient_name"].lower(), -1) for lot in lots]
+        self.lots_by_column = {}
+        for lot, column in enumerate(self.lot_columns):
+            self.lots_by_column.setdefault(column, []).append(lot)
+        self._recipes = {}
+
+        # Only recipe entries for stocked ingredients change cost with the pantry; every other
+        # entry is a whole missing ingredient (or nothing, for zero amounts) whatever the plan
+        amounts = data["amounts"]
+        stocked = np.zeros(len(columns), dtype=bool)
+        stocked[[column for column in self.lots_by_column if column >= 0]] = True
+        self.base_cost = MISSING_WEIGHT * np.bincount(data["entry_rows"], weights=(~(amounts <= 0)).astype(float),
+                                                      minlength=len(data["recipe_ids"]))
+        self.stocked = np.flatnonzero(stocked[data["indices"]] & (amounts > 0))
+
+    # Returns [(column, amount)] for every ingredient of recipe row
+    def entries(self, row):
+        start, end = self.data["indptr"][row], self.data["indptr"][row + 1]
+        return list(zip(self.data["indices"][start:end].tolist(), self.data["amounts"][start:end].tolist()))
+
+    # Returns (fixed, entries) for recipe row, where entries are the ingredients the pantry has and
+    # fixed is the missing cost of the others, which does not depend on the plan
+    def recipe(self, row):
+        recipe = self._recipes.get(row)
+        if recipe is None:
+            entries = [(column, amount) for column, amount in self.entries(row) if not amount <= 0]
+            stocked = [(column, amount) for column, amount in entries
+                       if column in self.lots_by_column and not math.isnan(amount)]
+            recipe = self._recipes[row] = (float(len(entries) - len(stocked)), stocked)
+        return recipe
+
+    # Cooks recipe row on day against remaining (lot amounts left), updating remaining if apply
+    # Returns (saved, missing): fractions of expiring lots used and of ingredient amounts not found
+    # details, when given, collects the lots used as (lot, amount) and the shortfalls as (column, amount)
+    def cook(self, remaining, row, day, apply, details=None):
+        saved = 0.0
+        if details is None:
+            missing, entries = self.recipe(row)
+        else:
+            missing, entries = 0.0, self.entries(row)
+        day_start = self.day_starts[day]
+        for column, amount in entries:
+            if math.isnan(amount):
+                missing += 1
+                details["missing"].append((column, None))
+                continue
+            need = amount
+            for lot in self.lots_by_column.get(column, ()):
+                if need <= QUANTITY_EPSILON:
+                    break
+                if self.lot_expiry[lot] <= day_start or remaining[lot] <= QUANTITY_EPSILON:
+                    continue
+                take = min(remaining[lot], need)
+                if self.lot_expiring[lot]:
+                    saved += take / self.lot_amounts[lot]
+                if apply:
+                    remaining[lot] -= take
+                if details is not None:
+                    details["uses"].append((lot, take))
+                need -= take
+            if need > QUANTITY_EPSILON:
+                missing += need / amount
+                if details is not None:
+                    details["missing"].append((column, need))
+        return saved, missing
+
+    # Cost of the plan's slots from first on (recipe row per slot, -1 for an empty slot), cooked
+    # against remaining, the lot amounts left before first. The cost leaves out the constant waste
+    # of every expiring lot: cooking can only lower it.
+    # states, when given, gets (lot amounts left, cost so far) before every slot
+    def cost(self, plan, first=0, remaining=None, states=None):
+        remaining = list(self.lot_amounts if remaining is None else remaining)
+        total = 0.0
+        for slot in range(first, len(plan)):
+            if states is not None:
+                states.append((list(remaining), total))
+            if plan[slot] >= 0:
+                saved, missing = self.cook(remaining, plan[slot], self.slots[slot][0], True)
+                total += MISSING_WEIGHT * missing - WASTE_WEIGHT * saved
+        return total
+
+    # Estimated cost of cooking each recipe on day against remaining, for every recipe at once
+    # Treats an ingredient's expiring stock as one pool, so it is only used to shortlist candidates
+    def estimate(self, remaining, day):
+        data = self.data
+        remaining = np.array(remaining)
+        lot_columns = np.array(self.lot_columns, dtype=np.int64)
+        usable = (np.array(self.lot_expiry) > self.day_starts[day]) & (remaining > QUANTITY_EPSILON) & (lot_columns >= 0)
+        expiring = usable & np.array(self.lot_expiring, dtype=bool)
+        size = len(data["columns"])
+        available = np.bincount(lot_columns[usable], weights=remaining[usable], minlength=size)
+        expiring_amount = np.bincount(lot_columns[expiring], weights=remaining[expiring], minlength=size)
+        expiring_lots = np.bincount(lot_columns[expiring], minlength=size,
+                                    weights=remaining[expiring] / np.array(self.lot_amounts)[expiring])
+        per_unit = np.divide(expiring_lots, expiring_amount, out=np.zeros(size), where=expiring_amount > 0)
+
+        entries = self.stocked
+        columns, amounts = data["indices"][entries], data["amounts"][entries]
+        shortfall = np.maximum(amounts - available[columns], 0) / amounts
+        saved = np.minimum(amounts, expiring_amount[columns]) * per_unit[columns]
+        # Entries counted as wholly missing in base_cost
+        delta = MISSING_WEIGHT * (shortfall - 1) - WASTE_WEIGHT * saved
+        return self.base_cost + np.bincount(data["entry_rows"][entries], weights=delta, minlength=len(self.base_cost))
+
+    # Greedy pass: fills the slots in order, each with the recipe that lowers the cost most given
+    # the meals before it, chosen by exact simulation among the best estimated candidates
+    # Returns (plan, candidates per slot)
+    def greedy(self, allowed):
+        remaining = list(self.lot_amounts)
+        plan, pools, used = [], [], set()
+        for day, meal in self.slots:
+            candidates = allowed.get(meal)
+            if candidates is None or not len(candidates):
+                plan.append(-1)
+                pools.append([])
+                continue
+            estimates = self.estimate(remaining, day)[candidates]
+            count = min(CANDIDATES_PER_MEAL + len(used), len(candidates))
+            shortlist = candidates[np.argpartition(estimates, count - 1)[:count]] if count < len(candidates) else candidates
+            pool = [row for row in shortlist.tolist() if row not in used][:CANDIDATES_PER_MEAL]
+            best, best_cost = -1, math.inf
+            for row in sorted(pool):
+                saved, missing = self.cook(remaining, row, day, False)
+                cost = MISSING_WEIGHT * missing - WASTE_WEIGHT * saved
+                if cost < best_cost - QUANTITY_EPSILON:
+                    best, best_cost = row, cost
+            if best >= 0:
+                self.cook(remaining, best, day, True)
+                used.add(best)
+            plan.append(best)
+            pools.append(pool)
+        return plan, pools
+
+    # Local search: replaces a meal with another candidate for its slot, or swaps the same meal
+    # between two days (which changes what is still fresh when), keeping any change that lowers the
+    # cost, until no change helps or the deadline passes
+    # A trial only re-cooks the slots from the first one it changes, starting from the pantry state
+    # the current plan leaves there
+    def improve(self, plan, pools, deadline):
+        states = []
+        cost = self.cost(plan, states=states)
+
+        def trial_cost(trial, first):
+            remaining, before = states[first]
+            return before + self.cost(trial, first, remaining)
+
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            moves = [(slot, slot, row) for slot, pool in enumerate(pools) for row in pool]
+            moves += [(slot, other, None) for slot in range(len(plan))
+                      for other in range(slot + len(self.meals), len(plan), len(self.meals))]
+            for slot, other, row in moves:
+                if time.perf_counter() >= deadline:
+                    break
+                trial = list(plan)
+                if row is None:
+                    trial[slot], trial[other] = plan[other], plan[slot]
+                elif row not in plan:
+                    trial[slot] = row
+                if trial == plan:
+                    continue
+                if trial_cost(trial, slot) < cost - QUANTITY_EPSILON:
+                    plan, improved = trial, True
+                    states = []
+                    cost = self.cost(plan, states=states)
+        return plan
+
+# Plans days of meals that use up expiring pantry stock and need as little as possible that is
+# not in the pantry. Every slot (day, meal) gets a different recipe of that meal type, within the
+# prep_time and cook_time ranges ((min, max) in minutes, as in recipe_interface.filter_recipes);
+# a slot without any such recipe stays empty.
+# The recipes come from the in-memory RecipeTable and the pantry is read with one query, so no
+# query runs per candidate. A greedy pass builds a plan slot by slot, then a local search swaps
+# meals for up to TIME_BUDGET seconds.
+# Returns Dict[plan:List[Dict[day, meal, recipe, uses, missing]], wasted:List[Dict], cost:Dict],
+# or None if a query fails
+def plan_meals(days, meals=DEFAULT_MEALS, prep_time=None, cook_time=None):
+    conn = database.get_connection()
+    now = round(time.time())
+    amount = migrations.convert_sql("p.quantity", "COALESCE(p.unit_of_measurement, i.unit_of_measurement)",
+                                    "i.unit_of_measurement", "i.density")
+    try:
+        data = get_table().current()
+        lots = conn.execute(f"""SELECT p.id, p.ingredient_name, p.expiry_date, {amount} AS amount,
+                                      i.unit_of_measurement AS unit
+                               FROM pantry AS p
+                               JOIN ingredients AS i ON i.name = p.ingredient_name
+                               WHERE (p.expiry_date IS NULL OR p.expiry_date > ?) AND p.quantity > 0
+                               ORDER BY p.ingredient_name, p.expiry_date NULLS LAST, p.id""", (now,)).fetchall()
+    except sqlite3.Error as error:
+        print(f"Failed to plan meals: ", error)
+        return None
+    # Lots in a unit that cannot be converted are left out
+    lots = [lot for lot in lots if lot["amount"] is not None and lot["amount"] > 0]
+    start = time.perf_counter()
+    planner = _Planner(data, lots, days, meals, now)
+
+    eligible = np.ones(len(data["recipe_ids"]), dtype=bool)
+    for times, limits in ((data["prep_time"], prep_time), (data["cook_time"], cook_time)):
+        if limits:
+            eligible &= (times >= float(limits[0])) & (times <= float(limits[1]))
+    allowed = {meal: np.flatnonzero(eligible & (data["meal_types"] == meal)) for meal in set(meals)}
+
+    plan, pools = planner.greedy(allowed)
+    plan = planner.improve(plan, pools, start + TIME_BUDGET)
+
+    try:
+        chosen = [int(data["recipe_ids"][row]) for row in plan if row >= 0]
+        recipes = {recipe["id"]: dict(recipe) for recipe in conn.execute(
+            "SELECT * FROM recipes WHERE id IN (SELECT value FROM json_each(?))", (json.dumps(chosen),))}
+    except sqlite3.Error as error:
+        print(f"Failed to plan meals: ", error)
+        return None
+
+    names, column_units = data["names"], data["units"]
+    remaining = list(planner.lot_amounts)
+    entries = []
+    saved_total = missing_total = 0.0
+    for (day, meal), row in zip(planner.slots, plan):
+        entry = {"day": day, "meal": meal, "recipe": None, "uses": [], "missing": []}
+        if row >= 0:
+            details = {"uses": [], "missing": []}
+            saved, missing = planner.cook(remaining, row, day, True, details)
+            saved_total += saved
+            missing_total += missing
+            entry["recipe"] = recipes.get(int(data["recipe_ids"][row]))
+            entry["uses"] = [{"id": lots[lot]["id"], "ingredient_name": lots[lot]["ingredient_name"],
+                              "quantity": round(take, 4), "unit_of_measurement": lots[lot]["unit"]}
+                             for lot, take in details["uses"]]
+            entry["missing"] = [{"ingredient_name": names[column],
+                                 "quantity": None if need is None else round(need, 4),
+                                 "unit_of_measurement": column_units[column]}
+                                for column, need in details["missing"]]
+        entries.append(entry)
+
+    wasted = [{"id": lot["id"], "ingredient_name": lot["ingredient_name"], "quantity": round(remaining[i], 4),
+               "unit_of_measurement": lot["unit"], "expiry_date": lot["expiry_date"]}
+              for i, lot in enumerate(lots) if planner.lot_expiring[i] and remaining[i] > QUANTITY_EPSILON]
+    wasted_lots = sum(remaining[i] / planner.lot_amounts[i] for i in range(len(lots)) if planner.lot_expiring[i])
+    return {"days": days, "meals": list(meals), "plan": entries, "wasted": wasted,
+            "cost": {"wasted_lots": round(wasted_lots, 4), "missing": round(missing_total, 4)},
+            "seconds": round(time.perf_counter() - start, 4)}
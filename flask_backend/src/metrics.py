@@ -0,0 +1,271 @@
+from bisect import bisect_left
+from collections import deque
+import os
+import sqlite3
+import threading
+import time
+
+# Process-wide request, query and LLM call metrics, rendered in the Prometheus text format at /metrics
+# Queries are timed by the Connection and Cursor classes below, which database.connect() hands to
+# sqlite3.connect() as its factory. Durations cover execute() up to the first result row, rows
+# fetched afterwards are not included.
+
+# Queries slower than this are kept in the slow query log (SLOW_QUERY_MS, milliseconds)
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_MS", 100)) / 1000
+# Slow queries remembered, oldest dropped first
+SLOW_QUERY_LOG_SIZE = 100
+# Longest SQL / parameters text kept per slow query
+SLOW_QUERY_TEXT = 500
+
+# Bucket upper bounds (seconds unless noted)
+REQUEST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        with self._lock:
+            return self._values.get(labels, 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labels, labels)} {_number(value)}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=REQUEST_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last, not cumulative), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    # Returns (count, sum) of the series
+    def summary(self, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            return (sum(series[0]), series[1]) if series else (0, 0.0)
+
+    # Returns (count, sum) over every series
+    def total(self):
+        with self._lock:
+            return (sum(sum(counts) for counts, _ in self._series.values()),
+                    sum(total for _, total in self._series.values()))
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._series.items())
+        for labels, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(self.labels, labels, [('le', _number(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+REQUESTS = Counter("recipeapp_http_requests_total", "HTTP requests by route and status.",
+                   ("method", "route", "status"))
+REQUEST_SECONDS = Histogram("recipeapp_http_request_duration_seconds", "HTTP request latency.",
+                            ("method", "route"), REQUEST_BUCKETS)
+REQUEST_QUERIES = Histogram("recipeapp_http_request_queries", "SQLite queries run per HTTP request.",
+                            ("method", "route"), QUERY_COUNT_BUCKETS)
+REQUEST_QUERY_SECONDS = Histogram("recipeapp_http_request_query_seconds", "Time spent in SQLite per HTTP request.",
+                                  ("method", "route"), REQUEST_BUCKETS)
+QUERY_SECONDS = Histogram("recipeapp_sqlite_query_duration_seconds", "SQLite query latency by statement type.",
+                          ("statement",), QUERY_BUCKETS)
+SLOW_QUERIES = Counter("recipeapp_sqlite_slow_queries_total", "SQLite queries slower than the slow query threshold.")
+LLM_SECONDS = Histogram("recipeapp_llm_request_duration_seconds",
+                        "Completion API latency until the response (or its first bytes when streaming), retries included.",
+                        ("stream", "outcome"), LLM_BUCKETS)
+
+METRICS = (REQUESTS, REQUEST_SECONDS, REQUEST_QUERIES, REQUEST_QUERY_SECONDS, QUERY_SECONDS, SLOW_QUERIES, LLM_SECONDS)
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_slow_lock = threading.Lock()
+
+# Queries run by the request on this thread (Flask serves each request on a single thread)
+class _RequestState(threading.local):
+    active = False
+    route = None
+    queries = 0
+    query_seconds = 0.0
+    start = 0.0
+
+_request = _RequestState()
+
+# Statement type labels by SQL text (the app runs a small, fixed set of statements)
+_statements = {}
+
+# Statement type label: the first keyword of the SQL
+def _statement(sql):
+    label = _statements.get(sql)
+    if label is None:
+        keyword = sql.split(None, 1)[0].upper() if sql.strip() else ""
+        label = keyword if keyword in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "PRAGMA") else "OTHER"
+        if len(_statements) < 10_000:
+            _statements[sql] = label
+    return label
+
+def _truncate(text):
+    return text if len(text) <= SLOW_QUERY_TEXT else text[:SLOW_QUERY_TEXT] + "..."
+
+# Records one query (called by the Connection and Cursor classes)
+def record_query(sql, parameters, seconds):
+    QUERY_SECONDS.observe(seconds, _statement(sql))
+    in_request = _request.active
+    if in_request:
+        _request.queries += 1
+        _request.query_seconds += seconds
+    if seconds >= SLOW_QUERY_SECONDS:
+        SLOW_QUERIES.inc()
+        entry = {"sql": _truncate(" ".join(sql.split())), "parameters": _truncate(repr(parameters)),
+                 "ms": round(seconds * 1000, 3), "route": _request.route if in_request else None,
+                 "time": round(time.time(), 3)}
+        with _slow_lock:
+            _slow_queries.append(entry)
+        print(f"Slow query ({entry['ms']} ms): {entry['sql']} {entry['parameters']}")
+
+_perf_counter = time.perf_counter
+_execute = sqlite3.Cursor.execute
+_executemany = sqlite3.Cursor.executemany
+_cursor = sqlite3.Connection.cursor
+
+class Cursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = _perf_counter()
+        try:
+            return _execute(self, sql, parameters)
+        finally:
+            record_query(sql, parameters, _perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not isinstance(seq_of_parameters, (list, tuple)):
+            # Materialized so the slow query log can show them (generators can only be read once)
+            seq_of_parameters = list(seq_of_parameters)
+        start = _perf_counter()
+        try:
+            return _executemany(self, sql, seq_of_parameters)
+        finally:
+            record_query(sql, seq_of_parameters, _perf_counter() - start)
+
+    def executescript(self, sql_script):
+        start = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            record_query(sql_script, (), time.perf_counter() - start)
+
+# sqlite3.Connection.execute() and friends create a plain cursor internally, so they are routed
+# through Cursor here
+class Connection(sqlite3.Connection):
+    def cursor(self, factory=Cursor):
+        return _cursor(self, factory)
+
+    def execute(self, sql, parameters=()):
+        return _cursor(self, Cursor).execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return _cursor(self, Cursor).executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        return _cursor(self, Cursor).executescript(sql_script)
+
+# Starts counting the queries of the request on this thread
+def start_request(route):
+    _request.active = True
+    _request.route = route
+    _request.queries = 0
+    _request.query_seconds = 0.0
+    _request.start = time.perf_counter()
+
+# Stops counting and records the request
+# Returns (seconds, queries, query_seconds), or None if no request was started on this thread
+def finish_request(method, status):
+    if not _request.active:
+        return None
+    _request.active = False
+    seconds = time.perf_counter() - _request.start
+    REQUESTS.inc(method, _request.route, str(status))
+    REQUEST_SECONDS.observe(seconds, method, _request.route)
+    REQUEST_QUERIES.observe(_request.queries, method, _request.route)
+    REQUEST_QUERY_SECONDS.observe(_request.query_seconds, method, _request.route)
+    return seconds, _request.queries, _request.query_seconds
+
+# Records one completion API call
+# outcome: ok, error or circuit_open
+def record_llm_call(seconds, stream, outcome):
+    LLM_SECONDS.observe(seconds, "true" if stream else "false", outcome)
+
+# Returns the slow query log, oldest first
+def slow_queries():
+    with _slow_lock:
+        return list(_slow_queries)
+
+# All metrics in the Prometheus text format
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def stats():
+    count, total = QUERY_SECONDS.total()
+    return {"queries": count, "query_seconds": round(total, 6), "slow_query_ms": SLOW_QUERY_SECONDS * 1000,
+            "slow_queries": slow_queries()}
+
+# Clears every metric and the slow query log (tests)
+def reset():
+    for metric in METRICS:
+        metric.reset()
+    with _slow_lock:
+        _slow_queries.clear()
@@ -0,0 +1,330 @@
+import sqlite3
+
+# Versioned schema migrations
+# The applied version is stored in PRAGMA user_version. upgrade() runs every step above it in order,
+# each inside its own transaction. Steps are idempotent (IF NOT EXISTS) so they are safe to run against
+# databases, like pantry.db, that were created before versioning existed.
+
+# Version 1: the original tables (see recipe_interface.create_tables for what each one stores)
+BASELINE = (
+    """CREATE TABLE IF NOT EXISTS units (
+        id INTEGER PRIMARY KEY,
+        unit TEXT NOT NULL UNIQUE
+        ) STRICT""",
+    """CREATE TABLE IF NOT EXISTS ingredients (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        serving_size REAL NOT NULL,
+        unit_of_measurement TEXT NOT NULL REFERENCES units(unit),
+        calories REAL,
+        total_fat REAL,
+        sodium REAL,
+        total_carbohydrate REAL,
+        total_sugars REAL,
+        protein REAL,
+        cost REAL,
+        shelf_life INTEGER
+        ) STRICT""",
+    """CREATE TABLE IF NOT EXISTS pantry (
+        id INTEGER PRIMARY KEY,
+        ingredient_name TEXT NOT NULL REFERENCES ingredients(name),
+        quantity REAL NOT NULL,
+        purchase_date INTEGER DEFAULT (unixepoch()),
+        expiry_date INTEGER
+        ) STRICT""",
+    """CREATE TABLE IF NOT EXISTS recipes (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        meal_type TEXT,
+        prep_time INTEGER,
+        cook_time INTEGER,
+        instructions TEXT NOT NULL,
+        servings INTEGER NOT NULL DEFAULT (1)
+        ) STRICT""",
+    """CREATE TABLE IF NOT EXISTS recipe_ingredients (
+        recipe_name TEXT NOT NULL REFERENCES recipes(name) ON DELETE CASCADE,
+        ingredient_name TEXT NOT NULL REFERENCES ingredients(name),
+        quantity REAL NOT NULL,
+        unit_of_measurement TEXT NOT NULL REFERENCES units(unit),
+        PRIMARY KEY (recipe_name, ingredient_name)
+        ) STRICT""",
+)
+
+# Version 2: indexes for every hot lookup
+# Case-insensitive name lookups (WHERE LOWER(name) = ?) are served by indexes on the normalized
+# expression rather than extra columns, since generated columns would show up in every SELECT *.
+# pantry(ingredient_name) and recipe_ingredients(ingredient_name) also back the foreign key checks
+# SQLite runs when an ingredient is deleted.
+LOOKUP_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_ingredients_name_lower ON ingredients(LOWER(name))",
+    "CREATE INDEX IF NOT EXISTS idx_recipes_name_lower ON recipes(LOWER(name))",
+    "CREATE INDEX IF NOT EXISTS idx_recipes_meal_type_lower ON recipes(LOWER(meal_type))",
+    "CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_recipe_name_lower ON recipe_ingredients(LOWER(recipe_name))",
+    "CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_ingredient_name ON recipe_ingredients(ingredient_name)",
+    "CREATE INDEX IF NOT EXISTS idx_pantry_expiry_date ON pantry(expiry_date)",
+    "CREATE INDEX IF NOT EXISTS idx_pantry_ingredient_name ON pantry(ingredient_name)",
+)
+
+# Version 3: persistent cache of LLM recipe generations (see llm_cache.py)
+LLM_CACHE = (
+    """CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        response TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        last_used INTEGER NOT NULL
+        ) STRICT""",
+    "CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used)",
+)
+
+# Version 4: full-text index over recipe names and instructions (see recipe_interface.search_recipes)
+# External content table: the text lives only in recipes, triggers keep the index in step with it
+RECIPES_FTS = (
+    """CREATE VIRTUAL TABLE IF NOT EXISTS recipes_fts USING fts5(
+        name, instructions, content='recipes', content_rowid='id', tokenize='porter unicode61'
+        )""",
+    """CREATE TRIGGER IF NOT EXISTS recipes_fts_insert AFTER INSERT ON recipes BEGIN
+        INSERT INTO recipes_fts (rowid, name, instructions) VALUES (new.id, new.name, new.instructions);
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS recipes_fts_delete AFTER DELETE ON recipes BEGIN
+        INSERT INTO recipes_fts (recipes_fts, rowid, name, instructions) VALUES ('delete', old.id, old.name, old.instructions);
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS recipes_fts_update AFTER UPDATE OF name, instructions ON recipes BEGIN
+        INSERT INTO recipes_fts (recipes_fts, rowid, name, instructions) VALUES ('delete', old.id, old.name, old.instructions);
+        INSERT INTO recipes_fts (rowid, name, instructions) VALUES (new.id, new.name, new.instructions);
+        END""",
+    # Index the recipes that existed before this migration
+    "INSERT INTO recipes_fts (recipes_fts) VALUES ('rebuild')",
+)
+
+# Version 5: covering index for joins from ingredients to the recipes that use them
+# (recipe_interface.recommend_expiring reads recipe_name and quantity without touching the table);
+# it replaces the plain ingredient_name index, which is a prefix of it
+RECIPE_INGREDIENTS_COVERING = (
+    """CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_ingredient_covering
+        ON recipe_ingredients(ingredient_name, recipe_name, quantity)""",
+    "DROP INDEX IF EXISTS idx_recipe_ingredients_ingredient_name",
+)
+
+# Version 6: nutrition totals per recipe (see recipe_interface._nutrition_by_recipe)
+# An ingredient's nutrients are given per serving_size of its unit_of_measurement, so a recipe
+# ingredient contributes quantity / serving_size servings of them; amounts in another unit cannot be
+# converted and are counted in unconverted instead. recipe_nutrition materializes the totals so the
+# calorie and protein filters are index range scans. Triggers keep it current: adding, changing or
+# removing a recipe ingredient adds or subtracts that one row's contribution (so inserting a recipe's
+# k ingredients costs k small updates, not k recomputations), while a change to a recipe's servings
+# or to an ingredient's nutrition recomputes the recipes affected.
+# recipe_nutrition_live computes the same totals on the fly, e.g. to check the table against it.
+NUTRIENT_COLUMNS = ("calories", "total_fat", "sodium", "total_carbohydrate", "total_sugars", "protein", "cost")
+
+# Servings of ingredient i used by the recipe ingredient row, NULL if the units differ
+def _servings_used(row):
+    return f"""CASE WHEN {row}.unit_of_measurement = i.unit_of_measurement AND i.serving_size > 0
+                    THEN {row}.quantity / i.serving_size END"""
+
+# Totals of the recipes matching where (a condition on recipes AS r)
+def _nutrition_query(where, servings_used=_servings_used):
+    used = servings_used("ri")
+    totals = ", ".join(f"TOTAL({used} * i.{column}) AS {column}" for column in NUTRIENT_COLUMNS)
+    return f"""SELECT r.id AS recipe_id, r.servings, {totals},
+               COUNT(ri.ingredient_name) - COUNT({used}) AS unconverted
+        FROM recipes AS r
+        LEFT JOIN recipe_ingredients AS ri ON ri.recipe_name = r.name
+        LEFT JOIN ingredients AS i ON i.name = ri.ingredient_name
+        WHERE {where}
+        GROUP BY r.id"""
+
+# Recomputes the rows of the recipes matching where
+def _refresh_nutrition(where, servings_used=_servings_used):
+    return f"""INSERT OR REPLACE INTO recipe_nutrition (recipe_id, servings, {", ".join(NUTRIENT_COLUMNS)}, unconverted)
+        {_nutrition_query(where, servings_used)}"""
+
+# Adds (sign "+") or subtracts (sign "-") the contribution of one recipe_ingredients row (new or old)
+def _apply_nutrition(row, sign, servings_used=_servings_used):
+    used = servings_used(row)
+    deltas = ", ".join(f"{column} = recipe_nutrition.{column} {sign} IFNULL(({used}) * i.{column}, 0)"
+                       for column in NUTRIENT_COLUMNS)
+    # Triggers do not allow an alias on the updated table
+    return f"""UPDATE recipe_nutrition
+        SET {deltas}, unconverted = recipe_nutrition.unconverted {sign} (({used}) IS NULL)
+        FROM recipes AS r, ingredients AS i
+        WHERE r.name = {row}.recipe_name AND recipe_nutrition.recipe_id = r.id AND i.name = {row}.ingredient_name"""
+
+# The view and triggers that keep recipe_nutrition current
+# ingredient_columns: ingredients columns whose change recomputes the recipes using the ingredient
+def _nutrition_upkeep(servings_used, ingredient_columns):
+    return (
+        f"CREATE VIEW IF NOT EXISTS recipe_nutrition_live AS {_nutrition_query('1', servings_used)}",
+        f"""CREATE TRIGGER IF NOT EXISTS recipe_nutrition_recipe_insert AFTER INSERT ON recipes BEGIN
+        {_refresh_nutrition("r.id = new.id", servings_used)};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS recipe_nutrition_recipe_update AFTER UPDATE OF servings ON recipes BEGIN
+        {_refresh_nutrition("r.id = new.id", servings_used)};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS recipe_nutrition_ingredient_insert AFTER INSERT ON recipe_ingredients BEGIN
+        {_apply_nutrition("new", "+", servings_used)};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS recipe_nutrition_ingredient_delete AFTER DELETE ON recipe_ingredients BEGIN
+        {_apply_nutrition("old", "-", servings_used)};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS recipe_nutrition_ingredient_update AFTER UPDATE ON recipe_ingredients BEGIN
+        {_apply_nutrition("old", "-", servings_used)};
+        {_apply_nutrition("new", "+", servings_used)};
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS recipe_nutrition_nutrients_update
+        AFTER UPDATE OF {", ".join(ingredient_columns)} ON ingredients BEGIN
+        {_refresh_nutrition("r.name IN (SELECT recipe_name FROM recipe_ingredients WHERE ingredient_name = new.name)",
+                            servings_used)};
+        END""",
+    )
+
+RECIPE_NUTRITION = (
+    f"""CREATE TABLE IF NOT EXISTS recipe_nutrition (
+        recipe_id INTEGER PRIMARY KEY REFERENCES recipes(id) ON DELETE CASCADE,
+        servings INTEGER NOT NULL,
+        {" ".join(f"{column} REAL NOT NULL," for column in NUTRIENT_COLUMNS)}
+        unconverted INTEGER NOT NULL,
+        calories_per_serving REAL GENERATED ALWAYS AS (calories / servings) STORED,
+        protein_per_serving REAL GENERATED ALWAYS AS (protein / servings) STORED
+        ) STRICT""",
+    "CREATE INDEX IF NOT EXISTS idx_recipe_nutrition_calories ON recipe_nutrition(calories_per_serving)",
+    "CREATE INDEX IF NOT EXISTS idx_recipe_nutrition_protein ON recipe_nutrition(protein_per_serving)",
+    *_nutrition_upkeep(_servings_used, ("serving_size", "unit_of_measurement") + NUTRIENT_COLUMNS),
+    # Totals for the recipes that existed before this migration
+    _refresh_nutrition("1"),
+)
+
+# Version 7: unit conversion (see units.py)
+# unit_factors gives the size of each volume unit in ml and of each mass unit in g; units without a
+# row (clove(s), piece(s)) only convert to themselves. ingredients.density (g per ml) converts an
+# ingredient between volume and mass, and pantry.unit_of_measurement is the unit a lot is measured
+# in (NULL: the ingredient's unit, as before). Nutrition totals now convert recipe amounts to the
+# ingredient's serving unit, so the view and triggers of version 6 are recreated and every recipe
+# recomputed. recipe_interface.recommend_expiring converts too, so its covering index gains the unit.
+UNIT_FACTORS = (
+    ("ml", "volume", 1.0), ("L", "volume", 1000.0), ("tsp.", "volume", 4.92892), ("tbsp.", "volume", 14.7868),
+    ("cup(s)", "volume", 236.588), ("fl oz", "volume", 29.5735), ("pint(s)", "volume", 473.176),
+    ("g", "mass", 1.0), ("lb", "mass", 453.592), ("oz", "mass", 28.3495),
+)
+
+# SQL expression converting quantity from from_unit to to_unit (all three SQL expressions) with
+# unit_factors; NULL when the units are not convertible. density (g per ml, an SQL expression) is
+# only used between volume and mass.
+# Both units are looked up for every row the expression is evaluated on, so code that converts
+# many rows (recommend_expiring, plan_meals) reads them and converts with units.UnitTable instead;
+# this is for the few rows of one recipe (cook_recipe, the nutrition triggers).
+def convert_sql(quantity, from_unit, to_unit, density="NULL"):
+    return f"""(CASE WHEN {from_unit} = {to_unit} THEN {quantity}
+        ELSE {quantity} * (SELECT f.to_base / t.to_base * CASE WHEN f.family = t.family THEN 1.0
+                                 WHEN f.family = 'volume' AND t.family = 'mass' THEN {density}
+                                 WHEN f.family = 'mass' AND t.family = 'volume' THEN 1.0 / {density} END
+                           FROM unit_factors AS f, unit_factors AS t
+                           WHERE f.unit = {from_unit} AND t.unit = {to_unit}) END)"""
+
+# Servings of ingredient i used by the recipe ingredient row, converted to the ingredient's unit
+def _servings_converted(row):
+    quantity = convert_sql(f"{row}.quantity", f"{row}.unit_of_measurement", "i.unit_of_measurement", "i.density")
+    return f"CASE WHEN i.serving_size > 0 THEN {quantity} / i.serving_size END"
+
+# Adds a column unless it exists (ALTER TABLE has no IF NOT EXISTS)
+def _add_column(conn, table, column, definition):
+    if column not in [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]:
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+def _unit_conversion(conn):
+    conn.execute("""CREATE TABLE IF NOT EXISTS unit_factors (
+        unit TEXT PRIMARY KEY,
+        family TEXT NOT NULL,
+        to_base REAL NOT NULL
+        ) STRICT""")
+    conn.executemany("INSERT OR IGNORE INTO unit_factors (unit, family, to_base) VALUES (?, ?, ?)", UNIT_FACTORS)
+    _add_column(conn, "ingredients", "density", "REAL")
+    _add_column(conn, "pantry", "unit_of_measurement", "TEXT REFERENCES units(unit)")
+    conn.execute("""CREATE INDEX IF NOT EXISTS idx_recipe_ingredients_ingredient_units
+                 ON recipe_ingredients(ingredient_name, recipe_name, quantity, unit_of_measurement)""")
+    conn.execute("DROP INDEX IF EXISTS idx_recipe_ingredients_ingredient_covering")
+
+    conn.execute("DROP VIEW IF EXISTS recipe_nutrition_live")
+    for trigger in ("recipe_insert", "recipe_update", "ingredient_insert", "ingredient_delete",
+                    "ingredient_update", "nutrients_update"):
+        conn.execute(f"DROP TRIGGER IF EXISTS recipe_nutrition_{trigger}")
+    for statement in _nutrition_upkeep(_servings_converted,
+                                       ("serving_size", "unit_of_measurement", "density") + NUTRIENT_COLUMNS):
+        conn.execute(statement)
+    conn.execute(_refresh_nutrition("1", _servings_converted))
+
+# Ordered list of migrations, version i + 1 is MIGRATIONS[i]
+# A step is either a tuple of SQL statements or a function taking the connection
+MIGRATIONS = [
+    BASELINE,
+    LOOKUP_INDEXES,
+    LLM_CACHE,
+    RECIPES_FTS,
+    RECIPE_INGREDIENTS_COVERING,
+    RECIPE_NUTRITION,
+    _unit_conversion,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# Returns the version recorded in the database
+def get_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+# Applies every migration newer than the database's recorded version
+# Each step takes the write lock (BEGIN IMMEDIATE) and re-reads the version first,
+# so concurrent processes upgrading the same file apply each step once.
+def upgrade(conn):
+    if conn.in_transaction:
+        conn.commit()
+    while get_version(conn) < SCHEMA_VERSION:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = get_version(conn)
+            if version >= SCHEMA_VERSION:
+                conn.rollback()
+                break
+            step = MIGRATIONS[version]
+            if callable(step):
+                step(conn)
+            else:
+                for statement in step:
+                    conn.execute(statement)
+            # PRAGMA does not accept bound parameters
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+
+# Representative forms of the queries recipe_interface runs on every request
+# check_query_plans() verifies each one is answered through an index
+HOT_QUERIES = {
+    "get_ingredient": ("SELECT * FROM ingredients WHERE LOWER(name) = ?", ("garlic",)),
+    "get_from_pantry": ("SELECT * FROM pantry WHERE id = ?", (1,)),
+    "get_recipe": ("SELECT * FROM recipes WHERE LOWER(name) = ?", ("fried eggs",)),
+    "get_recipe_ingredients": ("SELECT * FROM recipe_ingredients WHERE LOWER(recipe_name) = ?", ("fried eggs",)),
+    "filter_recipes_meal_type": ("SELECT * FROM recipes AS r WHERE LOWER(r.meal_type) = ? ORDER BY r.id", ("lunch",)),
+    "filter_recipes_ingredients": ("""SELECT * FROM recipe_ingredients WHERE recipe_name IN (SELECT value FROM json_each(?))
+                                   ORDER BY recipe_name, ingredient_name""", ('["Fried Eggs"]',)),
+    "recipes_using_ingredient": ("SELECT recipe_name FROM recipe_ingredients WHERE ingredient_name = ?", ("Garlic",)),
+    "pantry_available": ("SELECT ingredient_name FROM pantry WHERE expiry_date IS NULL OR expiry_date > ?", (0,)),
+    "pantry_by_ingredient": ("SELECT * FROM pantry WHERE ingredient_name = ?", ("Garlic",)),
+    "get_expiring": ("SELECT ingredient_name FROM pantry WHERE expiry_date >= ? AND expiry_date < ?", (0, 1)),
+    "get_expired": ("SELECT ingredient_name FROM pantry WHERE expiry_date < ?", (0,)),
+    "search_recipes": ("""SELECT r.* FROM recipes_fts JOIN recipes AS r ON r.id = recipes_fts.rowid
+                       WHERE recipes_fts MATCH ? ORDER BY rank""", ('"eggs"*',)),
+    "filter_recipes_calories": ("SELECT recipe_id FROM recipe_nutrition WHERE calories_per_serving BETWEEN ? AND ?", (0, 500)),
+    "filter_recipes_protein": ("SELECT recipe_id FROM recipe_nutrition WHERE protein_per_serving BETWEEN ? AND ?", (20, 50)),
+}
+
+# Runs EXPLAIN QUERY PLAN for each of HOT_QUERIES
+# Returns {query name: [plan steps]} for queries that fall back to a full table scan (empty when all are indexed)
+def check_query_plans(conn, queries=HOT_QUERIES):
+    unindexed = {}
+    for name, (sql, params) in queries.items():
+        plan = [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+        scans = [step for step in plan if step.startswith("SCAN ") and "VIRTUAL TABLE" not in step
+                 and "INDEX" not in step]
+        if scans:
+            unindexed[name] = plan
+    return unindexed
@@ -0,0 +1,213 @@
+import math
+import os
+import re
+import threading
+from . import catalog
+from . import ingredient_index
+
+# Upper bound on the estimated size of the prompt (system and user message together)
+PROMPT_TOKEN_BUDGET = int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", 1500))
+# At most this many catalog ingredients are offered beyond the ones in the pantry
+MAX_CATALOG_INGREDIENTS = int(os.getenv("LLM_PROMPT_MAX_INGREDIENTS", 50))
+# Rough size of a token for English text and ingredient lists
+CHARS_PER_TOKEN = 4
+
+SYSTEM_PROMPT = """You are a helpful assistant that generates detailed recipes based on a provided list of ingredients.
+Please adhere to the following guidelines:
+1. Prioritise using mostly just the ingredients from the user's pantry.
+   If needed, you can also use the AVAILABLE INGREDIENTS listed below. USE NOTHING ELSE.
+2. Include a list of the required ingredients for the recipe. You MUST use EXACTLY the SAME name and SAME spelling as provided.
+3. Provide clear, step-by-step cooking instructions.
+4. Estimate approximate cooking/preparation times.
+{exclusions}
+Combine them in a way that results in a balanced, flavorful dish, and detail the recipe thoroughly.
+
+Finally, please return the recipe title, ingredients, and instructions in JSON format, with ABSOLUTELY NO backslashes or comments.
+
+The JSON should look like this:
+For ingredient, copy LETTER FOR LETTER one of the AVAILABLE INGREDIENTS.
+For quantity, you MUST ONLY use an integer or decimal numbers, NO fractions, NO units and NO strings.
+For unit, copy LETTER FOR LETTER one of the following keys: {units}. If there is no appropriate unit, default to using "piece(s)".
+{{
+    "title": "Recipe Title",
+    "ingredients": [
+        ["Ingredient 1", "quantity", "unit"],
+        ["Ingredient 2", "quantity", "unit"],
+        ...
+    ],
+    "instructions": [
+        "Step 1",
+        "Step 2",
+        ...
+    ],
+    "meal_type": (breakfast, lunch, dinner or snack)
+    "prep_time": "X minutes",
+    "cook_time": "Y minutes"
+}}
+
+Only include the ingredients under ONE LIST. Make sure any information about cooking time is included as a bullet point under instructions.
+You MUST use the format provided above.
+
+AVAILABLE INGREDIENTS: {ingredients}"""
+
+_stats_lock = threading.Lock()
+_requests = 0
+_estimated_tokens = 0
+_reported_tokens = 0
+_last = None
+
+
+def estimate_tokens(text):
+    """
+    Estimates how many tokens a piece of text costs.
+
+    No tokenizer for the hosted model is available locally, so this uses the usual
+    characters-per-token approximation. The API's own count is recorded too when it
+    reports one (see record_usage()).
+
+    Args:
+        text (str): The text to measure.
+
+    Returns:
+        int: The estimated token count.
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def pantry_names(user_question):
+    """
+    Extracts the ingredient names from a pantry summary.
+
+    Accepts both a comma separated list ("eggs, milk") and the output of
+    `llm_interface.get_pantry_summary()` ("Eggs: 12.0 piece(s) total in pantry" per line).
+
+    Args:
+        user_question (str): The pantry summary sent to the LLM.
+
+    Returns:
+        list of str: Lowercase ingredient names, deduplicated, in order of appearance.
+    """
+    names = []
+    for item in re.split(r"[,\n]", str(user_question)):
+        name = item.split(":", 1)[0].strip().lower()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def relevant_ingredients(pantry, k=MAX_CATALOG_INGREDIENTS):
+    """
+    Picks the catalog ingredients worth offering the LLM for a pantry.
+
+    Pantry items that exist in the catalog come first, followed by up to `k` other ingredients
+    ranked by how many recipes they share with the pantry (from the in-memory ingredient index).
+    While the index is still cold, or when it yields fewer than `k` names, the list is padded
+    with other catalog ingredients in insertion order.
+
+    Args:
+        pantry (list of str): Lowercase pantry ingredient names.
+        k (int): Maximum number of ingredients to add beyond the pantry.
+
+    Returns:
+        list of str: Lowercase ingredient names, most relevant first.
+    """
+    snapshot = catalog.get_snapshot()
+    known = [name for name in pantry if name in snapshot.ingredients]
+
+    index = ingredient_index.get_index()
+    if index.warm:
+        related = index.co_occurring(pantry, k)
+    else:
+        index.build_async()
+        related = []
+    if len(related) < k:
+        skip = set(pantry).union(related)
+        for name in snapshot.ingredient_names:
+            if len(related) >= k:
+                break
+            if name.lower() not in skip:
+                related.append(name.lower())
+    return known + related
+
+
+def build_messages(user_question, user_preference=None, exclude=(), budget=None, k=MAX_CATALOG_INGREDIENTS):
+    """
+    Builds the chat messages for a recipe generation within a token budget.
+
+    The prompt lists the units, the pantry ingredients and the most relevant catalog
+    ingredients (see relevant_ingredients()), adding ingredients in order of relevance
+    until the estimated prompt size reaches `budget`. Its size therefore no longer grows
+    with the catalog or with the number of saved recipes. The pantry summary itself is
+    always sent in full. Units and names come from the in-process catalog snapshot.
+
+    Args:
+        user_question (str): A summary of the ingredients available in the user's pantry.
+        user_preference (str, optional): User's preferred style or cuisine for the recipe.
+        exclude (iterable of str): Recipe titles the LLM must not produce (e.g. ones that already exist).
+        budget (int, optional): Token budget, defaults to PROMPT_TOKEN_BUDGET.
+        k (int): Maximum number of catalog ingredients beyond the pantry.
+
+    Returns:
+        tuple: (messages, info) where messages is the list for the chat completions API and info
+            is a dict with the estimated "prompt_tokens" and the number of "ingredients" offered.
+    """
+    budget = PROMPT_TOKEN_BUDGET if budget is None else budget
+    units = catalog.get_snapshot().units
+    exclusions = ""
+    if exclude:
+        exclusions = f"5. Do NOT generate any of these existing recipes: {', '.join(exclude)}.\n"
+
+    user_content = "Here is a summary of the ingredients in my pantry:\n" + str(user_question)
+    if user_preference:
+        user_content = "Please make the recipe in this style: " + str(user_preference) + "\n" + user_content
+
+    chars = len(SYSTEM_PROMPT.format(exclusions=exclusions, units=", ".join(units), ingredients="")) + len(user_content)
+    chosen = []
+    for name in relevant_ingredients(pantry_names(user_question), k):
+        extra = len(name) + (2 if chosen else 0)
+        if math.ceil((chars + extra) / CHARS_PER_TOKEN) > budget:
+            break
+        chosen.append(name)
+        chars += extra
+
+    system_prompt = SYSTEM_PROMPT.format(exclusions=exclusions, units=", ".join(units), ingredients=", ".join(chosen))
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_content},
+    ]
+    info = {"prompt_tokens": estimate_tokens(system_prompt) + estimate_tokens(user_content), "ingredients": len(chosen)}
+    return messages, info
+
+
+def record_usage(estimated, reported=None):
+    """
+    Records the prompt size of one completion request and logs it.
+
+    Args:
+        estimated (int): Prompt tokens estimated by build_messages().
+        reported (int, optional): Prompt tokens reported by the API ("usage.prompt_tokens").
+    """
+    global _requests, _estimated_tokens, _reported_tokens, _last
+    with _stats_lock:
+        _requests += 1
+        _estimated_tokens += estimated
+        _reported_tokens += reported or 0
+        _last = {"estimated": estimated, "reported": reported}
+    print(f"Recipe generation prompt: {estimated} tokens estimated"
+          + (f", {reported} reported by the API" if reported is not None else ""))
+
+
+def stats():
+    """
+    Returns:
+        dict: Number of completion requests, total estimated and reported prompt tokens,
+            and the counts for the most recent request.
+    """
+    with _stats_lock:
+        return {
+            "requests": _requests,
+            "estimated_tokens": _estimated_tokens,
+            "reported_tokens": _reported_tokens,
+            "last": _last,
+            "budget": PROMPT_TOKEN_BUDGET,
+        }
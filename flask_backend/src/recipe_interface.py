@@ -1,16 +1,32 @@
+import json
 import sqlite3
 import time
+import numpy as np
+from . import catalog
+from . import coverage
+from . import database
+from . import ingredient_index
+from . import ingredient_search
+from . import meal_plan
+from . import migrations
+from . import units
 
 SECONDS_PER_DAY = 86400
 
-# Connects to pantry database
+# Slack when comparing converted quantities, so rounding does not leave crumbs in the pantry
+QUANTITY_EPSILON = 1e-9
+
+# Recipe search: bm25 weight of name matches relative to instructions matches,
+# markers around matched terms (plain text, not HTML), and snippet length in tokens
+SEARCH_NAME_WEIGHT = 10.0
+SEARCH_HIGHLIGHT = ("**", "**")
+SEARCH_SNIPPET_TOKENS = 16
+
+# Returns the pantry database connection for the current thread
+# The connection is pooled per thread (see database.py), so callers must not close it:
+# commit on success, rollback on failure
 def open_db():
-    conn = sqlite3.connect('flask_backend/pantry.db')
-    # Returns queries as Row objects (similar to dictionary)
-    conn.row_factory = sqlite3.Row
-    # Enforces correct foreign keys
-    conn.execute("PRAGMA foreign_keys = 1")
-    return conn
+    return database.get_connection()
 
 # Creates the following tables:
 # units: stores units of measurements for food. e.g. tbsp., cups, oz
@@ -18,60 +34,16 @@ def open_db():
 # pantry: stores physical ingredients from user's kitchen
 # recipes: stores user and LLM generated recipes
 # recipe_ingredients: stores all the required ingredients + quantities for recipes table
+# The schema is versioned, see migrations.py
+# Creating tables is the first migration, so this also upgrades an existing database
 def create_tables():
     conn = open_db()
-    c = conn.cursor()
     try:
-        c.execute("""CREATE TABLE units (
-                    id INTEGER PRIMARY KEY,
-                    unit TEXT NOT NULL UNIQUE
-                    ) STRICT""")
-        
-        c.execute("""CREATE TABLE ingredients (
-                    id INTEGER PRIMARY KEY,
-                    name TEXT NOT NULL UNIQUE,
-                    serving_size REAL NOT NULL,
-                    unit_of_measurement TEXT NOT NULL REFERENCES units(unit),
-                    calories REAL,
-                    total_fat REAL,
-                    sodium REAL,
-                    total_carbohydrate REAL,
-                    total_sugars REAL,
-                    protein REAL,
-                    cost REAL,
-                    shelf_life INTEGER
-                    ) STRICT""")
-
-        c.execute("""CREATE TABLE pantry (
-                    id INTEGER PRIMARY KEY,
-                    ingredient_name TEXT NOT NULL REFERENCES ingredients(name),
-                    quantity REAL NOT NULL,
-                    purchase_date INTEGER DEFAULT (unixepoch()),
-                    expiry_date INTEGER
-                    ) STRICT""")
-
-        c.execute("""CREATE TABLE recipes (
-                    id INTEGER PRIMARY KEY,
-                    name TEXT NOT NULL UNIQUE,
-                    meal_type TEXT,
-                    prep_time INTEGER,
-                    cook_time INTEGER,
-                    instructions TEXT NOT NULL,
-                    servings INTEGER NOT NULL DEFAULT (1)
-                    ) STRICT""")
-
-        c.execute("""CREATE TABLE recipe_ingredients (
-                    recipe_name TEXT NOT NULL REFERENCES recipes(name) ON DELETE CASCADE,            
-                    ingredient_name TEXT NOT NULL REFERENCES ingredients(name),
-                    quantity REAL NOT NULL,
-                    unit_of_measurement TEXT NOT NULL REFERENCES units(unit),
-                    PRIMARY KEY (recipe_name, ingredient_name)
-                    ) STRICT""")
-        conn.commit()
+        migrations.upgrade(conn)
+        database.bump_generation()
+        catalog.invalidate()
     except sqlite3.Error as error:
         print(f"Failed to create tables: ", error)
-    finally:
-        conn.close()
 
 # Function to initialize common units to units table    
 def init_units():
@@ -81,43 +53,47 @@ def init_units():
     try:
         c.executemany("INSERT INTO units (unit) VALUES (?)", units)
         conn.commit()
+        database.bump_generation()
+        catalog.invalidate()
     except sqlite3.Error as error:
+        conn.rollback()
         print(f"Failed to setup units table: ", error)
-    finally:
-        conn.close()
 
 # Inserts into ingredients table.
+# density: grams per ml, lets volume and mass amounts of the ingredient be converted into each other
 def insert_ingredient(name, serving_size, unit_of_measurement, calories=None, total_fat=None, sodium=None,
-                      total_carbohydrate=None, total_sugars=None, protein=None, cost=None, shelf_life=None):
+                      total_carbohydrate=None, total_sugars=None, protein=None, cost=None, shelf_life=None, density=None):
     conn = open_db()
     c = conn.cursor()
     try:
         c.execute("""INSERT INTO ingredients (
                     name, serving_size, unit_of_measurement, calories, total_fat, sodium, 
-                    total_carbohydrate, total_sugars, protein, cost, shelf_life)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    total_carbohydrate, total_sugars, protein, cost, shelf_life, density)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
                     (name, serving_size, unit_of_measurement, calories, total_fat, sodium, 
-                    total_carbohydrate, total_sugars, protein, cost, shelf_life,))
+                    total_carbohydrate, total_sugars, protein, cost, shelf_life, density,))
         conn.commit()
+        database.bump_generation()
+        catalog.add_ingredients([name])
+        ingredient_search.get_index(build=False).add([name])
         return True
     except sqlite3.Error as error:
+        conn.rollback()
         print(f"Failed to insert {name}: ", error)
         return False
-    finally:
-        conn.close()
 
 # Inserts into pantry table. 
 # Purchase date defaults to current time.
 # If expiry date not specified, will be set to purchase date + ingredient shelf life. 
 # If ingredient has no shelf life, expiry date will be NULL
-def add_to_pantry(ingredient_name, quantity, purchase_date=round(time.time()), expiry_date=None):
+# unit_of_measurement: unit quantity is given in, defaults to the ingredient's unit
+def add_to_pantry(ingredient_name, quantity, purchase_date=round(time.time()), expiry_date=None, unit_of_measurement=None):
     conn = open_db()
     c = conn.cursor()
     # check ingredient_name is in ingredients table
     ingredient = get_ingredient(ingredient_name)
     if not ingredient:
         print(f"Ingredient {ingredient_name} not found")
-        conn.close()
         return False
     
     # sets expiry date based on ingredient shelf life and current time
@@ -128,54 +104,68 @@ def add_to_pantry(ingredient_name, quantity, purchase_date=round(time.time()), e
     
     try:
         c.execute("""INSERT INTO pantry (
-                    ingredient_name, quantity, purchase_date, expiry_date)
-                    VALUES (?, ?, ?, ?)""", (ingredient["name"], quantity, purchase_date, expiry_date,))
+                    ingredient_name, quantity, purchase_date, expiry_date, unit_of_measurement)
+                    VALUES (?, ?, ?, ?, ?)""", (ingredient["name"], quantity, purchase_date, expiry_date, unit_of_measurement,))
         conn.commit()
+        database.bump_generation()
         return True
     except sqlite3.Error as error:
+        conn.rollback()
         print(f"Failed to insert {ingredient_name} to pantry: ", error)
         return False
-    finally:
-        conn.close()
 
 # Inserts recipe into recipes table 
 # instructions: string
 # ingredients: list of (ingredient, quantity, unit) tuples
+# The recipe and its ingredients are committed together; any failure rolls the whole recipe back
 def add_recipe(recipe_name, instructions, ingredients, meal_type=None, prep_time=None, cook_time=None, servings=1):
     conn = open_db()
     c = conn.cursor()
+    # Ingredient names are resolved against the catalog snapshot, loaded (on first use) before the transaction starts
+    try:
+        snapshot = catalog.get_snapshot()
+    except sqlite3.Error as error:
+        print(f"Failed to load catalog: ", error)
+        return False
     # add recipe
     try:
         c.execute("""INSERT INTO recipes (name, meal_type, prep_time, cook_time, instructions, servings)
                     VALUES (?, ?, ?, ?, ?, ?)""",
                     (recipe_name, meal_type, prep_time, cook_time, instructions, servings))
     except sqlite3.Error as error:
+        conn.rollback()
         print(f"Failed to insert {recipe_name}: ", error)
-        conn.close()
         return False
+    recipe_id = c.lastrowid
     
     # add recipe ingredients
+    ingredient_names = []
     for quant_ingredient in ingredients:
         ingredient_name, quantity, unit_of_measurement = quant_ingredient
-        ingredient = get_ingredient(ingredient_name)
-        if not ingredient:
+        canonical_name = snapshot.ingredient(ingredient_name)
+        if not canonical_name:
+            conn.rollback()
             print(f"Ingredient {ingredient_name} not found")
-            conn.close()
             return False
         
         try:
             c.execute("""INSERT INTO recipe_ingredients (recipe_name, ingredient_name, quantity, unit_of_measurement)
                         VALUES (?, ?, ?, ?)""", 
-                        (recipe_name, ingredient["name"], quantity, unit_of_measurement))
+                        (recipe_name, canonical_name, quantity, unit_of_measurement))
         except sqlite3.Error as error:
             print(f"Failed to insert {ingredient_name} for recipe {recipe_name}: ", error)
             c.execute("PRAGMA foreign_key_check")
             print("Foreign key check:", c.fetchall())
-            conn.close()
+            conn.rollback()
             return False
+        ingredient_names.append(canonical_name)
             
     conn.commit()
-    conn.close()
+    database.bump_generation()
+    catalog.add_recipes([recipe_name])
+    ingredient_index.get_index().add_recipe(recipe_id, ingredient_names)
+    coverage.get_matrix().invalidate()
+    meal_plan.get_table().add_recipes(conn, [recipe_id])
     return True
 
 # Removes ingredient from ingredients table
@@ -184,18 +174,20 @@ def remove_ingredient(ingredient_name):
     c = conn.cursor()
     if len(get_ingredient(ingredient_name)) == 0:
         print(f"Ingredient {ingredient_name} not found")
-        conn.close()
         return False
     
     try:
         c.execute("DELETE FROM ingredients WHERE name = ?", (ingredient_name,))
         conn.commit()
+        database.bump_generation()
+        if c.rowcount:
+            catalog.remove_ingredient(ingredient_name)
+            ingredient_search.get_index(build=False).remove(ingredient_name)
         return True
     except sqlite3.Error as error:
+        conn.rollback()
         print(f"Failed to delete {ingredient_name}: ", error)
         return False
-    finally:
-        conn.close()
 
 # Removes ingredient from pantry table 
 def remove_from_pantry(id):
@@ -203,38 +195,44 @@ def remove_from_pantry(id):
     c = conn.cursor()
     if len(get_from_pantry(id)) == 0:
         print("Item ID not found")
-        conn.close()
         return False
     
     try:
         c.execute("DELETE FROM pantry WHERE id = ?", (id,))
         conn.commit()
+        database.bump_generation()
         return True
     except sqlite3.Error as error:
+        conn.rollback()
         print(f"Failed to delete id:{id} from pantry: ", error)
         return False
-    finally:
-        conn.close()
 
 # Removes recipe from recipes table
 # All coresponding ingredients from recipe_ingredients table will automatically be deleted
 def remove_recipe(recipe_name):
     conn = open_db()
     c = conn.cursor()
-    if len(get_recipe(recipe_name)) == 0:
+    recipe = get_recipe(recipe_name)
+    if len(recipe) == 0:
         print(f"Recipe for {recipe_name} not found")
-        conn.close()
         return False
     
     try:
         c.execute("DELETE FROM recipes WHERE name = ?", (recipe_name,))
         conn.commit()
+        database.bump_generation()
+        if c.rowcount:
+            catalog.remove_recipe(recipe_name)
+        if c.rowcount and recipe["recipe"]:
+            ingredient_index.get_index().remove_recipe(recipe["recipe"]["id"],
+                                                       [row["ingredient_name"] for row in recipe["ingredients"]])
+            coverage.get_matrix().invalidate()
+            meal_plan.get_table().remove_recipes([recipe["recipe"]["id"]])
         return True
     except sqlite3.Error as error:
+        conn.rollback()
         print(f"Failed to delete {recipe_name}: ", error)
         return False
-    finally:    
-        conn.close()
 
 # Returns the corresponding row in the ingredients table (list)
 def get_ingredient(ingredient_name):
@@ -245,14 +243,29 @@ def get_ingredient(ingredient_name):
         c.execute("SELECT * FROM ingredients WHERE LOWER(name) = ?", (ingredient_name,))
     except sqlite3.Error as error:
         print(f"Failed to get {ingredient_name}: ", error)
-        conn.close()
         return
     ingredient=c.fetchone()
     
-    conn.close()
     ingredient = dict(ingredient) if ingredient else None
     return ingredient
 
+# Returns up to limit ingredient names starting with prefix (any case), shortest first
+# Used by the search endpoint while the ingredient search index is still building (served by
+# the LOWER(name) index)
+def search_ingredient_names(prefix, limit=10):
+    prefix = " ".join(prefix.lower().split())
+    if not prefix:
+        return []
+    conn = open_db()
+    c = conn.cursor()
+    try:
+        c.execute("""SELECT name FROM ingredients WHERE LOWER(name) >= ? AND LOWER(name) < ?
+                     ORDER BY LENGTH(name), LOWER(name) LIMIT ?""", (prefix, prefix + "\U0010ffff", limit))
+    except sqlite3.Error as error:
+        print(f"Failed to search ingredients for {prefix}: ", error)
+        return []
+    return [row[0] for row in c.fetchall()]
+
 # Returns the corresponding row in the pantry table (list)
 def get_from_pantry(id):
     conn = open_db()
@@ -261,15 +274,13 @@ def get_from_pantry(id):
         c.execute("SELECT * FROM pantry WHERE id = ?", (id,))
     except sqlite3.Error as error:
         print(f"Failed to get id:{id} from pantry: ", error)
-        conn.close()
         return
     ingredient=c.fetchone()
     
-    conn.close()
     ingredient = dict(ingredient) if ingredient else None
     return ingredient
 
-# Returns Dict[recipe:Dict, ingredients:List[Dict]]
+# Returns Dict[recipe:Dict, ingredients:List[Dict], nutrition:Dict] (see _nutrition_by_recipe)
 def get_recipe(recipe_name):
     recipe_name = recipe_name.lower()
     conn = open_db()
@@ -278,7 +289,6 @@ def get_recipe(recipe_name):
         c.execute("SELECT * FROM recipes WHERE LOWER(name) = ?", (recipe_name,))
     except sqlite3.Error as error:
         print(f"Failed to get {recipe_name}: ", error)
-        conn.close()
         return None
     recipe = c.fetchone()
     
@@ -286,89 +296,252 @@ def get_recipe(recipe_name):
         c.execute("SELECT * FROM recipe_ingredients WHERE LOWER(recipe_name) = ?", (recipe_name,))
     except sqlite3.Error as error:
         print(f"Failed to get recipe ingredients: ", error)
-        conn.close()
         return None
     ingredients = c.fetchall()
     
-    conn.close()
     recipe = dict(recipe) if recipe else None
-    return {"recipe":recipe, "ingredients":[dict(row) for row in ingredients]}
+    nutrition = None
+    if recipe:
+        try:
+            nutrition = _nutrition_by_recipe(c, [recipe["id"]]).get(recipe["id"])
+        except sqlite3.Error as error:
+            print(f"Failed to get recipe nutrition: ", error)
+            return None
+    return {"recipe":recipe, "ingredients":[dict(row) for row in ingredients], "nutrition":nutrition}
 
 # filters recipes by preptime, required ingredients, meal type, and whether or not ingredients are available in pantry
 # prep_time: (mintime, maxtime)
 # cook_time: (mintime, maxtime)
 # ingredients: [ingredient_name, ingredient_name...]
 # meal_type: breakfast, lunch, dinner, snack
-# returns List[Dict[recipe:Dict, recipe_ingredients:List[Dict]]]
-def filter_recipes(prep_time=None, cook_time=None, ingredients=None, meal_type=None, ingredients_available=False):
-    conn = open_db()
-    c = conn.cursor()
-    
-    # Base query
-    query = "SELECT * FROM recipes"
+# calories: (min, max) calories per serving
+# protein: (min, max) grams of protein per serving
+# after: only return recipes after this recipe id (keyset pagination cursor)
+# limit: maximum number of recipes to return
+# max_missing: only return recipes with at most this many ingredients missing from the pantry (or expired)
+# sort: "coverage" orders by the share of the recipe's ingredients in the pantry, best first,
+#       then by fewest missing ingredients, then by id
+# returns List[Dict[recipe:Dict, recipe_ingredients:List[Dict], nutrition:Dict]] ordered by recipe id unless sorted by coverage;
+# with max_missing or sort=coverage every result also has coverage (0 to 1) and missing (count)
+def filter_recipes(prep_time=None, cook_time=None, ingredients=None, meal_type=None, ingredients_available=False,
+                   after=None, limit=None, max_missing=None, sort=None, calories=None, protein=None):
+    try:
+        return list(iter_filtered_recipes(prep_time=prep_time, cook_time=cook_time, ingredients=ingredients,
+                                          meal_type=meal_type, ingredients_available=ingredients_available,
+                                          after=after, limit=limit, max_missing=max_missing, sort=sort,
+                                          calories=calories, protein=protein))
+    except sqlite3.Error as error:
+        print(f"Failed to filter recipes: ", error)
+        return
+
+# Builds the WHERE conditions on recipes AS r for the filter_recipes filters
+# Returns (conditions, params)
+def _filter_conditions(prep_time=None, cook_time=None, ingredients=None, meal_type=None, ingredients_available=False,
+                       calories=None, protein=None):
     conditions = []
     params = []
     
-    # Complete query
     if prep_time:
-        conditions.append("prep_time BETWEEN ? AND ?")
+        conditions.append("r.prep_time BETWEEN ? AND ?")
         params.extend(prep_time)
         
     if cook_time:
-        conditions.append("cook_time BETWEEN ? AND ?")
+        conditions.append("r.cook_time BETWEEN ? AND ?")
         params.extend(cook_time)
         
     if meal_type:
-        conditions.append("LOWER(meal_type) = ?")
+        conditions.append("LOWER(r.meal_type) = ?")
         params.append(meal_type.lower())
 
+    # Per serving nutrition ranges, index range scans on the materialized recipe_nutrition table
+    if calories:
+        conditions.append("r.id IN (SELECT recipe_id FROM recipe_nutrition WHERE calories_per_serving BETWEEN ? AND ?)")
+        params.extend(calories)
+
+    if protein:
+        conditions.append("r.id IN (SELECT recipe_id FROM recipe_nutrition WHERE protein_per_serving BETWEEN ? AND ?)")
+        params.extend(protein)
+
+    # Recipe must contain every required ingredient
+    # Answered by the in-memory inverted index once it is warm, by SQL until then
+    index = ingredient_index.get_index()
+    if ingredients and index.warm:
+        conditions.append("r.id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(index.recipes_with_all(ingredients)))
+    elif ingredients:
+        index.build_async()
+        required = set(ingredients)
+        conditions.append("""(SELECT COUNT(DISTINCT LOWER(ri.ingredient_name)) FROM recipe_ingredients AS ri
+                             WHERE ri.recipe_name = r.name
+                             AND LOWER(ri.ingredient_name) IN (SELECT value FROM json_each(?))) = ?""")
+        params.extend([json.dumps(sorted(required)), len(required)])
+
+    # Every ingredient of the recipe must be in the pantry and not expired
+    if ingredients_available:
+        conditions.append("""NOT EXISTS (SELECT 1 FROM recipe_ingredients AS ri
+                             WHERE ri.recipe_name = r.name
+                             AND LOWER(ri.ingredient_name) NOT IN (
+                                 SELECT LOWER(p.ingredient_name) FROM pantry AS p
+                                 WHERE p.expiry_date IS NULL OR p.expiry_date > ?))""")
+        params.append(round(time.time()))
+    return conditions, params
+
+# Gets the ingredients used by every recipe in recipe_names in one query
+# Returns {recipe name: [recipe_ingredients rows as dicts]}
+def _ingredients_by_recipe(c, recipe_names):
+    recipe_ingredients = {name: [] for name in recipe_names}
+    c.execute("""SELECT * FROM recipe_ingredients WHERE recipe_name IN (SELECT value FROM json_each(?))
+                ORDER BY recipe_name, ingredient_name""", (json.dumps(list(recipe_ingredients)),))
+    for row in c.fetchall():
+        recipe_ingredients[row["recipe_name"]].append(dict(row))
+    return recipe_ingredients
+
+# Gets the nutrition of every recipe in recipe_ids in one query
+# Returns {recipe id: {total:Dict, per_serving:Dict, unconverted:int}}, where total and per_serving map
+# each of migrations.NUTRIENT_COLUMNS to its sum over the recipe's ingredients and unconverted counts
+# the ingredients left out because their unit differs from the ingredient's serving unit
+def _nutrition_by_recipe(c, recipe_ids):
+    c.execute("SELECT * FROM recipe_nutrition WHERE recipe_id IN (SELECT value FROM json_each(?))",
+              (json.dumps(list(recipe_ids)),))
+    nutrition = {}
+    for row in c.fetchall():
+        total = {column: round(row[column], 2) for column in migrations.NUTRIENT_COLUMNS}
+        per_serving = {column: round(row[column] / row["servings"], 2) if row["servings"] else None
+                       for column in migrations.NUTRIENT_COLUMNS}
+        nutrition[row["recipe_id"]] = {"total": total, "per_serving": per_serving, "unconverted": row["unconverted"]}
+    return nutrition
+
+# Same filters as filter_recipes, but yields matching recipes one at a time
+# Recipes are read in keyset pages of batch_size (WHERE id > last id ORDER BY id LIMIT batch_size),
+# and each page's ingredients are fetched in one batch, so memory use does not grow with the catalog
+# and the first result is available as soon as the first page is read.
+# Raises sqlite3.Error if a query fails
+def iter_filtered_recipes(prep_time=None, cook_time=None, ingredients=None, meal_type=None, ingredients_available=False,
+                          after=None, limit=None, max_missing=None, sort=None, calories=None, protein=None,
+                          batch_size=500):
+    conn = open_db()
+    c = conn.cursor()
+    
+    conditions, params = _filter_conditions(prep_time, cook_time, ingredients, meal_type, ingredients_available,
+                                            calories, protein)
+    if max_missing is not None or sort == "coverage":
+        yield from _iter_by_coverage(c, conditions, params, max_missing, sort, after, limit, batch_size)
+        return
+    conditions.append("r.id > ?")
+    query = "SELECT * FROM recipes AS r WHERE " + " AND ".join(conditions) + " ORDER BY r.id LIMIT ?"
+    last_id = int(after) if after is not None else -1
+    remaining = int(limit) if limit is not None else None
+
+    while remaining is None or remaining > 0:
+        page_size = batch_size if remaining is None else min(batch_size, remaining)
+        # Query one page of the recipes table
+        c.execute(query, params + [last_id, page_size])
+        recipes = c.fetchall()
+        if not recipes:
+            return
+
+        recipe_ingredients = _ingredients_by_recipe(c, [recipe["name"] for recipe in recipes])
+        nutrition = _nutrition_by_recipe(c, [recipe["id"] for recipe in recipes])
+        for recipe in recipes:
+            yield {"recipe":dict(recipe), "ingredients":recipe_ingredients[recipe["name"]],
+                   "nutrition":nutrition.get(recipe["id"])}
+
+        last_id = recipes[-1]["id"]
+        if remaining is not None:
+            remaining -= len(recipes)
+        if len(recipes) < page_size:
+            return
+
+# Scored variant of iter_filtered_recipes, used for max_missing and sort=coverage
+# Every recipe is scored against the non-expired pantry in one pass over the coverage matrix, the SQL
+# filters are applied to the candidates with one query, and the rows are then read in pages of
+# batch_size in result order. For sort=coverage, after is the id of the last recipe seen; if that
+# recipe is no longer ranked (deleted, or now missing too much) the listing starts over.
+def _iter_by_coverage(c, conditions, params, max_missing, sort, after, limit, batch_size):
+    c.execute("""SELECT DISTINCT ingredient_name FROM pantry
+                WHERE expiry_date IS NULL OR expiry_date > ?""", (round(time.time()),))
+    recipe_ids, _, missing, ratio = coverage.get_matrix().score([row[0].lower() for row in c.fetchall()])
+
+    keep = np.ones(len(recipe_ids), dtype=bool) if max_missing is None else missing <= int(max_missing)
     if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-
-    # Query recipes table
+        c.execute("SELECT r.id FROM recipes AS r WHERE " + " AND ".join(conditions), params)
+        keep &= np.isin(recipe_ids, [row[0] for row in c.fetchall()])
+    order = np.flatnonzero(keep)
+    if sort == "coverage":
+        order = order[np.lexsort((recipe_ids[order], missing[order], -ratio[order]))]
+        if after is not None:
+            position = np.flatnonzero(recipe_ids[order] == int(after))
+            if len(position):
+                order = order[position[0] + 1:]
+    elif after is not None:
+        order = order[recipe_ids[order] > int(after)]
+    if limit is not None:
+        order = order[:int(limit)]
+
+    for start in range(0, len(order), batch_size):
+        page = order[start:start + batch_size]
+        c.execute("SELECT * FROM recipes WHERE id IN (SELECT value FROM json_each(?))",
+                  (json.dumps(recipe_ids[page].tolist()),))
+        recipes = {recipe["id"]: recipe for recipe in c.fetchall()}
+        recipe_ingredients = _ingredients_by_recipe(c, [recipe["name"] for recipe in recipes.values()])
+        nutrition = _nutrition_by_recipe(c, list(recipes))
+        for i in page.tolist():
+            recipe = recipes.get(int(recipe_ids[i]))
+            # Deleted since the matrix was built
+            if recipe is None:
+                continue
+            yield {"recipe":dict(recipe), "ingredients":recipe_ingredients[recipe["name"]],
+                   "nutrition":nutrition.get(recipe["id"]),
+                   "coverage":round(float(ratio[i]), 3), "missing":int(missing[i])}
+
+# Turns free text into an FTS5 query: every word must match, the last one as a prefix
+# (search as you type), and FTS5 operators or syntax in the input are treated as plain text
+def _fts_query(text):
+    words = [word.replace('"', "") for word in str(text).split()]
+    words = [word for word in words if word]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+# Full-text search over recipe names and instructions (recipes_fts)
+# query: free text, e.g. "garlic pasta"
+# The filter_recipes filters (prep_time, cook_time, ingredients, meal_type, ingredients_available) apply too
+# Results are ranked by bm25 with name matches weighted above instructions matches, and paginated
+# with offset/limit. Each result has the recipe, its ingredients, its rank (lower is better), the
+# name with matches marked and a snippet of the instructions around the matches.
+# Returns List[Dict], or None if the search failed
+def search_recipes(query, prep_time=None, cook_time=None, ingredients=None, meal_type=None,
+                   ingredients_available=False, offset=0, limit=20):
+    match = _fts_query(query)
+    if match is None:
+        return []
+    conn = open_db()
+    c = conn.cursor()
+    conditions, params = _filter_conditions(prep_time, cook_time, ingredients, meal_type, ingredients_available)
+    start, end = SEARCH_HIGHLIGHT
+    sql = f"""SELECT r.*, bm25(recipes_fts, {SEARCH_NAME_WEIGHT}, 1.0) AS rank,
+                     highlight(recipes_fts, 0, ?, ?) AS name_highlight,
+                     snippet(recipes_fts, 1, ?, ?, '...', {SEARCH_SNIPPET_TOKENS}) AS snippet
+              FROM recipes_fts JOIN recipes AS r ON r.id = recipes_fts.rowid
+              WHERE recipes_fts MATCH ?{"".join(" AND " + condition for condition in conditions)}
+              ORDER BY rank, r.id LIMIT ? OFFSET ?"""
     try:
-        c.execute(query, params)
-        recipes = c.fetchall()
+        c.execute(sql, [start, end, start, end, match] + params + [int(limit), int(offset)])
+        rows = c.fetchall()
+        recipe_ingredients = _ingredients_by_recipe(c, [row["name"] for row in rows])
     except sqlite3.Error as error:
-        print(f"Failed to filter recipes: ", error)
-        conn.close()
-        return
-
-    # Filter recipes
-    filtered_recipes = []
-    for recipe in recipes:
-        recipe_name = recipe["name"]
-        # Get ingredients used by recipe
-        try:
-            c.execute("SELECT * FROM recipe_ingredients WHERE recipe_name = ?", (recipe_name,))
-        except sqlite3.Error as error:
-            print(f"Failed to get recipe ingredients: ", error)
-            conn.close()
-            continue
-        recipe_ingredients = c.fetchall()
-        ingredient_names = {row["ingredient_name"].lower() for row in recipe_ingredients}
-    
-        # Check if recipe contains required ingredients
-        if ingredients:
-            if not set(ingredients).issubset(ingredient_names):
-                continue
-
-        # Check if ingredients are available in pantry
-        if ingredients_available:
-            try:
-                c.execute("SELECT ingredient_name FROM pantry WHERE expiry_date IS NULL OR expiry_date > ?", (round(time.time()),))
-                available_ingredients = {row["ingredient_name"].lower() for row in c.fetchall()}
-            except sqlite3.Error as error:
-                print(f"Failed to get pantry ingredients: ", error)
-                continue
-
-            if not ingredient_names.issubset(available_ingredients):
-                continue
-
-        filtered_recipes.append({"recipe":dict(recipe), "ingredients":[dict(ingredient) for ingredient in recipe_ingredients]})
+        print(f"Failed to search recipes: ", error)
+        return None
 
-    conn.close()
-    return filtered_recipes
+    results = []
+    for row in rows:
+        recipe = dict(row)
+        result = {"rank": recipe.pop("rank"), "name_highlight": recipe.pop("name_highlight"),
+                  "snippet": recipe.pop("snippet")}
+        results.append({"recipe": recipe, "ingredients": recipe_ingredients[recipe["name"]], **result})
+    return results
 
 # Gets ingredients from pantry that are not currently expired but will expire in specified number of days
 def get_expiring(days):
@@ -380,14 +553,194 @@ def get_expiring(days):
         c.execute("SELECT ingredient_name FROM pantry WHERE expiry_date >= ? AND expiry_date < ?", (round(time.time()), cut_off,))
     except sqlite3.Error as error:
         print(f"Failed to get expiring ingredients: ", error)
-        conn.close()
         return
     ingredients = c.fetchall()
     
-    conn.close()
     ingredients = [dict(row) for row in ingredients]
     return ingredients
 
+# Recommends recipes that use up pantry ingredients expiring within days
+# Each recipe consumes its ingredient quantities from the pantry lots that expire first. A lot
+# counts as the fraction of it the recipe uses up, weighted by urgency 1 / (1 + days to expiry),
+# and a recipe's score is the sum over the lots it draws from, so using all of something that
+# expires tomorrow beats using a little of something that expires next week.
+# Lot and recipe quantities are compared in the ingredient's unit of measurement: the lots are
+# converted with units.UnitTable, the recipe amounts come converted from meal_plan.RecipeTable;
+# lots and amounts in a unit that cannot be converted are left out.
+# Only the expiring lots are read. Every recipe is then scored in one pass over the recipe table's
+# CSR arrays: a recipe needing n of an ingredient uses its lots up to n of their running total, so
+# each entry's score is the urgency of the lots it uses in full (a prefix sum over the lots, found
+# with one searchsorted) plus the used fraction of the next. np.bincount adds the entries up per
+# recipe and np.argpartition picks the top limit, the only recipes read and itemized.
+# Returns the top limit as List[Dict[recipe:Dict, score:float, uses:List[Dict]]], or None on failure
+def recommend_expiring(days=7, limit=10):
+    conn = open_db()
+    c = conn.cursor()
+    now = round(time.time())
+    try:
+        c.execute("""SELECT p.ingredient_name, p.quantity, COALESCE(p.unit_of_measurement, i.unit_of_measurement),
+                            i.unit_of_measurement, i.density, p.expiry_date
+                     FROM pantry AS p
+                     JOIN ingredients AS i ON i.name = p.ingredient_name
+                     WHERE p.expiry_date >= ? AND p.expiry_date < ? AND p.quantity > 0
+                     ORDER BY p.expiry_date, p.id""", (now, now + days * SECONDS_PER_DAY))
+        lots = c.fetchall()
+        data = meal_plan.get_table().current()
+    except sqlite3.Error as error:
+        print(f"Failed to recommend recipes: ", error)
+        return None
+    if not lots or limit <= 0:
+        return []
+
+    # Lots grouped by ingredient column, earliest expiry first within each
+    columns = data["columns"]
+    quantities = units.get_table().convert([lot[1] for lot in lots], [lot[2] for lot in lots],
+                                           [lot[3] for lot in lots], [lot[4] for lot in lots])
+    lot_columns = np.array([columns.get(lot[0].lower(), -1) for lot in lots], dtype=np.int64)
+    kept = np.flatnonzero((lot_columns >= 0) & (quantities > 0))
+    order = kept[np.argsort(lot_columns[kept], kind="stable")]
+    if not len(order):
+        return []
+    lot_columns, quantities = lot_columns[order], quantities[order]
+    expiry = np.array([lots[i][5] for i in order], dtype=float)
+    urgency = 1.0 / (1.0 + (expiry - now) / SECONDS_PER_DAY)
+    stocked, first, counts = np.unique(lot_columns, return_index=True, return_counts=True)
+    ends = np.cumsum(quantities)
+    column_starts = ends[first] - quantities[first]
+    # Amount of the ingredient's earlier lots used before this lot is touched
+    used_before = ends - quantities - np.repeat(column_starts, counts)
+    urgency_totals = np.concatenate([[0.0], np.cumsum(urgency)])
+
+    # Recipe entries for expiring ingredients, scored against their column's lots
+    has_lots = np.zeros(len(columns), dtype=bool)
+    has_lots[stocked] = True
+    entries = np.flatnonzero(has_lots[data["indices"]])
+    position = np.searchsorted(stocked, data["indices"][entries])
+    start, end = first[position], first[position] + counts[position]
+    needed = np.clip(np.nan_to_num(data["amounts"][entries], nan=0.0), 0.0, ends[end - 1] - column_starts[position])
+    full = np.clip(np.searchsorted(ends, column_starts[position] + needed, side="right"), start, end)
+    partial = np.minimum(full, len(quantities) - 1)
+    fraction = np.where(full < end, np.maximum(needed - used_before[partial], 0.0) / quantities[partial], 0.0)
+    entry_scores = urgency_totals[full] - urgency_totals[start] + fraction * urgency[partial]
+    scores = np.bincount(data["entry_rows"][entries], weights=entry_scores, minlength=len(data["recipe_ids"]))
+
+    rows = np.flatnonzero(scores > 0)
+    if len(rows) > limit:
+        # Everything tied with the limit-th best, ties are broken by name below
+        rows = rows[scores[rows] >= np.partition(scores[rows], len(rows) - limit)[len(rows) - limit]]
+    try:
+        c.execute("SELECT * FROM recipes WHERE id IN (SELECT value FROM json_each(?))",
+                  (json.dumps(data["recipe_ids"][rows].tolist()),))
+        recipes = {row["id"]: dict(row) for row in c.fetchall()}
+    except sqlite3.Error as error:
+        print(f"Failed to recommend recipes: ", error)
+        return None
+    ranked = sorted((row for row in rows.tolist() if int(data["recipe_ids"][row]) in recipes),
+                    key=lambda row: (-scores[row], recipes[int(data["recipe_ids"][row])]["name"]))[:limit]
+
+    recommendations = []
+    for row in ranked:
+        uses = []
+        for entry in range(data["indptr"][row], data["indptr"][row + 1]):
+            column, amount = data["indices"][entry], data["amounts"][entry]
+            position = np.searchsorted(stocked, column)
+            if position == len(stocked) or stocked[position] != column or not amount > 0:
+                continue
+            for lot in range(first[position], first[position] + counts[position]):
+                if amount > used_before[lot]:
+                    uses.append({"ingredient_name": lots[order[lot]][0],
+                                 "quantity": float(min(quantities[lot], amount - used_before[lot])),
+                                 "unit_of_measurement": lots[order[lot]][3], "expiry_date": lots[order[lot]][5]})
+        recommendations.append({"recipe": recipes[int(data["recipe_ids"][row])],
+                                "score": round(float(scores[row]), 4), "uses": uses})
+    return recommendations
+
+# Cooks a recipe: deducts its ingredient quantities from the pantry, earliest expiring lots first
+# (lots without an expiry date last, expired lots are not used). Quantities are compared in the
+# ingredient's unit (migrations.convert_sql); a lot is reduced in its own unit by the share taken.
+# Runs as one BEGIN IMMEDIATE transaction, so the write lock is held from the read that plans the
+# deductions until the commit and concurrent cooks against the same pantry are serialized instead of
+# both spending the same lots. One query plans every lot with a running total per ingredient,
+# then partly used lots are updated with one executemany and emptied lots removed with one DELETE.
+# Nothing is deducted unless every ingredient is available in full.
+# Returns Dict[cooked:True, used:List[Dict]] or Dict[cooked:False, missing:List[Dict]],
+# or None if the recipe does not exist or a query fails
+def cook_recipe(recipe_name):
+    conn = open_db()
+    c = conn.cursor()
+    needed = migrations.convert_sql("ri.quantity", "ri.unit_of_measurement", "i.unit_of_measurement", "i.density")
+    amount = migrations.convert_sql("p.quantity", "COALESCE(p.unit_of_measurement, i.unit_of_measurement)",
+                                    "i.unit_of_measurement", "i.density")
+    try:
+        if conn.in_transaction:
+            conn.commit()
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT name FROM recipes WHERE LOWER(name) = ?", (recipe_name.lower(),))
+        recipe = c.fetchone()
+        if recipe is None:
+            conn.rollback()
+            print(f"Recipe for {recipe_name} not found")
+            return None
+
+        c.execute(f"""
+            WITH needs AS (
+                SELECT ri.ingredient_name, i.unit_of_measurement AS unit, {needed} AS needed
+                FROM recipe_ingredients AS ri
+                JOIN ingredients AS i ON i.name = ri.ingredient_name
+                WHERE ri.recipe_name = :recipe_name
+            ),
+            lots AS (
+                SELECT p.id, p.ingredient_name, p.quantity, p.unit_of_measurement, p.expiry_date, {amount} AS amount
+                FROM pantry AS p
+                JOIN ingredients AS i ON i.name = p.ingredient_name
+                WHERE p.ingredient_name IN (SELECT ingredient_name FROM needs)
+                AND (p.expiry_date IS NULL OR p.expiry_date > :now) AND p.quantity > 0
+            )
+            SELECT n.ingredient_name, n.unit, n.needed, l.id, l.quantity, l.unit_of_measurement, l.amount,
+                   SUM(l.amount) OVER (PARTITION BY n.ingredient_name ORDER BY l.expiry_date NULLS LAST, l.id
+                                       ROWS UNBOUNDED PRECEDING) - l.amount AS used_before
+            FROM needs AS n
+            LEFT JOIN lots AS l ON l.ingredient_name = n.ingredient_name AND l.amount > 0
+        """, {"recipe_name": recipe["name"], "now": round(time.time())})
+        rows = c.fetchall()
+
+        plan = {}
+        for row in rows:
+            item = plan.setdefault(row["ingredient_name"], {"needed": row["needed"], "unit": row["unit"],
+                                                            "available": 0.0, "lots": []})
+            if row["id"] is None:
+                continue
+            item["available"] += row["amount"]
+            if item["needed"] is None or row["needed"] - row["used_before"] <= QUANTITY_EPSILON:
+                continue
+            take = min(row["amount"], row["needed"] - row["used_before"])
+            emptied = take >= row["amount"] - QUANTITY_EPSILON
+            item["lots"].append({"id": row["id"], "ingredient_name": row["ingredient_name"],
+                                 "quantity": row["quantity"] if emptied else take / row["amount"] * row["quantity"],
+                                 "unit_of_measurement": row["unit_of_measurement"] or row["unit"], "emptied": emptied})
+
+        # Recipe amounts that cannot be converted to the ingredient's unit count as missing
+        missing = [{"ingredient_name": name, "needed": item["needed"], "available": item["available"],
+                    "unit_of_measurement": item["unit"]}
+                   for name, item in plan.items()
+                   if item["needed"] is None or item["available"] < item["needed"] - QUANTITY_EPSILON]
+        if missing:
+            conn.rollback()
+            return {"cooked": False, "missing": missing}
+
+        used = [lot for item in plan.values() for lot in item["lots"]]
+        c.executemany("UPDATE pantry SET quantity = quantity - ? WHERE id = ?",
+                      [(lot["quantity"], lot["id"]) for lot in used if not lot["emptied"]])
+        c.execute("DELETE FROM pantry WHERE id IN (SELECT value FROM json_each(?))",
+                  (json.dumps([lot["id"] for lot in used if lot["emptied"]]),))
+        conn.commit()
+    except sqlite3.Error as error:
+        conn.rollback()
+        print(f"Failed to cook {recipe_name}: ", error)
+        return None
+    database.bump_generation()
+    return {"cooked": True, "used": used}
+
 # Gets currently expired ingredients
 def get_expired():
     conn = open_db()
@@ -396,11 +749,9 @@ def get_expired():
         c.execute("SELECT ingredient_name FROM pantry WHERE expiry_date < ?", (round(time.time()),))
     except sqlite3.Error as error:
         print(f"Failed to get expired ingredients: ", error)
-        conn.close()
         return
     ingredients = c.fetchall()
     
-    conn.close()
     ingredients = [dict(row) for row in ingredients]
     return ingredients
 
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+from functools import wraps
+import hashlib
+import threading
+import time
+from flask import Response, make_response, request
+from . import database
+
+# Bounded LRU cache for read-only endpoints
+# Entries are keyed on the endpoint and its normalized arguments and are tagged with the data
+# generation they were built at (see database.bump_generation), so any write invalidates them.
+# Every cached response carries an ETag, and requests with a matching If-None-Match get a 304.
+
+# Response headers that are stored and replayed along with the body
+CACHED_HEADERS = ("X-Next-After", "X-Next-Offset")
+
+class ResponseCache:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    # Returns the entry for key if it was built at generation and has not expired, else None
+    def get(self, key, generation):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["generation"] != generation or \
+                    (entry["expires"] is not None and entry["expires"] <= time.monotonic()):
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries,
+                    "hits": self.hits, "misses": self.misses}
+
+CACHE = ResponseCache()
+
+# Same normalization as app.normalized_string: underscores to spaces, lowercase
+def _normalized(value):
+    return value.replace("_", " ").lower()
+
+# Cache key for the current request
+# Path and query values are normalized, query parameters are sorted, and the comma separated
+# values of unordered_args (e.g. required ingredients) are sorted too
+def request_key(unordered_args=()):
+    view_args = tuple(sorted((name, _normalized(str(value))) for name, value in (request.view_args or {}).items()))
+    query_args = []
+    for name, value in request.args.items(multi=True):
+        value = _normalized(value)
+        if name in unordered_args:
+            value = ",".join(sorted(value.split(",")))
+        query_args.append((name, value))
+    return (request.endpoint, view_args, tuple(sorted(query_args)))
+
+# Returns the cached response, or a 304 if the client already has it
+def _respond(entry):
+    if request.if_none_match.contains(entry["etag"]):
+        response = Response(status=304)
+    else:
+        response = Response(entry["body"], status=200, mimetype=entry["mimetype"])
+        response.headers.extend(entry["headers"])
+    response.set_etag(entry["etag"])
+    # Browsers revalidate with If-None-Match instead of reusing a stale copy
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+# Decorator for read-only Flask views
+# ttl: seconds before an entry expires even without writes, for results that depend on the current
+#      time (expiry dates) or that other processes may change
+# unordered_args: query parameters whose comma separated values can be given in any order
+def cached(ttl=None, unordered_args=()):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request_key(unordered_args)
+            # Read the generation before running the view, a write that lands meanwhile
+            # leaves the entry stale and it is rebuilt on the next request
+            generation = database.get_generation()
+            entry = CACHE.get(key, generation)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                # Only complete successful responses are cached (not errors or NDJSON streams)
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                body = response.get_data()
+                entry = {
+                    "generation": generation,
+                    "expires": time.monotonic() + ttl if ttl is not None else None,
+                    "body": body,
+                    "mimetype": response.mimetype,
+                    "headers": [(name, response.headers[name]) for name in CACHED_HEADERS if name in response.headers],
+                    "etag": hashlib.sha1(body).hexdigest(),
+                }
+                CACHE.put(key, entry)
+            return _respond(entry)
+        return wrapper
+    return decorator
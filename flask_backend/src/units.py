@@ -0,0 +1,74 @@
+import threading
+import numpy as np
+from . import database
+
+# Unit conversion engine
+# Loads the units and unit_factors tables once per data generation into a dense matrix,
+# factors[i, j] = how many of unit j make one of unit i, NaN when i and j are in different
+# families (or either has no factor, like piece(s)). Volume and mass convert into each other
+# through a density in g per ml, passed per quantity. Conversions are batched: a whole recipe
+# or the whole pantry is converted with a few array operations. The same factors are used in
+# SQL through migrations.convert_sql, e.g. for the nutrition totals.
+class UnitTable:
+    def __init__(self, generation, units, factors):
+        self.generation = generation
+        self.units = tuple(units)
+        self.positions = {unit: position for position, unit in enumerate(self.units)}
+        # factors: {unit: (family, size in the family's base unit)}
+        self.families = np.array([factors.get(unit, (None, None))[0] or "" for unit in self.units])
+        self.to_base = np.array([factors.get(unit, (None, np.nan))[1] for unit in self.units], dtype=float)
+        same_family = (self.families[:, None] == self.families[None, :]) & (self.families[:, None] != "")
+        self.factors = np.where(same_family, self.to_base[:, None] / self.to_base[None, :], np.nan)
+        np.fill_diagonal(self.factors, 1.0)
+
+    # Converts quantities[k] from from_units[k] to to_units[k]
+    # densities: g per ml for each quantity (None or NaN where unknown), needed between volume and mass
+    # Returns a float array, NaN where a quantity cannot be converted
+    def convert(self, quantities, from_units, to_units, densities=None):
+        quantities = np.asarray(quantities, dtype=float)
+        source = np.array([self.positions.get(unit, -1) for unit in from_units], dtype=np.int64)
+        target = np.array([self.positions.get(unit, -1) for unit in to_units], dtype=np.int64)
+        known = (source >= 0) & (target >= 0)
+        source, target = np.where(known, source, 0), np.where(known, target, 0)
+
+        factors = np.where(known, self.factors[source, target], np.nan)
+        if densities is not None:
+            densities = np.array([np.nan if density is None else density for density in densities], dtype=float)
+            ratio = self.to_base[source] / self.to_base[target]
+            source_family, target_family = self.families[source], self.families[target]
+            to_mass = known & (source_family == "volume") & (target_family == "mass")
+            to_volume = known & (source_family == "mass") & (target_family == "volume")
+            factors = np.where(to_mass, ratio * densities, factors)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                factors = np.where(to_volume, ratio / densities, factors)
+            factors[~np.isfinite(factors)] = np.nan
+        return quantities * factors
+
+    # Converts one quantity, returns None if it cannot be converted
+    def convert_one(self, quantity, from_unit, to_unit, density=None):
+        value = self.convert([quantity], [from_unit], [to_unit], [density])[0]
+        return None if np.isnan(value) else float(value)
+
+    # Reads the units and their factors over conn
+    @classmethod
+    def load(cls, conn, generation):
+        units = [row[0] for row in conn.execute("SELECT unit FROM units ORDER BY id")]
+        factors = {row[0]: (row[1], row[2]) for row in conn.execute("SELECT unit, family, to_base FROM unit_factors")}
+        return cls(generation, units, factors)
+
+_tables = {}
+_lock = threading.Lock()
+
+# Returns the unit table for the current database file, reloading it if a write happened since it was loaded
+def get_table():
+    path = database.DB_PATH
+    generation = database.get_generation()
+    table = _tables.get(path)
+    if table is not None and table.generation == generation:
+        return table
+    with _lock:
+        table = _tables.get(path)
+        if table is None or table.generation != generation:
+            table = UnitTable.load(database.get_connection(), generation)
+            _tables[path] = table
+        return table
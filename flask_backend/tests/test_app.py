@@ -1,6 +1,12 @@
 import pytest
 import sys
 import os
+import json
+import io
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../")))
 
@@ -15,6 +21,74 @@ def client():
     with app.test_client() as client:
         yield client
 
+class CompletionHandler(BaseHTTPRequestHandler):
+    """Stub chat completions API answering with the server's canned content."""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.requests.append(body)
+        if body.get("stream") and not self.server.responses:
+            # Send the content a few characters per server-sent event
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            content = self.server.content
+            for start in range(0, len(content), 8):
+                chunk = {"choices": [{"delta": {"content": content[start:start + 8]}}]}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+        status, payload = 200, {"choices": [{"message": {"content": self.server.content}}]}
+        if self.server.responses:
+            status, payload = self.server.responses.pop(0)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def completion_server(monkeypatch):
+    """Fixture running a local stub completion server and pointing llm_interface at it."""
+    from flask_backend.src import llm_interface
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CompletionHandler)
+    server.content = ""
+    server.requests = []
+    # (status, JSON body) pairs served before falling back to content
+    server.responses = []
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    monkeypatch.setattr(llm_interface, "ARLIAI_API_URL", f"http://127.0.0.1:{server.server_port}/v1/chat/completions")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def wait_for_job(client, job_id, timeout=10):
+    """Polls a recipe generation job until it is done or failed."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f"/api/generate_recipe/{job_id}").get_json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Job {job_id} did not finish")
+
+@pytest.fixture
+def temp_db(tmp_path):
+    """Fixture pointing the backend at an empty database with the default units."""
+    from flask_backend.src import database, recipe_interface
+    original_path = database.DB_PATH
+    database.set_database_path(str(tmp_path / "pantry.db"))
+    recipe_interface.create_tables()
+    recipe_interface.init_units()
+    yield recipe_interface.open_db()
+    database.set_database_path(original_path)
+
 def test_add_ingredient(client):
     """Test the add_ingredient endpoint."""
     # Define the payload for the POST request
@@ -121,21 +195,933 @@ def test_expired(client):
     data = response.get_json()
     assert isinstance(data, list)
     
-def test_generate_recipe(client):
-    """Test the generate_recipe endpoint."""
+def test_generate_recipe(client, temp_db, completion_server):
+    """Test the generate_recipe endpoint against a stub completion server."""
+    from flask_backend.src import recipe_interface
+    recipe_interface.insert_ingredient("Eggs", 1, "piece(s)")
+    recipe_interface.insert_ingredient("Parmesan Cheese", 1, "tbsp.")
+    completion_server.content = json.dumps({
+        "title": "Cheesy Eggs",
+        "ingredients": [["Eggs", "2", "piece(s)"], ["Parmesan Cheese", "1", "tbsp."]],
+        "instructions": ["Whisk", "Cook"],
+        "meal_type": "breakfast",
+        "prep_time": "5 minutes",
+        "cook_time": "10 minutes",
+    })
+
     # Define the payload for the POST request
     payload = {
-        "user_question": ["pasta", "eggs", "cheese"],
-        "user_preference": "Italian"
+        "ingredients": ["eggs", "cheese"],
+        "preference": "Italian"
     }
 
     # Send a POST request to the /api/generate_recipe endpoint
     response = client.post("/api/generate_recipe", json=payload)
 
-    # Assert the response status code is 200 (success)
+    # The job is accepted straight away
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+
+    # Poll until the background worker finishes
+    job = wait_for_job(client, job_id)
+    assert job["status"] == "done"
+    assert job["recipe_name"] == "Cheesy Eggs"
+    assert recipe_interface.get_recipe("cheesy eggs")["recipe"]["prep_time"] == 5
+
+    assert client.get("/api/generate_recipe/unknown").status_code == 404
+    
+def test_generate_recipe_failure(client, temp_db, completion_server):
+    """Test that a job whose recipe cannot be saved is reported as failed."""
+    completion_server.content = '{"title": "Mystery", "ingredients": [["Unobtainium", 1, "g"]], "instructions": []}'
+    job_id = client.post("/api/generate_recipe", json={"ingredients": ["rocks"]}).get_json()["job_id"]
+    job = wait_for_job(client, job_id)
+    assert job["status"] == "failed"
+    assert "Mystery" in job["error"]
+
+def test_connection_reused_per_thread():
+    """Test that recipe_interface reuses one configured connection per thread."""
+    from flask_backend.src import recipe_interface
+
+    conn = recipe_interface.open_db()
+    assert recipe_interface.open_db() is conn
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    assert conn.execute("PRAGMA foreign_keys").fetchone()[0] == 1
+
+    # Another thread gets its own connection
+    import threading
+    other = []
+    thread = threading.Thread(target=lambda: other.append(recipe_interface.open_db()))
+    thread.start()
+    thread.join()
+    assert other[0] is not conn
+
+
+def test_filtered_recipes(client):
+    """Test the get_filtered_recipes endpoint with a required ingredient."""
+    response = client.get("/api/recipes/?ingredients=olive_oil,eggs")
+
+    assert response.status_code == 200
+
+    # Every returned recipe must use all required ingredients
+    data = response.get_json()
+    assert isinstance(data, list)
+    for entry in data:
+        names = {ingredient["ingredient_name"].lower() for ingredient in entry["ingredients"]}
+        assert {"olive oil", "eggs"} <= names
+
+
+def test_ingredient_index():
+    """Test that the inverted ingredient index agrees with recipe_ingredients and updates incrementally."""
+    from flask_backend.src import recipe_interface
+    from flask_backend.src.ingredient_index import IngredientIndex
+
+    conn = recipe_interface.open_db()
+    index = IngredientIndex("unused")
+    index.build(conn)
+    assert index.warm and index.stats()["memory_bytes"] > 0
+
+    expected = [row["id"] for row in conn.execute(
+        """SELECT id FROM recipes AS r WHERE
+           EXISTS (SELECT 1 FROM recipe_ingredients WHERE recipe_name = r.name AND LOWER(ingredient_name) = 'eggs')
+           AND EXISTS (SELECT 1 FROM recipe_ingredients WHERE recipe_name = r.name AND LOWER(ingredient_name) = 'olive oil')
+           ORDER BY id""")]
+    assert index.recipes_with_all(["eggs", "olive oil"]) == expected
+
+    index.add_recipe(10**6, ["Eggs", "Olive Oil"])
+    assert index.recipes_with_all(["eggs", "olive oil"]) == expected + [10**6]
+    index.remove_recipe(10**6, ["Eggs", "Olive Oil"])
+    assert index.recipes_with_all(["eggs", "olive oil"]) == expected
+
+
+def test_ingredient_index_concurrent_builds():
+    """Test that a sync build started while another build is running waits for it and keeps queued changes."""
+    from flask_backend.src import database
+    from flask_backend.src.ingredient_index import IngredientIndex
+
+    read, resume = threading.Event(), threading.Event()
+
+    # Hands out the rows of the first build, then holds it before it swaps its postings in
+    class SlowConnection:
+        def __init__(self):
+            self.conn = database.connect()
+
+        def execute(self, sql, *args):
+            rows = self.conn.execute(sql, *args).fetchall()
+
+            def slowly():
+                yield from rows
+                read.set()
+                resume.wait(5)
+            return slowly()
+
+    index = IngredientIndex(database.DB_PATH)
+    first = threading.Thread(target=lambda: index.build(SlowConnection()))
+    first.start()
+    assert read.wait(5)
+
+    # Added after the first build read its snapshot, so it is queued for replay
+    index.add_recipe(10**6, ["Eggs", "Olive Oil"])
+    index.build_async()
+    second = threading.Thread(target=lambda: index.build(database.connect()))
+    second.start()
+    time.sleep(0.1)
+    assert second.is_alive()
+
+    resume.set()
+    first.join(5)
+    second.join(5)
+    assert index.warm
+    assert 10**6 in index.recipes_with_all(["eggs", "olive oil"])
+
+
+def test_migrations_index_hot_queries(tmp_path):
+    """Test that migrations are idempotent and every hot query uses an index."""
+    from flask_backend.src import database, migrations, recipe_interface
+
+    conn = recipe_interface.open_db()
+    assert migrations.get_version(conn) == migrations.SCHEMA_VERSION
+    assert migrations.check_query_plans(conn) == {}
+
+    # Re-running every step against an already migrated database is a no-op
+    copy = database.connect(str(tmp_path / "copy.db"))
+    conn.backup(copy)
+    copy.execute("PRAGMA user_version = 0")
+    migrations.upgrade(copy)
+    assert migrations.get_version(copy) == migrations.SCHEMA_VERSION
+    assert migrations.check_query_plans(copy) == {}
+    copy.close()
+
+
+def test_filtered_recipes_pagination(client):
+    """Test keyset pagination and NDJSON streaming on the get_filtered_recipes endpoint."""
+    full = client.get("/api/recipes/").get_json()
+
+    # Walk the catalog one recipe at a time following the X-Next-After cursor
+    pages = []
+    url = "/api/recipes/?limit=1"
+    while url:
+        response = client.get(url)
+        assert response.status_code == 200
+        pages.extend(response.get_json())
+        cursor = response.headers.get("X-Next-After")
+        url = f"/api/recipes/?limit=1&after={cursor}" if cursor else None
+    assert pages == full
+
+    response = client.get("/api/recipes/?format=ndjson")
     assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines == full
 
-    # Assert the response JSON contains a recipe
+
+def test_import_ingredients(client, temp_db):
+    """Test bulk ingredient import from CSV and JSONL with per-row errors."""
+    csv_file = (b"name,serving_size,unit_of_measurement,calories,protein,shelf_life\n"
+                b"Garlic,1,clove(s),4.5,0.2,\n"
+                b"Eggs,1,piece(s),72,6.3,21\n"
+                b"Bad Unit,1,handful,1,,\n"
+                b"Garlic,1,clove(s),4.5,0.2,\n")
+    response = client.post("/api/ingredients/import", data={"file": (io.BytesIO(csv_file), "nutrition.csv")})
+    assert response.status_code == 200
     data = response.get_json()
-    assert isinstance(data, dict)
-    assert data["message"] == "Recipe generated and saved"
+    assert data["inserted"] == 2
+    assert [(error["line"], error["name"]) for error in data["errors"]] == [(4, "Bad Unit"), (5, "Garlic")]
+
+    jsonl = (b'{"name": "Milk", "serving_size": 1, "unit_of_measurement": "cup(s)", "calories": 103}\n'
+             b'not json\n'
+             b'{"name": "Eggs", "serving_size": 1, "unit_of_measurement": "piece(s)"}\n')
+    response = client.post("/api/ingredients/import?format=jsonl", data=jsonl)
+    data = response.get_json()
+    assert data["inserted"] == 1
+    assert [error["line"] for error in data["errors"]] == [2, 3]
+
+    rows = temp_db.execute("SELECT name, calories, shelf_life FROM ingredients ORDER BY id").fetchall()
+    assert [tuple(row) for row in rows] == [("Garlic", 4.5, None), ("Eggs", 72.0, 21), ("Milk", 103.0, None)]
+
+
+def test_import_recipes(client, temp_db):
+    """Test bulk recipe import: bad recipes are rejected whole, good ones are saved."""
+    from flask_backend.src import recipe_interface
+    recipe_interface.insert_ingredient("Eggs", 1, "piece(s)")
+    recipe_interface.insert_ingredient("Olive Oil", 1, "tbsp.")
+
+    recipes = [
+        {"recipe_name": "Fried Eggs", "instructions": "Fry", "ingredients": [["eggs", 2, "piece(s)"], ["Olive Oil", 1, "tbsp."]],
+         "meal_type": "Breakfast", "prep_time": 0, "cook_time": 5},
+        {"recipe_name": "Unicorn Stew", "instructions": "Stew", "ingredients": [["Eggs", 1, "piece(s)"], ["Unicorn", 1, "g"]]},
+        {"recipe_name": "Double Eggs", "instructions": "Fry", "ingredients": [["Eggs", 1, "piece(s)"], ["Eggs", 2, "piece(s)"]]},
+        {"recipe_name": "Fried Eggs", "instructions": "Again", "ingredients": []},
+    ]
+    body = "\n".join(json.dumps(recipe) for recipe in recipes)
+    response = client.post("/api/recipes/import", data=body)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["inserted"] == 1
+    assert [error["line"] for error in data["errors"]] == [2, 3, 4]
+
+    # Failed recipes leave no rows behind
+    assert [row[0] for row in temp_db.execute("SELECT name FROM recipes")] == ["Fried Eggs"]
+    assert temp_db.execute("SELECT COUNT(*) FROM recipe_ingredients").fetchone()[0] == 2
+    assert recipe_interface.get_recipe("fried eggs")["ingredients"][0]["ingredient_name"] == "Eggs"
+
+    # A row whose ingredients are not a list is reported, the valid row beside it is saved
+    recipes = [{"recipe_name": "Boiled Eggs", "instructions": "Boil", "ingredients": [["Eggs", 2, "piece(s)"]]},
+               {"recipe_name": "Scraped Junk", "instructions": "?", "ingredients": 5}]
+    response = client.post("/api/recipes/import", data="\n".join(json.dumps(recipe) for recipe in recipes))
+    assert response.status_code == 200
+    data = response.get_json()
+    assert data["inserted"] == 1 and data["error_count"] == 1
+    assert data["errors"] == [{"line": 2, "name": "Scraped Junk", "error": "ingredients must be a list of [name, quantity, unit]"}]
+    assert recipe_interface.get_recipe("boiled eggs")["recipe"] is not None
+
+
+def test_response_cache_etag(client, temp_db):
+    """Test that read endpoints return ETags, answer If-None-Match with 304 and refresh after writes."""
+    from flask_backend.src import recipe_interface
+    recipe_interface.insert_ingredient("Eggs", 1, "piece(s)")
+
+    first = client.get("/api/ingredients/Eggs")
+    assert first.status_code == 200 and first.get_json()["name"] == "Eggs"
+    etag = first.headers["ETag"]
+
+    # Same resource under a differently spelled name hits the same entry
+    assert client.get("/api/ingredients/eggs", headers={"If-None-Match": etag}).status_code == 304
+
+    # A write invalidates the cached list
+    before = client.get("/api/recipes/?ingredients=eggs").get_json()
+    recipe_interface.add_recipe("Boiled Eggs", "Boil", [("Eggs", 2, "piece(s)")])
+    after = client.get("/api/recipes/?ingredients=eggs").get_json()
+    assert len(after) == len(before) + 1
+
+
+def test_llm_generation_is_memoized(client, temp_db, completion_server):
+    """Test that only saved generations are cached and a repeated request returns the saved recipe."""
+    from flask_backend.src import llm_interface, recipe_interface
+    recipe_interface.insert_ingredient("Eggs", 1, "piece(s)")
+    recipe_interface.insert_ingredient("Milk", 1, "ml")
+    hits = client.get("/api/stats").get_json()["llm_cache"]["hits"]
+
+    # A generation that cannot be saved is not cached, the next attempt calls the API again
+    completion_server.content = '{"title": "Omelette", "ingredients": [["Unobtainium", 1, "g"]]}'
+    with pytest.raises(ValueError):
+        llm_interface.generate_and_save_recipe("eggs, Milk", "French")
+    completion_server.content = '{"title": "Omelette", "ingredients": [["Eggs", 2, "piece(s)"], ["Milk", 50, "ml"]]}'
+    assert llm_interface.generate_and_save_recipe("eggs, Milk", "French") == "Omelette"
+    assert len(completion_server.requests) == 2
+
+    # Same request in another order and case: the saved recipe, not a duplicate and no API call
+    assert llm_interface.generate_and_save_recipe("milk,eggs", "french ") == "Omelette"
+    assert len(completion_server.requests) == 2
+
+    # Removed since: saved again from the cached text
+    recipe_interface.remove_recipe("Omelette")
+    assert llm_interface.generate_and_save_recipe("milk,eggs", "french") == "Omelette"
+    assert recipe_interface.get_recipe("omelette")["recipe"] is not None
+    assert len(completion_server.requests) == 2
+
+    completion_server.content = '{"title": "Frittata", "ingredients": [["Eggs", 3, "piece(s)"]]}'
+    assert llm_interface.generate_and_save_recipe("eggs, milk", "Italian") == "Frittata"
+    assert len(completion_server.requests) == 3
+
+    stats = client.get("/api/stats").get_json()["llm_cache"]
+    assert stats["hits"] == hits + 2 and stats["entries"] == 2
+
+
+def test_stream_generated_recipe(client, temp_db, completion_server):
+    """Test that the streaming endpoint relays LLM chunks as SSE and saves the recipe at the end."""
+    from flask_backend.src import recipe_interface
+    recipe_interface.insert_ingredient("Eggs", 1, "piece(s)")
+    completion_server.content = json.dumps({
+        "title": "Soft Boiled Eggs",
+        "ingredients": [["Eggs", "2", "piece(s)"]],
+        "instructions": ["Boil for 6 minutes"],
+    })
+
+    response = client.get("/api/generate_recipe/stream?ingredients=eggs&preference=simple")
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+
+    events = []
+    for block in response.get_data(as_text=True).strip().split("\n\n"):
+        name, data = block.split("\n")
+        events.append((name[len("event: "):], json.loads(data[len("data: "):])))
+
+    tokens = [data["text"] for name, data in events if name == "token"]
+    assert len(tokens) > 1
+    assert "".join(tokens) == completion_server.content
+    assert events[-1] == ("done", {"recipe_name": "Soft Boiled Eggs"})
+    assert completion_server.requests[-1]["stream"] is True
+    assert recipe_interface.get_recipe("soft boiled eggs")["recipe"] is not None
+
+
+def test_completion_client_retries_and_breaker(completion_server, monkeypatch):
+    """Test that the completion client retries 5xx responses and fails fast once the breaker opens."""
+    from flask_backend.src import completion_client, llm_interface
+    monkeypatch.setattr(completion_client.time, "sleep", lambda seconds: None)
+    client = completion_client.CompletionClient(max_retries=2, breaker=completion_client.CircuitBreaker(2, 60))
+    url = llm_interface.ARLIAI_API_URL
+
+    # Two failures then a success: retried transparently over the pooled session
+    completion_server.content = "ok"
+    completion_server.responses = [(503, {}), (429, {})]
+    response = client.post(url, {"messages": []})
+    assert response.json()["choices"][0]["message"]["content"] == "ok"
+    assert len(completion_server.requests) == 3
+
+    # Non-retryable errors are raised straight away
+    completion_server.responses = [(401, {"error": "bad key"})]
+    with pytest.raises(completion_client.CompletionError):
+        client.post(url, {"messages": []})
+    assert len(completion_server.requests) == 4
+
+    # Two calls that exhaust their retries open the breaker, the next call never reaches the server
+    completion_server.responses = [(500, {})] * 6
+    for _ in range(2):
+        with pytest.raises(completion_client.CompletionError):
+            client.post(url, {"messages": []})
+    assert client.breaker.state == "open"
+    with pytest.raises(completion_client.CircuitOpenError):
+        client.post(url, {"messages": []})
+    assert len(completion_server.requests) == 10
+
+    # Any requests error counts as a failure, and a trial that raises something else is released
+    import requests
+    client = completion_client.CompletionClient(max_retries=0, breaker=completion_client.CircuitBreaker(1, 0))
+
+    def broken(*args, **kwargs):
+        raise requests.exceptions.ChunkedEncodingError("connection broken")
+    post = client.session.post
+    monkeypatch.setattr(client.session, "post", broken)
+    with pytest.raises(completion_client.CompletionError):
+        client.post(url, {"messages": []})
+    assert client.breaker.state == "half_open"
+    monkeypatch.setattr(client.session, "post", lambda *args, **kwargs: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        client.post(url, {"messages": []})
+    monkeypatch.setattr(client.session, "post", post)
+    assert client.post(url, {"messages": []}).status_code == 200
+    assert client.breaker.state == "closed"
+
+
+def test_prompt_is_bounded_and_duplicates_are_regenerated(client, temp_db, completion_server):
+    """Test that the prompt stays within its token budget and an existing recipe triggers a retry."""
+    from flask_backend.src import ingredient_index, llm_interface, prompt_builder, recipe_interface
+    for i in range(500):
+        recipe_interface.insert_ingredient(f"Filler {i}", 1, "piece(s)")
+    for name in ("Eggs", "Bacon", "Pecorino"):
+        recipe_interface.insert_ingredient(name, 1, "piece(s)")
+    assert recipe_interface.add_recipe("Carbonara", "Mix", [("Eggs", 2, "piece(s)"), ("Bacon", 1, "piece(s)")])
+    ingredient_index.get_index().build(temp_db)
+
+    messages, info = prompt_builder.build_messages("Eggs: 6.0 piece(s) total in pantry\n", budget=600)
+    available = messages[0]["content"].rsplit("AVAILABLE INGREDIENTS: ", 1)[1].split(", ")
+    # The pantry item comes first, then the ingredient it shares a recipe with
+    assert available[:2] == ["eggs", "bacon"]
+    assert 2 < len(available) < 500
+    assert info["prompt_tokens"] <= 600
+    assert "Carbonara" not in messages[0]["content"]
+
+    def completion(title):
+        return json.dumps({"title": title, "ingredients": [["Eggs", "2", "piece(s)"]], "instructions": ["Cook"]})
+
+    completion_server.responses = [(200, {"choices": [{"message": {"content": completion("Carbonara")}}],
+                                          "usage": {"prompt_tokens": 321}})]
+    completion_server.content = completion("Scrambled Eggs")
+    assert llm_interface.generate_and_save_recipe("eggs") == "Scrambled Eggs"
+    assert len(completion_server.requests) == 2
+    assert "Do NOT generate any of these existing recipes: Carbonara" in completion_server.requests[1]["messages"][0]["content"]
+
+    stats = client.get("/api/stats").get_json()["prompt"]
+    assert stats["requests"] >= 2 and stats["reported_tokens"] >= 321
+
+
+def test_catalog_snapshot(client, temp_db):
+    """Test that the catalog snapshot is kept up to date in place and backs unit validation."""
+    from flask_backend.src import catalog, database, recipe_interface
+    snapshot = catalog.get_snapshot()
+    assert catalog.get_snapshot() is snapshot
+    assert "piece(s)" in snapshot.units
+
+    recipe_interface.insert_ingredient("Olive Oil", 1, "tbsp.")
+    snapshot = catalog.get_snapshot()
+    assert snapshot.ingredient("olive oil") == "Olive Oil"
+    assert client.get("/api/ingredients/olive_oil").get_json()["name"] == "Olive Oil"
+    assert client.get("/api/ingredients/unknown").get_json() is None
+
+    response = client.post("/api/ingredient_post", json={"name": "Salt", "serving_size": 1, "unit_of_measurement": "pinch"})
+    assert response.status_code == 400
+    response = client.post("/api/recipe_post", json={"recipe_name": "Oil", "instructions": "Pour",
+                                                     "ingredients": [["Olive Oil", 1, "spoonful"]]})
+    assert response.status_code == 400
+    response = client.post("/api/recipe_post", json={"recipe_name": "Oil", "instructions": "Pour",
+                                                     "ingredients": [["olive oil", 1, "tbsp."]], "servings": 1})
+    assert response.status_code == 200
+    assert catalog.get_snapshot().has_recipe("OIL")
+
+    # Catalog writes update the snapshot in place, pantry writes leave it alone
+    snapshot = catalog.get_snapshot()
+    version = snapshot.version
+    assert recipe_interface.add_to_pantry("Olive Oil", 5)
+    assert catalog.get_snapshot() is snapshot and snapshot.version == version
+    assert recipe_interface.remove_recipe("Oil")
+    assert catalog.get_snapshot() is snapshot and not snapshot.has_recipe("oil")
+    assert snapshot.version > version
+
+    # Rows written by another process are found in the database instead of reported missing
+    other = database.connect(database.DB_PATH)
+    other.execute("INSERT INTO ingredients (name, serving_size, unit_of_measurement) VALUES ('Vinegar', 1, 'ml')")
+    other.execute("INSERT INTO recipes (name, instructions) VALUES ('Dressing', 'Shake')")
+    other.commit()
+    other.close()
+    assert snapshot.ingredient("VINEGAR") == "Vinegar" and "vinegar" in snapshot.ingredients
+    assert client.get("/api/recipes/dressing").get_json()["recipe"]["name"] == "Dressing"
+
+
+def test_json_extraction_fuzz_and_linear_time():
+    """Test that JSON recipes are recovered from noisy, chunked LLM output in linear time."""
+    import random
+    from flask_backend.src import json_extract, llm_interface
+    rng = random.Random(15)
+    noise = ["{", "}", "\\", "Sure! ", "```json\n", "```", "\n", "{draft}", "a \"quote\" ", "x"]
+
+    def random_recipe():
+        return {
+            "title": "Dish " + "".join(rng.choice('ab{}"\\ ') for _ in range(rng.randint(0, 12))),
+            "ingredients": [[f"item {i}", rng.randint(1, 5), "g"] for i in range(rng.randint(0, 4))],
+            "instructions": ["Stir {gently}", 'Say "done"'],
+            "meta": {"nested": {"deep": [1, {"x": "}"}]}},
+        }
+
+    for _ in range(300):
+        recipe = random_recipe()
+        # Prose never contains a valid object, so the recipe is the largest one
+        prefix = "".join(rng.choice(noise) for _ in range(rng.randint(0, 6)))
+        text = prefix + "\n```json\n" + json.dumps(recipe, indent=rng.choice([None, 2])) + "\n```\nEnjoy {"
+        assert llm_interface.parse_recipe_json(text) == recipe
+
+        # Fed in random pieces, as when streaming
+        extractor = json_extract.JSONObjectExtractor()
+        position = 0
+        while position < len(text):
+            size = rng.randint(1, 9)
+            extractor.feed(text[position:position + size])
+            position += size
+        assert extractor.finish() == recipe
+
+    # A truncated outer object still yields the complete recipe inside it
+    assert llm_interface.parse_recipe_json('{"response": {"title": "Inner"}, "more": [') == {"title": "Inner"}
+    with pytest.raises(ValueError):
+        llm_interface.parse_recipe_json("no json here")
+
+    def timed(text):
+        start = time.perf_counter()
+        json_extract.extract_json_object(text)
+        return time.perf_counter() - start
+
+    # Pathological input for the old non-greedy regex: many unmatched braces
+    # (the regex took seconds on 20k braces), 4x the input should take about 4x the time
+    for size in (20_000, 60_000):
+        small, large = timed("{" * size), timed("{" * (4 * size))
+        assert large < max(small, 0.002) * 4 * 4
+    big = json.dumps({"title": "Big", "instructions": ["step {" + str(i) + "}" for i in range(50_000)]})
+    assert timed("noise " * 10_000 + big) < 2
+
+
+def test_ingredient_search_and_resolution(client, temp_db):
+    """Test ingredient autocomplete and fuzzy resolution of LLM ingredient names."""
+    from flask_backend.src import ingredient_search, llm_interface, recipe_interface
+    for name in ("Garlic", "Parmesan Cheese", "Cheddar Cheese", "Olive Oil", "Tomato"):
+        recipe_interface.insert_ingredient(name, 1, "piece(s)")
+
+    # The first request starts a background build and is answered with whole-name prefix matches
+    index = ingredient_search.get_index(build=False)
+    assert client.get("/api/ingredients/search?q=olive_oil").get_json() == ["Olive Oil"]
+    index.ensure_built()
+    assert index.warm
+
+    assert client.get("/api/ingredients/search?q=chee").get_json() == ["Cheddar Cheese", "Parmesan Cheese"]
+    assert client.get("/api/ingredients/search?q=olive_oil").get_json()[0] == "Olive Oil"
+    assert client.get("/api/ingredients/search?q=tomatos").get_json() == ["Tomato"]
+
+    # Kept up to date by inserts and removals
+    recipe_interface.insert_ingredient("Cheese", 1, "piece(s)")
+    assert client.get("/api/ingredients/search?q=chee&limit=1").get_json() == ["Cheese"]
+    recipe_interface.remove_ingredient("Cheese")
+    assert "Cheese" not in client.get("/api/ingredients/search?q=chee").get_json()
+
+    assert index.resolve("garlic cloves") == "Garlic"
+    assert index.resolve("PARMESAN") == "Parmesan Cheese"
+    assert index.resolve("unobtainium") is None
+
+    recipe = {"title": "Garlic Toast", "ingredients": [["garlic cloves", 2, "clove(s)"], ["olive oil", 1, "tbsp."]],
+              "instructions": ["Toast"]}
+    assert llm_interface.add_parsed_recipe(recipe) == "Garlic Toast"
+    saved = recipe_interface.get_recipe("garlic toast")["ingredients"]
+    assert sorted(row["ingredient_name"] for row in saved) == ["Garlic", "Olive Oil"]
+
+    # Fuzzy results match a brute force ranking over names sharing words (the index only reads
+    # the postings that can reach the threshold)
+    words = ["red", "green", "hot", "chili", "pepper", "flakes", "sauce", "oil", "olive", "smoked"]
+    rng = random.Random(7)
+    names = {" ".join(rng.sample(words, rng.randint(1, 3))).title() for _ in range(400)}
+    index = ingredient_search.IngredientSearchIndex(":memory:")
+    index.warm = True
+    index.add(names)
+    removed = sorted(names)[::5]
+    for name in removed:
+        index.remove(name)
+    names -= set(removed)
+    for query in ("red chili flakes", "chilli", "oliv oil", "smoked hot pepper sauce", "xyz"):
+        for threshold in (0.3, 0.6):
+            grams = ingredient_search.trigrams(query)
+            expected = sorted(((len(grams & ingredient_search.trigrams(name)) / len(grams | ingredient_search.trigrams(name)),
+                                name) for name in names), key=lambda item: (-item[0], len(item[1]), item[1].lower()))
+            expected = [(name, round(value, 3)) for value, name in expected if value >= threshold][:10]
+            assert index.fuzzy_search(query, 10, threshold) == expected
+
+
+def test_search_recipes(client, temp_db):
+    """Test full-text recipe search with ranking, snippets, filters and pagination."""
+    from flask_backend.src import recipe_interface
+    recipe_interface.insert_ingredient("Garlic", 1, "clove(s)")
+    recipes = [
+        ("Garlic Bread", "Spread butter on bread and bake", "snack", 5),
+        ("Pasta Aglio", "Fry sliced garlic in oil and toss with pasta", "dinner", 10),
+        ("Roast Garlic", "Roast whole garlic heads until soft", "dinner", 5),
+        ("Fruit Salad", "Chop the fruit", "breakfast", 5),
+    ]
+    for name, instructions, meal_type, prep_time in recipes:
+        assert recipe_interface.add_recipe(name, instructions, [("Garlic", 1, "clove(s)")], meal_type=meal_type,
+                                           prep_time=prep_time, cook_time=10)
+
+    results = client.get("/api/recipes/search?q=garlic").get_json()
+    names = [result["recipe"]["name"] for result in results]
+    # Name matches rank above instructions-only matches
+    assert set(names[:2]) == {"Garlic Bread", "Roast Garlic"} and names[2] == "Pasta Aglio"
+    assert results[2]["snippet"].count("**garlic**") == 1
+    assert results[0]["ingredients"][0]["ingredient_name"] == "Garlic"
+
+    # Prefix matching on the last word, stemming, and FTS syntax treated as text
+    assert [r["recipe"]["name"] for r in client.get("/api/recipes/search?q=roast_garl").get_json()] == ["Roast Garlic"]
+    assert [r["recipe"]["name"] for r in client.get("/api/recipes/search?q=roasting").get_json()] == ["Roast Garlic"]
+    assert client.get('/api/recipes/search?q=garlic"+AND+(').status_code == 200
+
+    filtered = client.get("/api/recipes/search?q=garlic&meal_type=dinner&prep_time=0,5").get_json()
+    assert [result["recipe"]["name"] for result in filtered] == ["Roast Garlic"]
+
+    first = client.get("/api/recipes/search?q=garlic&limit=2")
+    assert first.headers["X-Next-Offset"] == "2"
+    second = client.get("/api/recipes/search?q=garlic&limit=2&offset=2").get_json()
+    assert [r["recipe"]["name"] for r in first.get_json() + second] == names
+
+    # Triggers keep the index in step with deletes and updates
+    recipe_interface.remove_recipe("Roast Garlic")
+    temp_db.execute("UPDATE recipes SET instructions = 'Slice fruit' WHERE name = 'Pasta Aglio'")
+    temp_db.commit()
+    assert [r["recipe"]["name"] for r in recipe_interface.search_recipes("garlic")] == ["Garlic Bread"]
+
+
+def test_recommend_expiring(client, temp_db):
+    """Test that recipes using up soon-to-expire pantry lots are recommended first."""
+    from flask_backend.src import recipe_interface
+    now = round(time.time())
+    day = 86400
+    recipe_interface.insert_ingredient("Milk", 100, "ml")
+    recipe_interface.insert_ingredient("Spinach", 100, "g")
+    recipe_interface.insert_ingredient("Rice", 100, "g")
+    recipe_interface.add_to_pantry("Milk", 500, purchase_date=now, expiry_date=now + 5 * day)
+    recipe_interface.add_to_pantry("Milk", 500, purchase_date=now, expiry_date=now + 1 * day)
+    recipe_interface.add_to_pantry("Spinach", 100, purchase_date=now, expiry_date=now + 2 * day)
+    recipe_interface.add_to_pantry("Rice", 1000, purchase_date=now, expiry_date=now + 100 * day)
+    recipe_interface.add_recipe("Milkshake", "Blend", [("Milk", 700, "ml")])
+    recipe_interface.add_recipe("Spinach Soup", "Simmer", [("Spinach", 100, "g"), ("Milk", 100, "ml")])
+    recipe_interface.add_recipe("Rice Bowl", "Boil", [("Rice", 100, "g")])
+
+    recommendations = client.get("/api/recommendations?days=7").get_json()
+    assert [r["recipe"]["name"] for r in recommendations] == ["Milkshake", "Spinach Soup"]
+
+    # The milk expiring first is used up before the later lot is touched
+    milkshake = recommendations[0]
+    assert sorted((use["quantity"], use["expiry_date"]) for use in milkshake["uses"]) == \
+        [(200, now + 5 * day), (500, now + 1 * day)]
+    assert milkshake["score"] == pytest.approx(1 / 2 + 0.4 / 6, rel=1e-3)
+    assert recommendations[1]["score"] == pytest.approx(1 / 3 + 0.2 / 2, rel=1e-3)
+
+    # A shorter window only sees the first milk lot and the spinach
+    short = client.get("/api/recommendations?days=3&limit=1").get_json()
+    assert [use["quantity"] for use in short[0]["uses"]] == [500]
+
+def test_coverage_scoring(client, temp_db):
+    """Test max_missing and sort=coverage on the filtered recipes endpoint."""
+    from flask_backend.src import coverage, recipe_interface
+    now = round(time.time())
+    for name in ("Egg", "Flour", "Sugar", "Butter"):
+        recipe_interface.insert_ingredient(name, 100, "g")
+    recipe_interface.add_to_pantry("Egg", 6, purchase_date=now)
+    recipe_interface.add_to_pantry("Flour", 500, purchase_date=now)
+    # Expired lots do not count as available
+    recipe_interface.add_to_pantry("Sugar", 100, purchase_date=now - 10, expiry_date=now - 5)
+    recipe_interface.add_recipe("Pancakes", "Mix", [("Egg", 2, "g"), ("Flour", 200, "g")])
+    recipe_interface.add_recipe("Cake", "Bake", [("Egg", 2, "g"), ("Flour", 200, "g"), ("Sugar", 100, "g"),
+                                                 ("Butter", 100, "g")])
+    recipe_interface.add_recipe("Cookies", "Bake", [("Flour", 200, "g"), ("Sugar", 100, "g"), ("Butter", 50, "g")])
+    recipe_interface.add_recipe("Fudge", "Melt", [("Sugar", 100, "g"), ("Butter", 100, "g")])
+
+    ranked = client.get("/api/recipes/?sort=coverage").get_json()
+    assert [(r["recipe"]["name"], r["coverage"], r["missing"]) for r in ranked] == \
+        [("Pancakes", 1.0, 0), ("Cake", 0.5, 2), ("Cookies", 0.333, 2), ("Fudge", 0.0, 2)]
+
+    complete = client.get("/api/recipes/?max_missing=0").get_json()
+    assert [r["recipe"]["name"] for r in complete] == ["Pancakes"]
+    within_two = client.get("/api/recipes/?max_missing=2&meal_type=dinner").get_json()
+    assert within_two == []
+
+    # Cursor pagination follows the ranking
+    first = client.get("/api/recipes/?sort=coverage&limit=2")
+    assert [r["recipe"]["name"] for r in first.get_json()] == ["Pancakes", "Cake"]
+    rest = client.get(f"/api/recipes/?sort=coverage&limit=2&after={first.headers['X-Next-After']}").get_json()
+    assert [r["recipe"]["name"] for r in rest] == ["Cookies", "Fudge"]
+    assert client.get("/api/recipes/?sort=name").status_code == 400
+
+    # New recipes are picked up by a rebuild on the next query
+    recipe_interface.add_recipe("Boiled Egg", "Boil", [("Egg", 1, "g")])
+    names = [r["recipe"]["name"] for r in recipe_interface.filter_recipes(max_missing=0)]
+    assert names == ["Pancakes", "Boiled Egg"]
+    stats = coverage.get_matrix().stats()
+    assert stats["recipes"] == 5 and stats["nonzeros"] == 12 and stats["memory_bytes"] > 0
+
+def test_recipe_nutrition(client, temp_db):
+    """Test the materialized nutrition totals and the calorie/protein filters."""
+    from flask_backend.src import database, recipe_interface
+    recipe_interface.insert_ingredient("Egg", 50, "g", calories=70, protein=6)
+    recipe_interface.insert_ingredient("Milk", 100, "ml", calories=60, protein=3)
+    recipe_interface.insert_ingredient("Sugar", 10, "g", calories=40)
+    recipe_interface.add_recipe("Omelette", "Whisk", [("Egg", 150, "g"), ("Milk", 100, "ml")], servings=2)
+    recipe_interface.add_recipe("Custard", "Stir", [("Egg", 50, "g"), ("Milk", 1, "piece(s)"), ("Sugar", 50, "g")])
+
+    omelette = client.get("/api/recipes/Omelette").get_json()["nutrition"]
+    assert omelette["total"]["calories"] == 270 and omelette["total"]["protein"] == 21
+    assert omelette["per_serving"]["calories"] == 135 and omelette["unconverted"] == 0
+    # Milk in pieces cannot be converted to the ingredient's ml servings
+    custard = recipe_interface.get_recipe("Custard")["nutrition"]
+    assert custard["total"]["calories"] == 270 and custard["unconverted"] == 1
+
+    def names(query):
+        return [r["recipe"]["name"] for r in client.get("/api/recipes/?" + query).get_json()]
+
+    assert names("calories=100,200") == ["Omelette"]
+    assert names("calories=0,1000&protein=8,20") == ["Omelette"]
+    assert names("calories=200,300") == ["Custard"]
+
+    # Totals follow changes to an ingredient's nutrition and to the recipe's ingredients
+    conn = database.get_connection()
+    conn.execute("UPDATE ingredients SET calories = 100 WHERE name = 'Egg'")
+    conn.execute("DELETE FROM recipe_ingredients WHERE recipe_name = 'Custard' AND ingredient_name = 'Sugar'")
+    conn.commit()
+    database.bump_generation()
+    assert names("calories=100,150") == ["Custard"]
+    assert names("calories=150,200") == ["Omelette"]
+    live = [tuple(row) for row in conn.execute("SELECT * FROM recipe_nutrition_live ORDER BY recipe_id")]
+    stored = [tuple(row)[:10] for row in conn.execute("SELECT * FROM recipe_nutrition ORDER BY recipe_id")]
+    assert live == stored
+
+    recipe_interface.remove_recipe("Omelette")
+    assert conn.execute("SELECT COUNT(*) FROM recipe_nutrition").fetchone()[0] == 1
+
+def test_unit_conversion(client, temp_db):
+    """Test the unit engine and that pantry summaries, nutrition and recommendations convert units."""
+    from flask_backend.src import llm_interface, recipe_interface, units
+    table = units.get_table()
+    converted = table.convert([1, 2, 16, 1, 1, 3], ["cup(s)", "tbsp.", "oz", "cup(s)", "g", "piece(s)"],
+                              ["ml", "tsp.", "lb", "g", "cup(s)", "piece(s)"], [None, None, None, 0.5, None, None])
+    assert converted[:5] == pytest.approx([236.588, 6.0, 1.0, 118.294, float("nan")], rel=1e-4, nan_ok=True)
+    assert converted[5] == 3
+    assert table.convert_one(1, "piece(s)", "g") is None
+    assert table.convert_one(100, "g", "ml", density=0.5) == pytest.approx(200)
+
+    now = round(time.time())
+    recipe_interface.insert_ingredient("Flour", 100, "g", calories=364, density=0.53)
+    recipe_interface.insert_ingredient("Garlic", 1, "clove(s)", calories=4)
+    recipe_interface.add_to_pantry("Flour", 1, purchase_date=now, expiry_date=now + 86400, unit_of_measurement="lb")
+    recipe_interface.add_to_pantry("Flour", 2, purchase_date=now, expiry_date=now + 86400, unit_of_measurement="cup(s)")
+    recipe_interface.add_to_pantry("Garlic", 3, purchase_date=now)
+    recipe_interface.add_to_pantry("Garlic", 1, purchase_date=now, unit_of_measurement="piece(s)")
+
+    summary = llm_interface.get_pantry_summary()
+    flour_grams = 453.592 + 2 * 236.588 * 0.53
+    assert f"Flour: {round(flour_grams, 2)} g total in pantry" in summary
+    assert "Garlic: 3.0 clove(s) total in pantry (plus 1.0 piece(s))" in summary
+
+    # 1 cup of flour is 125.39 g, 3.64 calories per g
+    recipe_interface.add_recipe("Roux", "Whisk", [("Flour", 1, "cup(s)"), ("Garlic", 2, "clove(s)")])
+    nutrition = recipe_interface.get_recipe("Roux")["nutrition"]
+    assert nutrition["total"]["calories"] == pytest.approx(236.588 * 0.53 * 3.64 + 8, abs=0.01)
+    assert nutrition["unconverted"] == 0
+
+    uses = recipe_interface.recommend_expiring(days=3)[0]["uses"]
+    assert uses[0]["unit_of_measurement"] == "g"
+    assert uses[0]["quantity"] == pytest.approx(236.588 * 0.53, rel=1e-4)
+
+def test_cook_recipe(client, temp_db):
+    """Test that cooking deducts pantry lots earliest expiry first, atomically and under concurrency."""
+    from flask_backend.src import database, recipe_interface
+    now = round(time.time())
+    day = 86400
+    recipe_interface.insert_ingredient("Egg", 1, "piece(s)")
+    recipe_interface.insert_ingredient("Butter", 100, "g")
+    recipe_interface.add_to_pantry("Egg", 4, purchase_date=now, expiry_date=now + 5 * day)
+    recipe_interface.add_to_pantry("Egg", 2, purchase_date=now, expiry_date=now + 1 * day)
+    recipe_interface.add_to_pantry("Egg", 6, purchase_date=now)
+    recipe_interface.add_to_pantry("Egg", 12, purchase_date=now - 10 * day, expiry_date=now - day)
+    recipe_interface.add_to_pantry("Butter", 1, purchase_date=now, unit_of_measurement="lb")
+    recipe_interface.add_recipe("Scrambled Eggs", "Stir", [("Egg", 3, "piece(s)"), ("Butter", 1, "oz")])
+
+    response = client.post("/api/recipes/scrambled_eggs/cook")
+    assert response.status_code == 200
+    used = {(lot["ingredient_name"], round(lot["quantity"], 4), lot["emptied"]) for lot in response.get_json()["used"]}
+    # Both eggs expiring tomorrow, then one from the next lot; butter is taken in the lot's pounds
+    assert used == {("Egg", 2, True), ("Egg", 1, False), ("Butter", round(28.3495 / 453.592, 4), False)}
+    conn = database.get_connection()
+    eggs = [tuple(row) for row in conn.execute(
+        "SELECT quantity, expiry_date FROM pantry WHERE ingredient_name = 'Egg' ORDER BY id")]
+    assert eggs == [(3, now + 5 * day), (6, None), (12, now - day)]
+
+    # Not enough eggs left (expired ones do not count): nothing is deducted
+    recipe_interface.add_recipe("Big Omelette", "Whisk", [("Egg", 10, "piece(s)")])
+    response = client.post("/api/recipes/big_omelette/cook")
+    assert response.status_code == 409
+    assert response.get_json()["missing"] == [{"ingredient_name": "Egg", "needed": 10, "available": 9,
+                                               "unit_of_measurement": "piece(s)"}]
+    assert conn.execute("SELECT SUM(quantity) FROM pantry WHERE ingredient_name = 'Egg'").fetchone()[0] == 21
+    assert client.post("/api/recipes/unknown/cook").status_code == 404
+
+    # Concurrent cooks never spend the same eggs: 9 fresh eggs make exactly 3 more recipes
+    recipe_interface.add_recipe("Fried Eggs", "Fry", [("Egg", 3, "piece(s)")])
+    results = []
+
+    def cook():
+        results.append(recipe_interface.cook_recipe("Fried Eggs"))
+        database.close_connection()
+
+    threads = [threading.Thread(target=cook) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(result["cooked"] for result in results) == [False] * 5 + [True] * 3
+    remaining = [row[0] for row in conn.execute(
+        "SELECT quantity FROM pantry WHERE ingredient_name = 'Egg' AND (expiry_date > ? OR expiry_date IS NULL)", (now,))]
+    assert remaining == []
+
+def test_meal_plan(client, temp_db):
+    """Test that the meal plan uses up expiring stock first and respects meal types and times."""
+    from flask_backend.src import database, meal_plan, recipe_interface
+    now = round(time.time())
+    day = 86400
+    for name, unit in (("Spinach", "g"), ("Milk", "ml"), ("Egg", "piece(s)"), ("Rice", "g"),
+                       ("Oats", "g"), ("Bread", "piece(s)"), ("Salmon", "g")):
+        recipe_interface.insert_ingredient(name, 100, unit)
+    # The spinach is only good today, the milk until tomorrow evening
+    recipe_interface.add_to_pantry("Spinach", 200, purchase_date=now, expiry_date=now + day)
+    recipe_interface.add_to_pantry("Milk", 1, purchase_date=now, expiry_date=now + 2 * day, unit_of_measurement="L")
+    recipe_interface.add_to_pantry("Egg", 6, purchase_date=now)
+    recipe_interface.add_to_pantry("Rice", 1000, purchase_date=now, expiry_date=now + 100 * day)
+    recipes = (("Spinach Omelette", "Breakfast", 10, [("Egg", 2, "piece(s)"), ("Spinach", 100, "g")]),
+               ("Porridge", "Breakfast", 10, [("Milk", 250, "ml"), ("Oats", 100, "g")]),
+               ("Toast", "Breakfast", 5, [("Bread", 2, "piece(s)")]),
+               ("Spinach Soup", "Dinner", 30, [("Spinach", 100, "g"), ("Milk", 250, "ml")]),
+               ("Rice Pudding", "Dinner", 90, [("Rice", 100, "g"), ("Milk", 500, "ml")]),
+               ("Salmon Rice", "Dinner", 20, [("Salmon", 200, "g"), ("Rice", 100, "g")]))
+    for name, meal_type, cook_time, ingredients in recipes:
+        recipe_interface.add_recipe(name, "Cook", ingredients, meal_type=meal_type, prep_time=5, cook_time=cook_time)
+
+    response = client.get("/api/meal_plan?days=2&meals=breakfast,dinner")
+    assert response.status_code == 200
+    plan = response.get_json()
+    assert [(meal["day"], meal["meal"], meal["recipe"]["name"]) for meal in plan["plan"]] == [
+        (0, "breakfast", "Spinach Omelette"), (0, "dinner", "Spinach Soup"),
+        (1, "breakfast", "Porridge"), (1, "dinner", "Rice Pudding")]
+    assert plan["plan"][2]["missing"] == [{"ingredient_name": "Oats", "quantity": 100, "unit_of_measurement": "g"}]
+    assert plan["wasted"] == []
+    assert plan["cost"] == {"wasted_lots": 0, "missing": 1}
+
+    # Too slow to cook within the hour: half of the milk goes off
+    plan = client.get("/api/meal_plan?days=2&meals=breakfast,dinner&cook_time=0,60").get_json()
+    assert [meal["recipe"]["name"] for meal in plan["plan"]] == ["Spinach Omelette", "Spinach Soup", "Porridge", "Salmon Rice"]
+    assert [(lot["ingredient_name"], lot["quantity"]) for lot in plan["wasted"]] == [("Milk", 500)]
+    assert plan["cost"] == {"wasted_lots": 0.5, "missing": 2}
+
+    # Recipes are not repeated, and a meal type without recipes stays empty
+    plan = client.get("/api/meal_plan?days=4&meals=breakfast,snack").get_json()
+    breakfasts = [meal["recipe"]["name"] if meal["recipe"] else None for meal in plan["plan"] if meal["meal"] == "breakfast"]
+    assert sorted(breakfasts[:3]) == ["Porridge", "Spinach Omelette", "Toast"] and breakfasts[3] is None
+    assert all(meal["recipe"] is None for meal in plan["plan"] if meal["meal"] == "snack")
+
+    assert client.get("/api/meal_plan?days=0").status_code == 400
+    assert client.get("/api/meal_plan?days=15").status_code == 400
+
+    # Recipe writes update the recipe table in place, to the same arrays a rebuild reads
+    table = meal_plan.get_table()
+    data = table.current()
+    recipe_interface.insert_ingredient("Flour", 100, "g")
+    recipe_interface.add_recipe("Pancakes", "Fry", [("Flour", 1, "cup(s)"), ("Milk", 1, "cup(s)"), ("Egg", 2, "piece(s)")],
+                                meal_type="Breakfast", prep_time=5, cook_time=10)
+    appended = table.current()
+    recipe_interface.add_recipe("Crepes", "Fry", [("Flour", 100, "g"), ("Milk", 250, "ml")], meal_type="Breakfast")
+    recipe_interface.remove_recipe("Toast")
+    updated = table.current()
+    assert updated is not data and table.stats()["warm"]
+    # Arrays handed out earlier are not changed by later writes
+    assert len(data["recipe_ids"]) == 6 and len(appended["recipe_ids"]) == 7 and len(updated["recipe_ids"]) == 7
+    rebuilt = table._read(database.get_connection())
+    assert updated["recipe_ids"].tolist() == rebuilt["recipe_ids"].tolist()
+    assert updated["meal_types"].tolist() == rebuilt["meal_types"].tolist()
+    assert updated["indptr"].tolist() == rebuilt["indptr"].tolist()
+    def entries(data):
+        # NaN (flour by the cup has no density) compared as None
+        return [sorted((data["names"][column], None if amount != amount else round(float(amount), 6)) for column, amount in
+                       zip(data["indices"][start:end], data["amounts"][start:end]))
+                for start, end in zip(data["indptr"][:-1], data["indptr"][1:])]
+    assert entries(updated) == entries(rebuilt)
+    plan = client.get("/api/meal_plan?days=4&meals=breakfast").get_json()
+    assert sorted(meal["recipe"]["name"] for meal in plan["plan"] if meal["recipe"]) == \
+        ["Crepes", "Pancakes", "Porridge", "Spinach Omelette"]
+
+    # Other changes are picked up by a background build, the previous arrays are served meanwhile
+    table.invalidate()
+    assert table.current() is updated
+    table._built.wait(5)
+    assert table.current() is not updated and table.stats()["warm"]
+
+def test_benchmark_suite(tmp_path):
+    """Test that the benchmark catalog is deterministic and that comparing results flags regressions."""
+    from flask_backend.benchmarks import compare, datagen, suite
+    from flask_backend.src import database
+    original_path = database.DB_PATH
+    tables = ("ingredients", "recipes", "recipe_ingredients", "pantry")
+    dumps = []
+    for run in ("first", "second"):
+        conn = database.connect(datagen.generate(str(tmp_path / run), 200, seed=3))
+        dumps.append({table: [tuple(row) for row in conn.execute(f"SELECT * FROM {table} ORDER BY 1, 2")]
+                      for table in tables})
+        conn.close()
+    assert dumps[0] == dumps[1]
+    assert len(dumps[0]["recipes"]) == 200 and 3 * 200 <= len(dumps[0]["recipe_ingredients"]) <= 15 * 200
+    assert database.DB_PATH == original_path
+
+    only = {"micro/get_recipe", "micro/filter_recipes_meal_type", "endpoint/recipes_meal_type", "micro/add_recipe"}
+    results = suite.run(["200"], str(tmp_path / "first"), seed=3, repeat=2, only=only, log=lambda line: None)
+    assert database.DB_PATH == original_path
+    size = results["sizes"]["200"]
+    assert set(size["benchmarks"]) == only and size["recipes"] == 200
+    assert all(timing["runs"] == 2 for timing in size["benchmarks"].values())
+    # The recipes add_recipe added are gone again
+    conn = database.connect(datagen.database_path(str(tmp_path / "first"), 200, 3))
+    assert conn.execute("SELECT COUNT(*) FROM recipes").fetchone()[0] == 200
+    conn.close()
+
+    slower = json.loads(json.dumps(results))
+    slower["sizes"]["200"]["benchmarks"]["micro/get_recipe"]["median_ms"] += 10
+    del slower["sizes"]["200"]["benchmarks"]["micro/add_recipe"]
+    rows = {row["name"]: row["status"] for row in compare.compare(results, slower)}
+    assert rows["micro/get_recipe"] == "regression" and rows["micro/add_recipe"] == "missing"
+    assert rows["endpoint/recipes_meal_type"] == "same"
+    assert all(row["status"] == "same" for row in compare.compare(results, results))
+
+
+def test_metrics(client, temp_db, completion_server, monkeypatch):
+    """Test that /metrics exposes per-route latency, per-request query counts, LLM latency and slow queries."""
+    from flask_backend.src import completion_client, llm_interface, metrics, recipe_interface
+    metrics.reset()
+    recipe_interface.insert_ingredient("Eggs", 1, "piece(s)")
+    recipe_interface.add_recipe("Boiled Eggs", "Boil", [("Eggs", 2, "piece(s)")], meal_type="Breakfast")
+
+    # Every query is slow, so the slow query log records the filter query with its parameters
+    monkeypatch.setattr(metrics, "SLOW_QUERY_SECONDS", 0)
+    assert len(client.get("/api/recipes/?meal_type=breakfast").get_json()) == 1
+    monkeypatch.setattr(metrics, "SLOW_QUERY_SECONDS", 60)
+    assert client.get("/api/recipes/Boiled_Eggs").status_code == 200
+    assert client.get("/api/no_such_route").status_code == 404
+
+    completion_server.content = "ok"
+    completion_client.CompletionClient().post(llm_interface.ARLIAI_API_URL, {"messages": []})
+
+    requests, queries = metrics.REQUEST_QUERIES.summary("GET", "/api/recipes/")
+    assert metrics.REQUEST_SECONDS.summary("GET", "/api/recipes/")[0] == requests == 1 and queries > 0
+    assert metrics.REQUESTS.value("GET", "/api/recipes/<recipe_name>", "200") == 1
+    assert metrics.REQUESTS.value("GET", "unmatched", "404") == 1
+    assert metrics.LLM_SECONDS.summary("false", "ok")[0] == 1
+
+    slow = [entry for entry in metrics.slow_queries() if entry["route"] == "/api/recipes/"]
+    assert slow and any("breakfast" in entry["parameters"].lower() for entry in slow)
+    assert client.get("/api/stats").get_json()["metrics"]["slow_queries"] == metrics.slow_queries()
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.get_data(as_text=True)
+    assert '# TYPE recipeapp_http_request_duration_seconds histogram' in text
+    assert 'recipeapp_http_request_duration_seconds_bucket{method="GET",route="/api/recipes/",le="+Inf"} 1' in text
+    assert 'recipeapp_http_requests_total{method="GET",route="/api/recipes/<recipe_name>",status="200"} 1' in text
+    assert 'recipeapp_llm_request_duration_seconds_count{stream="false",outcome="ok"} 1' in text
+    assert 'recipeapp_sqlite_query_duration_seconds_count{statement="SELECT"}' in text
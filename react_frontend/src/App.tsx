@@ -8,7 +8,7 @@ import "./App.css";
 
 const AppContent: React.FC = () => {
   const { ingredients, showIngredientsModal, filters } = useAppContext();
-  const { recipes, loading } = useRecipes(ingredients, filters);
+  const { recipes, loading, loadMore } = useRecipes(ingredients, filters);
   const [sidebarOpen, setSidebarOpen] = useState(false);
 
   return (
@@ -25,7 +25,7 @@ const AppContent: React.FC = () => {
           <Sidebar />
         </div>
         <div className="feed-container">
-          <ScrollFeed recipes={recipes} loading={loading} />
+          <ScrollFeed recipes={recipes} loading={loading} onEndReached={loadMore} />
         </div>
       </div>
     </div>
@@ -1,19 +1,28 @@
 //api/recipeService.ts
 
-import { Recipe } from '../types/index.js';
+import { Recipe, RecipePage } from '../types/index.js';
 
 const API_BASE_URL = 'http://localhost:5000/api';
 
+export const RECIPE_PAGE_SIZE = 10;
+
+// Fetches one keyset page of recipes; pass the previous page's nextAfter to get the next one
 export const fetchRecipesByIngredients = async (
   ingredients: string[],
   filters?: {
     caloriesMin?: number;
     caloriesMax?: number;
     mealTypes?: string[];
-  }
-): Promise<Recipe[]> => {
+  },
+  after?: number | null
+): Promise<RecipePage> => {
   try {
     const params = new URLSearchParams();
+    params.append('limit', String(RECIPE_PAGE_SIZE));
+
+    if (after != null) {
+      params.append('after', String(after));
+    }
     
     if (ingredients.length > 0) {
       params.append('ingredients', ingredients.map(i => i.replace(/\s+/g, '_')).join(','));
@@ -22,6 +31,10 @@ export const fetchRecipesByIngredients = async (
     if (filters?.mealTypes && filters.mealTypes.length > 0) {
       params.append('meal_type', filters.mealTypes[0]);
     }
+
+    if (filters?.caloriesMin != null && filters?.caloriesMax != null) {
+      params.append('calories', `${filters.caloriesMin},${filters.caloriesMax}`);
+    }
   
     const response = await fetch(`${API_BASE_URL}/recipes/?${params.toString()}`);
     
@@ -38,21 +51,34 @@ export const fetchRecipesByIngredients = async (
       prep_time: entry.recipe.prep_time,
       cook_time: entry.recipe.cook_time,
       servings: entry.recipe.servings,
-      calories: entry.recipe.calories,
+      calories: entry.nutrition?.per_serving.calories,
       ingredients: entry.ingredients,
     }));
 
-    return recipes;
+    const nextAfter = response.headers.get('X-Next-After');
+    return { recipes, nextAfter: nextAfter ? Number(nextAfter) : null };
   } catch (error) {
     console.error('Error fetching recipes:', error);
     throw error;
   }
 };
 
+// Autocomplete suggestions for ingredient names
+export const searchIngredients = async (query: string, limit = 8): Promise<string[]> => {
+  if (!query.trim()) return [];
+  const params = new URLSearchParams({ q: query, limit: String(limit) });
+  const response = await fetch(`${API_BASE_URL}/ingredients/search?${params.toString()}`);
+  if (!response.ok) throw new Error('Failed to search ingredients');
+  return response.json();
+};
+
+// Generation runs as a background job on the server; poll its status until it finishes
+const GENERATION_POLL_INTERVAL_MS = 1000;
+
 export const generateRecipe = async (
   ingredients: string[],
   preference?: string
-): Promise<void> => {
+): Promise<string> => {
   try {
     const response = await fetch(`${API_BASE_URL}/generate_recipe`, {
       method: 'POST',
@@ -66,8 +92,23 @@ export const generateRecipe = async (
       throw new Error(`API error: ${response.status}`);
     }
 
-    const data = await response.json();
-    console.log('Generated recipe:', data.message);
+    const { job_id } = await response.json();
+
+    while (true) {
+      await new Promise(resolve => setTimeout(resolve, GENERATION_POLL_INTERVAL_MS));
+      const statusResponse = await fetch(`${API_BASE_URL}/generate_recipe/${job_id}`);
+      if (!statusResponse.ok) {
+        throw new Error(`API error: ${statusResponse.status}`);
+      }
+      const job = await statusResponse.json();
+      if (job.status === 'done') {
+        console.log('Generated recipe:', job.recipe_name);
+        return job.recipe_name;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error);
+      }
+    }
   } catch (error) {
     console.error('Error generating recipe:', error);
     throw error;
@@ -1,5 +1,6 @@
-import React, { useState } from 'react';
+import React, { useEffect, useState } from 'react';
 import { useAppContext } from '../../context/AppContext';
+import { searchIngredients } from '../../api/recipeService';
 import './IngredientsModal.css';
 
 const IngredientsModal: React.FC = () => {
@@ -13,6 +14,26 @@ const IngredientsModal: React.FC = () => {
   } = useAppContext();
   
   const [newIngredient, setNewIngredient] = useState('');
+  const [suggestions, setSuggestions] = useState<string[]>([]);
+
+  // Ask the server for matching ingredient names once typing pauses
+  useEffect(() => {
+    const query = newIngredient.trim();
+    if (!query) {
+      setSuggestions([]);
+      return;
+    }
+    let cancelled = false;
+    const timer = setTimeout(() => {
+      searchIngredients(query)
+        .then(names => { if (!cancelled) setSuggestions(names); })
+        .catch(() => { if (!cancelled) setSuggestions([]); });
+    }, 150);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [newIngredient]);
 
   const handleAddIngredient = () => {
     if (newIngredient.trim()) {
@@ -48,7 +69,13 @@ const IngredientsModal: React.FC = () => {
             onChange={(e) => setNewIngredient(e.target.value)}
             onKeyDown={handleKeyDown}
             placeholder="Type an ingredient..."
+            list="ingredient-suggestions"
           />
+          <datalist id="ingredient-suggestions">
+            {suggestions.map(name => (
+              <option key={name} value={name} />
+            ))}
+          </datalist>
           <button onClick={handleAddIngredient}>Add</button>
         </div>
         
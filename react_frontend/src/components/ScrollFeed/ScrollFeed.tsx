@@ -8,9 +8,10 @@ import './ScrollFeed.css';
 interface ScrollFeedProps {
   recipes: Recipe[];
   loading: boolean;
+  onEndReached?: () => void;
 }
 
-const ScrollFeed: React.FC<ScrollFeedProps> = ({ recipes, loading }) => {
+const ScrollFeed: React.FC<ScrollFeedProps> = ({ recipes, loading, onEndReached }) => {
   const [currentIndex, setCurrentIndex] = useState(0);
   const feedRef = useRef<HTMLDivElement>(null);
   
@@ -40,6 +41,13 @@ const ScrollFeed: React.FC<ScrollFeedProps> = ({ recipes, loading }) => {
       feed.removeEventListener('scroll', handleScroll);
     };
   }, []);
+
+  // Ask for the next page while a couple of recipes are still left to scroll through
+  useEffect(() => {
+    if (onEndReached && recipes.length > 0 && currentIndex >= recipes.length - 2) {
+      onEndReached();
+    }
+  }, [currentIndex, recipes.length, onEndReached]);
   
   const handleTouchStart = (e: React.TouchEvent) => {
     const touchStartY = e.touches[0].clientY;
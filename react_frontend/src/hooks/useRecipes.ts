@@ -1,40 +1,47 @@
 //hooks/useRecipes.ts
 
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useCallback } from 'react';
 import { Recipe, FilterSettings } from '../types';
 import { fetchRecipesByIngredients } from '../api/recipeService';
 
 export const useRecipes = (ingredients: string[], filters: FilterSettings) => {
   const [recipes, setRecipes] = useState<Recipe[]>([]);
+  const [nextAfter, setNextAfter] = useState<number | null>(null);
   const [loading, setLoading] = useState<boolean>(false);
   const [error, setError] = useState<string | null>(null);
 
-  useEffect(() => {
-    const loadRecipes = async () => {
-      if (ingredients.length === 0) return;
-      
-      setLoading(true);
-      setError(null);
-      
-      try {
-        // Pass filters directly to the API service
-        const data = await fetchRecipesByIngredients(ingredients, {
-          caloriesMin: filters.caloriesMin,
-          caloriesMax: filters.caloriesMax,
-          mealTypes: filters.mealTypes
-        });
-        
-        setRecipes(data);
-      } catch (err) {
-        setError('Failed to load recipes');
-        console.error(err);
-      } finally {
-        setLoading(false);
-      }
-    };
+  const loadPage = useCallback(async (after: number | null) => {
+    setLoading(true);
+    setError(null);
     
-    loadRecipes();
+    try {
+      // Pass filters directly to the API service
+      const page = await fetchRecipesByIngredients(ingredients, {
+        caloriesMin: filters.caloriesMin,
+        caloriesMax: filters.caloriesMax,
+        mealTypes: filters.mealTypes
+      }, after);
+      
+      setRecipes(previous => after == null ? page.recipes : [...previous, ...page.recipes]);
+      setNextAfter(page.nextAfter);
+    } catch (err) {
+      setError('Failed to load recipes');
+      console.error(err);
+    } finally {
+      setLoading(false);
+    }
   }, [ingredients, filters]);
 
-  return { recipes, loading, error };
+  useEffect(() => {
+    if (ingredients.length === 0) return;
+    loadPage(null);
+  }, [ingredients, filters, loadPage]);
+
+  // Fetches the next page when the feed nears its end
+  const loadMore = useCallback(() => {
+    if (loading || nextAfter == null) return;
+    loadPage(nextAfter);
+  }, [loading, nextAfter, loadPage]);
+
+  return { recipes, loading, error, loadMore };
 };
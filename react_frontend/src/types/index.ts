@@ -12,6 +12,11 @@ export interface Recipe {
   ingredients: Ingredient[];  // proper list, not just strings
 }
 
+export interface RecipePage {
+  recipes: Recipe[];
+  nextAfter: number | null;  // cursor for the next page, null on the last page
+}
+
 export interface Ingredient {
   ingredient_name: string;
   quantity: number;